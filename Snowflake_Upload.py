@@ -1,75 +1,129 @@
-import snowflake.connector
-import os, sys
-from dotenv import load_dotenv
+import argparse, importlib.util, json, os, sys, shutil, tempfile, time
 
-load_dotenv()
+import metrics
+from sf_session import Session, config_from_env
+
+LOAD_MODES = ('full', 'delta', 'flat', 'chunked')
 
 # --- Configuration ---
-SNOWFLAKE_USER = os.getenv('SNOWFLAKE_USER')
-SNOWFLAKE_PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
-SNOWFLAKE_ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
-SNOWFLAKE_WAREHOUSE = os.getenv('SNOWFLAKE_WAREHOUSE')
-SNOWFLAKE_DATABASE = os.getenv('SNOWFLAKE_DATABASE')
-SNOWFLAKE_SCHEMA = os.getenv('SNOWFLAKE_SCHEMA')
-STAGE_NAME = os.getenv('STAGE_NAME', 'BORDER_STAGE')
-TABLE_NAME = os.getenv('TABLE_NAME', 'BRONZE_BORDER')
-
-LOCAL_FILE_PATH = os.getenv('LOCAL_FILE_PATH')
-TRUNCATE_BEFORE_LOAD = os.getenv('TRUNCATE_BEFORE_LOAD', 'true').lower() in ('1', 'true', 'yes')
-
-# --- Validation ---
-required = [
-    ('SNOWFLAKE_USER', SNOWFLAKE_USER),
-    ('SNOWFLAKE_PASSWORD', SNOWFLAKE_PASSWORD),
-    ('SNOWFLAKE_ACCOUNT', SNOWFLAKE_ACCOUNT),
-    ('LOCAL_FILE_PATH', LOCAL_FILE_PATH),
-]
-missing = [name for name, val in required if not val]
-if missing:
-    sys.exit(f"Missing required environment variable(s): {', '.join(missing)}")
+def configure(dotenv=False):
+    """Reads the settings below from the environment; with `dotenv`, a .env file is loaded into it first (main)."""
+    global SNOWFLAKE_USER, SNOWFLAKE_PASSWORD, SNOWFLAKE_ACCOUNT, SNOWFLAKE_WAREHOUSE, SNOWFLAKE_DATABASE, \
+        SNOWFLAKE_SCHEMA, STAGE_NAME, TABLE_NAME, LOCAL_FILE_PATH, TRUNCATE_BEFORE_LOAD, LOAD_MODE, DELTA_TABLE, \
+        DELTA_STATE_PATH, FLAT_TABLE, FLAT_FORMAT, CHUNK_TARGET_MB, ROWS_PER_RECORD, COMPRESS_PROCESSES, \
+        PUT_PARALLEL, KEEP_UNCOMPRESSED, VALIDATE, QUARANTINE_PATH, TRANSFORM_AFTER_LOAD, TRANSFORM_SOURCE, required
+    if dotenv:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+    SNOWFLAKE_USER = os.getenv('SNOWFLAKE_USER')
+    SNOWFLAKE_PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
+    SNOWFLAKE_ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
+    SNOWFLAKE_WAREHOUSE = os.getenv('SNOWFLAKE_WAREHOUSE')
+    SNOWFLAKE_DATABASE = os.getenv('SNOWFLAKE_DATABASE')
+    SNOWFLAKE_SCHEMA = os.getenv('SNOWFLAKE_SCHEMA')
+    STAGE_NAME = os.getenv('STAGE_NAME', 'BORDER_STAGE')
+    TABLE_NAME = os.getenv('TABLE_NAME', 'BRONZE_BORDER')
+
+    LOCAL_FILE_PATH = os.getenv('LOCAL_FILE_PATH')
+    TRUNCATE_BEFORE_LOAD = os.getenv('TRUNCATE_BEFORE_LOAD', 'true').lower() in ('1', 'true', 'yes')
+
+    # LOAD_MODE=delta stages only rows whose fingerprint changed since the last run
+    # and appends them to DELTA_TABLE (one bronze row per source row, see transformations.sql).
+    LOAD_MODE = os.getenv('LOAD_MODE', 'full').lower()
+    DELTA_TABLE = os.getenv('DELTA_TABLE', 'BRONZE_BORDER_ROWS')
+    DELTA_STATE_PATH = os.getenv('DELTA_STATE_PATH') or (LOCAL_FILE_PATH and LOCAL_FILE_PATH + '.fingerprints.gz')
+    # LOAD_MODE=flat casts rows locally into the SILVER_BORDER_FLAT columns and COPYs typed chunks into FLAT_TABLE.
+    FLAT_TABLE = os.getenv('FLAT_TABLE', 'BRONZE_BORDER_TYPED')
+    # Parquet when pyarrow is installed (found without importing it), gzip NDJSON otherwise
+    FLAT_FORMAT = (os.getenv('FLAT_FORMAT') or ('parquet' if importlib.util.find_spec('pyarrow') else 'ndjson')).lower()
+    # LOAD_MODE=chunked splits the rows into ~CHUNK_TARGET_MB compressed parts, gzips them on a process pool,
+    # PUTs them concurrently and loads them with one pattern COPY. Each bronze row holds a {"data": [...]}
+    # slice of ROWS_PER_RECORD rows, so REFRESH_SILVER_FLAT_TASK keeps working unchanged.
+    CHUNK_TARGET_MB = float(os.getenv('CHUNK_TARGET_MB', '150'))
+    ROWS_PER_RECORD = int(os.getenv('ROWS_PER_RECORD', '10000'))
+    COMPRESS_PROCESSES = int(os.getenv('COMPRESS_PROCESSES', '0')) or None
+    PUT_PARALLEL = int(os.getenv('PUT_PARALLEL', '4'))
+    KEEP_UNCOMPRESSED = os.getenv('KEEP_UNCOMPRESSED', 'false').lower() in ('1', 'true', 'yes')
+    # VALIDATE=true checks rows locally before staging (delta, flat and chunked modes; validation.py) and writes
+    # failures with their reasons to QUARANTINE_PATH instead of loading them.
+    VALIDATE = os.getenv('VALIDATE', 'false').lower() in ('1', 'true', 'yes')
+    QUARANTINE_PATH = os.getenv('QUARANTINE_PATH') or (LOCAL_FILE_PATH and LOCAL_FILE_PATH + '.quarantine.ndjson.gz')
+    # TRANSFORM_AFTER_LOAD=true (or --transform) MERGEs the new bronze rows into SILVER_BORDER_FLAT after a successful
+    # full/chunked load (transform.py); TRANSFORM_SOURCE picks how new rows are found (watermark or stream).
+    TRANSFORM_AFTER_LOAD = os.getenv('TRANSFORM_AFTER_LOAD', 'false').lower() in ('1', 'true', 'yes')
+    TRANSFORM_SOURCE = os.getenv('TRANSFORM_SOURCE', 'watermark').lower()
+
+    # --- Validation ---
+    required = [
+        ('SNOWFLAKE_USER', SNOWFLAKE_USER),
+        ('SNOWFLAKE_PASSWORD', SNOWFLAKE_PASSWORD),
+        ('SNOWFLAKE_ACCOUNT', SNOWFLAKE_ACCOUNT),
+        ('LOCAL_FILE_PATH', LOCAL_FILE_PATH),
+    ]
+
+configure()
+
+def check_config():
+    """Exits when required env vars are missing (checked when a load starts, not on import)."""
+    missing = [name for name, val in required if not val]
+    if missing:
+        sys.exit(f"Missing required environment variable(s): {', '.join(missing)}")
+
+def source_rows():
+    """Streams the rows of LOCAL_FILE_PATH, through the validator when VALIDATE is set (`.meta` passes through)."""
+    from json_stream import JsonRowReader
+    from validation import Validator
+    rows = JsonRowReader(LOCAL_FILE_PATH)
+    return Validator(rows, quarantine_path=QUARANTINE_PATH) if VALIDATE else rows
+
+def report_validation(rows):
+    if VALIDATE:
+        print(rows.report())
 
+def open_session(size=4):
+    """Pooled, retrying Snowflake session (sf_session.py); connections open on first use."""
+    return Session(config_from_env(), size=size)
+
+@metrics.timed('border.upload_json_to_snowflake')
 def upload_json_to_snowflake():
-    conn = None
+    session = None
     try:
         # 1. Establish Connection
-        conn = snowflake.connector.connect(
-            user=SNOWFLAKE_USER,
-            password=SNOWFLAKE_PASSWORD,
-            account=SNOWFLAKE_ACCOUNT,
-            warehouse=SNOWFLAKE_WAREHOUSE,
-            database=SNOWFLAKE_DATABASE,
-            schema=SNOWFLAKE_SCHEMA
-        )
-        cur = conn.cursor()
-        print("Connection established successfully.")
+        session = open_session()
 
         # Prepare variables
         local_posix = LOCAL_FILE_PATH.replace('\\', '/')
         filename_clean = os.path.basename(local_posix) # e.g., 'border_crossing_dataset.json'
         fully_qualified_stage = f"{SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.{STAGE_NAME}"
+        # A download kept gzip-compressed (--gzip) is staged as is and COPY decompresses it
+        gzipped = filename_clean.endswith('.gz')
 
         # 2. Cleanup Old Files (Optional but Recommended)
-        # We remove the .gz version to avoid loading the wrong file
-        print(f"\nCleaning up old .gz files for {filename_clean}...")
-        cur.execute(f"REMOVE @{fully_qualified_stage}/{filename_clean}.gz")
+        # We remove the other (.json / .json.gz) version to avoid loading the wrong file
+        other = filename_clean[:-3] if gzipped else filename_clean + '.gz'
+        print(f"\nCleaning up old {other} files...")
+        session.execute(f"REMOVE @{fully_qualified_stage}/{other}")
 
         # 3. Stage the JSON File (PUT command)
-        # We use AUTO_COMPRESS=FALSE to keep it as .json so we can debug easily
+        # We use AUTO_COMPRESS=FALSE to keep it as .json so we can debug easily (or as the .json.gz we downloaded)
         put_uri = f"file://{local_posix}"
         put_command = f"PUT '{put_uri}' @{fully_qualified_stage} AUTO_COMPRESS=FALSE OVERWRITE=TRUE"
         
         print(f"\nExecuting PUT command: {put_command}")
-        cur.execute(put_command)
+        put_result = session.execute(put_command)
         
         # Verify Staging
         print("Staging Results:")
-        for row in cur.fetchall():
+        for row in put_result:
             print(row)
 
         # 4. Truncate Table (Optional)
         if TRUNCATE_BEFORE_LOAD:
             print(f"\nTruncating table {TABLE_NAME}...")
-            cur.execute(f"TRUNCATE TABLE {TABLE_NAME}")
+            session.execute(f"TRUNCATE TABLE {TABLE_NAME}")
 
         # 5. Copy Data (The Critical Fix)
         # STRIP_OUTER_ARRAY = TRUE splits the JSON array into individual rows.
@@ -84,31 +138,259 @@ def upload_json_to_snowflake():
             FROM @{fully_qualified_stage}
         )
         FILES = ('{filename_clean}')
-        FILE_FORMAT = (TYPE = 'JSON' STRIP_OUTER_ARRAY = TRUE)
+        FILE_FORMAT = (TYPE = 'JSON' STRIP_OUTER_ARRAY = TRUE COMPRESSION = '{'GZIP' if gzipped else 'NONE'}')
         ON_ERROR = 'CONTINUE';
         """
         
         print(f"\nExecuting COPY INTO command...")
-        cur.execute(copy_command)
+        rows = session.execute(copy_command)
         
         # Display copy results and check for failures
         print("COPY INTO Results:")
-        rows = cur.fetchall()
+        loaded = bool(rows)
         for row in rows:
             print(row)
             # row[1] is the status column. If it says LOAD_FAILED, we alert the user.
             if row[1] == 'LOAD_FAILED':
                 print(f"!!! CRITICAL ERROR: Load Failed. Reason: {row[6]}")
+                loaded = False
             else:
                 print(f"\nSUCCESS: Data loaded. Rows loaded: {row[3]}")
+        return loaded
         
     except Exception as e:
         print(f"\nAn error occurred: {e}")
         
     finally:
-        if conn:
-            conn.close()
+        if session:
+            print(session.timing_report())
+            session.close()
+            print("\nConnection closed.")
+
+@metrics.timed('border.upload_delta_to_snowflake')
+def upload_delta_to_snowflake():
+    import bulk_load
+    from delta_load import Delta, load_snapshot, commit_snapshot
+    session = None
+    tmp = tempfile.mkdtemp(prefix='border_delta_')
+    try:
+        reader = source_rows()
+        delta = Delta(load_snapshot(DELTA_STATE_PATH))
+        print(f"Previous snapshot: {len(delta.previous)} fingerprints ({DELTA_STATE_PATH})")
+
+        session = open_session()
+
+        # 1. Diff against the snapshot while streaming, staging change records as gzip NDJSON chunks
+        prefix = f"border_delta_{time.strftime('%Y%m%d%H%M%S')}"
+        stage_path = f"{SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.{STAGE_NAME}/delta"
+        chunks = bulk_load.write_chunks(delta.changes(reader), tmp, prefix, rows_per_chunk=250_000)
+        staged = bulk_load.put_chunks(session, chunks, stage_path)
+        report_validation(reader)
+        c = delta.counts
+        print(f"Delta: {c['I']} inserted, {c['U']} updated, {c['D']} deleted, "
+              f"{c['unchanged']} unchanged, {c['skipped']} without a key, {c['duplicates']} duplicate keys (last kept)")
+
+        # 2. Append only the changes (no TRUNCATE: bronze is append-only in delta mode)
+        if staged:
+            copy_command = f"""
+            COPY INTO {DELTA_TABLE} (CONTENT, OP, SOURCE_FILE, INGESTION_TIME)
+            FROM (
+                SELECT
+                    $1:row,
+                    $1:op::STRING,
+                    METADATA$FILENAME,
+                    CURRENT_TIMESTAMP()
+                FROM @{stage_path}
+            )
+            PATTERN = '{bulk_load.pattern_for(prefix, 'ndjson')}'
+            FILE_FORMAT = (TYPE = 'JSON' COMPRESSION = 'GZIP')
+            ON_ERROR = 'ABORT_STATEMENT';
+            """
+            print(f"\nExecuting COPY INTO {DELTA_TABLE} ({staged} change records)...")
+            loaded = bulk_load.rows_loaded(session.execute(copy_command))
+            print(f"SUCCESS: {loaded} change records appended.")
+            session.execute(f"REMOVE @{stage_path} PATTERN = '{bulk_load.pattern_for(prefix, 'ndjson')}'")
+        else:
+            print("No changes since the last run; nothing to load.")
+
+        # 3. Only now that the load succeeded does the new snapshot become the baseline
+        commit_snapshot(DELTA_STATE_PATH, delta.current)
+
+    except Exception as e:
+        print(f"\nAn error occurred: {e}")
+
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if session:
+            print(session.timing_report())
+            session.close()
+            print("\nConnection closed.")
+
+@metrics.timed('border.upload_flat_to_snowflake')
+def upload_flat_to_snowflake():
+    import border_flat, bulk_load
+    session = None
+    tmp = tempfile.mkdtemp(prefix='border_flat_')
+    try:
+        session = open_session()
+        flattener = border_flat.Flattener()
+        prefix = f"border_flat_{time.strftime('%Y%m%d%H%M%S')}"
+        stage_path = f"{SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.{STAGE_NAME}/flat"
+
+        # 1. Stream -> typed columnar chunks -> parallel PUT (chunks are staged while later ones are written)
+        source = source_rows()
+        rows = flattener.rows(source)
+        chunks = border_flat.write_flat_chunks(rows, tmp, prefix, fmt=FLAT_FORMAT)
+        staged = bulk_load.put_chunks(session, chunks, stage_path)
+        report_validation(source)
+        c = flattener.counts
+        print(f"Flattened {c['rows']} rows ({c['skipped']} without a port code skipped, "
+              f"{c['rejected']} values that did not cast set to NULL)")
+
+        if TRUNCATE_BEFORE_LOAD:
+            print(f"\nTruncating table {FLAT_TABLE}...")
+            session.execute(f"TRUNCATE TABLE {FLAT_TABLE}")
+
+        # 2. One COPY straight into typed columns
+        pattern = bulk_load.pattern_for(prefix, FLAT_FORMAT)
+        print(f"\nExecuting COPY INTO {FLAT_TABLE} ({staged} rows, {FLAT_FORMAT})...")
+        loaded = bulk_load.rows_loaded(session.execute(border_flat.copy_sql(FLAT_TABLE, stage_path, FLAT_FORMAT, pattern)))
+        print(f"SUCCESS: Data loaded. Rows loaded: {loaded}")
+        metrics.incr('rows', loaded, stage='border.upload_flat_to_snowflake')
+        session.execute(f"REMOVE @{stage_path} PATTERN = '{pattern}'")
+
+    except Exception as e:
+        print(f"\nAn error occurred: {e}")
+        raise
+
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if session:
+            print(session.timing_report())
+            session.close()
             print("\nConnection closed.")
 
+def data_records(rows, rows_per_record):
+    """Groups rows into serialized {"data": [...]} objects, each well below the 16 MB VARIANT limit."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= rows_per_record:
+            yield json.dumps({'data': batch}, separators=(',', ':'))
+            batch = []
+    if batch:
+        yield json.dumps({'data': batch}, separators=(',', ':'))
+
+@metrics.timed('border.upload_chunked_to_snowflake')
+def upload_chunked_to_snowflake():
+    import bulk_load
+    session = None
+    tmp = tempfile.mkdtemp(prefix='border_chunks_')
+    try:
+        session = open_session(size=max(PUT_PARALLEL, 1))
+        prefix = f"border_chunk_{time.strftime('%Y%m%d%H%M%S')}"
+        stage_path = f"{SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.{STAGE_NAME}/chunks"
+
+        # 1. Split into size-targeted parts, gzip on a process pool, PUT each part as soon as it is ready
+        sizer = bulk_load.ChunkSizer(CHUNK_TARGET_MB * 2**20)
+        source = source_rows()
+        records = data_records(source, ROWS_PER_RECORD)
+        parts = bulk_load.write_parts(records, tmp, prefix, sizer.raw_target if not KEEP_UNCOMPRESSED
+                                      else int(CHUNK_TARGET_MB * 2**20))
+        started = time.perf_counter()
+        stats = bulk_load.compress_and_put(session, parts, stage_path, processes=COMPRESS_PROCESSES,
+                                           parallel=PUT_PARALLEL, compress=not KEEP_UNCOMPRESSED,
+                                           keep_local=KEEP_UNCOMPRESSED, sizer=sizer)
+        report_validation(source)
+        print(f"Staged {stats['files']} files ({stats['records']} records): {stats['raw_bytes'] / 2**20:.1f} MB raw -> "
+              f"{stats['staged_bytes'] / 2**20:.1f} MB sent in {time.perf_counter() - started:.1f}s")
+        if KEEP_UNCOMPRESSED:
+            print(f"Uncompressed parts kept in {tmp}")
+
+        if TRUNCATE_BEFORE_LOAD:
+            print(f"\nTruncating table {TABLE_NAME}...")
+            session.execute(f"TRUNCATE TABLE {TABLE_NAME}")
+
+        # 2. One COPY over every part: the warehouse loads the files in parallel
+        ext = '.ndjson' if KEEP_UNCOMPRESSED else '.ndjson.gz'
+        pattern = bulk_load.pattern_for(prefix, ext=ext)
+        copy_command = f"""
+        COPY INTO {TABLE_NAME} (CONTENT, SOURCE_FILE, INGESTION_TIME)
+        FROM (
+            SELECT
+                $1,
+                METADATA$FILENAME,
+                CURRENT_TIMESTAMP()
+            FROM @{stage_path}
+        )
+        PATTERN = '{pattern}'
+        FILE_FORMAT = (TYPE = 'JSON' COMPRESSION = '{'NONE' if KEEP_UNCOMPRESSED else 'GZIP'}')
+        ON_ERROR = 'ABORT_STATEMENT';
+        """
+        print(f"\nExecuting COPY INTO {TABLE_NAME} (PATTERN = '{pattern}')...")
+        loaded = bulk_load.rows_loaded(session.execute(copy_command))
+        print(f"SUCCESS: Data loaded. Records loaded: {loaded}")
+        session.execute(f"REMOVE @{stage_path} PATTERN = '{pattern}'")
+        return loaded
+
+    except Exception as e:
+        print(f"\nAn error occurred: {e}")
+
+    finally:
+        if not KEEP_UNCOMPRESSED:
+            shutil.rmtree(tmp, ignore_errors=True)
+        if session:
+            print(session.timing_report())
+            session.close()
+            print("\nConnection closed.")
+
+def run_transform():
+    """Incremental bronze -> silver MERGE right after the load (see transform.py)."""
+    import transform
+    try:
+        entry = transform.run(TRANSFORM_SOURCE)
+    except Exception as e:
+        print(f"\nTransform failed (recorded in {transform.HISTORY_PATH}): {e}")
+        return
+    print(transform.report(entry))
+
+def main(argv=None):
+    configure(dotenv=True)
+    p = argparse.ArgumentParser(prog='load-border', description='Load the downloaded border rows.json (LOCAL_FILE_PATH) into Snowflake')
+    p.add_argument('--mode', choices=LOAD_MODES, default=LOAD_MODE if LOAD_MODE in LOAD_MODES else 'full',
+                   help='full: whole file as one VARIANT; delta: changed rows only; flat: typed columns; chunked: gzip parts')
+    p.add_argument('--transform', action='store_true', default=TRANSFORM_AFTER_LOAD,
+                   help='full/chunked: MERGE the new bronze rows into SILVER_BORDER_FLAT after a successful load (transform.py)')
+    p.add_argument('--dry-run', action='store_true', help='Check the configuration and print the load plan, then exit')
+    args = p.parse_args(argv)
+    check_config()
+    if args.transform and args.mode not in ('full', 'chunked'):
+        print(f"--transform applies to full and chunked loads into {TABLE_NAME}; ignored for {args.mode} mode")
+        args.transform = False
+    if args.dry_run:
+        size = os.path.getsize(LOCAL_FILE_PATH) if os.path.exists(LOCAL_FILE_PATH) else None
+        table = {'delta': DELTA_TABLE, 'flat': FLAT_TABLE}.get(args.mode, TABLE_NAME)
+        print(f"Dry run: {args.mode} load of {LOCAL_FILE_PATH} "
+              f"({f'{size / 2**20:.1f} MB' if size is not None else 'missing'})")
+        print(f"  into {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.{table} via @{STAGE_NAME}"
+              + (', truncating first' if TRUNCATE_BEFORE_LOAD and args.mode in ('full', 'flat', 'chunked') else ''))
+        if VALIDATE and args.mode != 'full':
+            print(f"  validation on, quarantine: {QUARANTINE_PATH}")
+        if args.transform:
+            print(f"  then: incremental MERGE into SILVER_BORDER_FLAT ({TRANSFORM_SOURCE})")
+        return 0
+    loaded = False
+    if args.mode == 'delta':
+        upload_delta_to_snowflake()
+    elif args.mode == 'flat':
+        upload_flat_to_snowflake()
+    elif args.mode == 'chunked':
+        loaded = upload_chunked_to_snowflake()
+    else:
+        loaded = upload_json_to_snowflake()
+    if args.transform and loaded:
+        run_transform()
+
+
 if __name__ == "__main__":
-    upload_json_to_snowflake()
\ No newline at end of file
+    main()
@@ -1,158 +1,300 @@
-import requests
+import argparse
 import os
 import sys
-from spotipy.oauth2 import SpotifyOAuth
-import snowflake.connector
 import json
-import boto3
-from dotenv import load_dotenv
+import time
 import concurrent.futures
 
+from sf_session import Session, config_from_env
+import metrics
 
-load_dotenv()
-
-# Configuration
-SNOWFLAKE_USER = os.getenv('SNOWFLAKE_USER')
-SNOWFLAKE_PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
-SNOWFLAKE_ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
-SNOWFLAKE_WAREHOUSE = os.getenv('SNOWFLAKE_WAREHOUSE')
 SNOWFLAKE_DATABASE = 'ELT_PROJECT'
 SNOWFLAKE_SCHEMA = 'SPOTIFY'
 STAGE_NAME = 'SPOTIFY_STAGE'
 TABLE_NAME = 'BRONZE_SP_ALL_ITEMS'
-TRUNCATE_BEFORE_LOAD = os.getenv('TRUNCATE_BEFORE_LOAD', 'false').lower() in ('1', 'true', 'yes')
-
-client_id = os.getenv('SP_CREDS_CLIENT_ID')
-client_secret = os.getenv('SP_CREDS_CLIENT_SECRET')
-username = os.getenv('SP_CREDS_USERNAME')
 scope = "user-library-read"
-redirect_uri = os.getenv('SPOTIPY_REDIRECT_URI', "http://127.0.0.1:8888/callback")
-
-aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
-aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-bucket_name = os.getenv('S3_BUCKET_NAME', 's3numerone')
-project_dir = os.getenv('PROJECT_DIR', 'project_sp_yt/')
-
-sp_oauth = SpotifyOAuth(
-    client_id=client_id,
-    client_secret=client_secret,
-    redirect_uri=redirect_uri,
-    scope=scope
-)
-
-# Authentication
-token_info = sp_oauth.get_access_token(as_dict=True)
-access_token = token_info['access_token']
-print(access_token)
-headers = {
-    'Authorization': f'Bearer {access_token}'
-}
-response = requests.get('https://api.spotify.com/v1/me/tracks', headers=headers).json()
-total = response['total']
-print(f"Total tracks: {total}")
-
-def fetch_all_tracks(total, headers):
+
+# Configuration
+def configure(dotenv=False):
+    """Reads the settings below from the environment; with `dotenv`, a .env file is loaded into it first (main)."""
+    global SNOWFLAKE_USER, SNOWFLAKE_PASSWORD, SNOWFLAKE_ACCOUNT, SNOWFLAKE_WAREHOUSE, TRUNCATE_BEFORE_LOAD, \
+        ARTIST_CACHE_PATH, ARTIST_CACHE_TTL, SYNC_MODE, SYNC_STATE_PATH, FULL_SYNC_DAYS, SPOTIFY_PROJECTION, \
+        client_id, client_secret, username, redirect_uri, aws_access_key_id, aws_secret_access_key, bucket_name, \
+        project_dir, SPOTIFY_OUTPUT, S3_STAGE_NAME, UPLOAD_REPORT_PATH, REQUIRED
+    if dotenv:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+    SNOWFLAKE_USER = os.getenv('SNOWFLAKE_USER')
+    SNOWFLAKE_PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
+    SNOWFLAKE_ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
+    SNOWFLAKE_WAREHOUSE = os.getenv('SNOWFLAKE_WAREHOUSE')
+    TRUNCATE_BEFORE_LOAD = os.getenv('TRUNCATE_BEFORE_LOAD', 'false').lower() in ('1', 'true', 'yes')
+    ARTIST_CACHE_PATH = os.getenv('ARTIST_CACHE_PATH', 'artist_cache.sqlite')
+    ARTIST_CACHE_TTL = float(os.getenv('ARTIST_CACHE_TTL_DAYS', '7')) * 24 * 3600
+    # SYNC_MODE=incremental (default) pages newest-first only until the stored added_at
+    # watermark and appends; a full reload (with TRUNCATE) runs every FULL_SYNC_DAYS to pick up removals.
+    SYNC_MODE = os.getenv('SYNC_MODE', 'incremental').lower()
+    SYNC_STATE_PATH = os.getenv('SYNC_STATE_PATH', 'spotify_sync_state.json')
+    FULL_SYNC_DAYS = float(os.getenv('FULL_SYNC_DAYS', '7'))
+    # Keep/drop JSON paths applied to every saved-track item as pages arrive (projection.py); a JSON spec file,
+    # the built-in default (drops markets, images, external URLs) when unset, or 'none' to keep full items.
+    SPOTIFY_PROJECTION = os.getenv('SPOTIFY_PROJECTION', '')
+
+    client_id = os.getenv('SP_CREDS_CLIENT_ID')
+    client_secret = os.getenv('SP_CREDS_CLIENT_SECRET')
+    username = os.getenv('SP_CREDS_USERNAME')
+    redirect_uri = os.getenv('SPOTIPY_REDIRECT_URI', "http://127.0.0.1:8888/callback")
+
+    aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
+    aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
+    bucket_name = os.getenv('S3_BUCKET_NAME', 's3numerone')
+    project_dir = os.getenv('PROJECT_DIR', 'project_sp_yt/')
+    # SPOTIFY_OUTPUT=s3 streams both payloads as gzip NDJSON to s3://<bucket>/<project_dir> (multipart, no local
+    # files) and loads them from the external stage S3_STAGE_NAME; the default 'stage' writes local files and PUTs them.
+    SPOTIFY_OUTPUT = os.getenv('SPOTIFY_OUTPUT', 'stage').lower()
+    S3_STAGE_NAME = os.getenv('S3_STAGE_NAME', 'SPOTIFY_S3_STAGE')
+    UPLOAD_REPORT_PATH = os.getenv('UPLOAD_REPORT_PATH', 'spotify_upload_report.json')
+
+    REQUIRED = [('SP_CREDS_CLIENT_ID', client_id), ('SP_CREDS_CLIENT_SECRET', client_secret),
+                ('SNOWFLAKE_USER', SNOWFLAKE_USER), ('SNOWFLAKE_PASSWORD', SNOWFLAKE_PASSWORD),
+                ('SNOWFLAKE_ACCOUNT', SNOWFLAKE_ACCOUNT)]
+
+configure()
+
+def check_config():
+    """Exits when required env vars are missing (checked when a sync starts, not on import)."""
+    missing = [name for name, val in REQUIRED if not val]
+    if missing:
+        sys.exit(f"Missing required environment variable(s): {', '.join(missing)}")
+
+def authenticate():
+    """Runs the Spotify OAuth flow (cached token or browser login) and returns the API request headers."""
+    from spotipy.oauth2 import SpotifyOAuth
+    sp_oauth = SpotifyOAuth(
+        client_id=client_id,
+        client_secret=client_secret,
+        redirect_uri=redirect_uri,
+        scope=scope
+    )
+    token_info = sp_oauth.get_access_token(as_dict=True)
+    return {
+        'Authorization': f"Bearer {token_info['access_token']}"
+    }
+
+def make_projector(spec_path=None):
+    import projection
+    spec_path = SPOTIFY_PROJECTION if spec_path is None else spec_path
+    if spec_path.lower() == 'none':
+        return None
+    return projection.Projector(projection.load_spec(spec_path))
+
+def report_projection(projector):
+    if projector and projector.items:
+        print(projector.report())
+        metrics.incr('bytes', projector.bytes_in, stage='projection_in')
+        metrics.incr('bytes', projector.bytes_out, stage='projection_out')
+
+@metrics.timed('fetch_all_tracks')
+def fetch_all_tracks(total, headers, projector=None):
     all_items = []
-    limit = 20
     if total == 0:
         print("No tracks to fetch.")
         return all_items
 
-    def fetch_page(offset):
-        url = f"https://api.spotify.com/v1/me/tracks?offset={offset}&limit={limit}"
-        resp = requests.get(url, headers=headers)
-        if resp.status_code == 200:
-            data = resp.json()
-            return data.get('items', [])
-        else:
-            print(f"Error fetching at offset {offset}: {resp.status_code}")
-            return []
-
-    offsets = list(range(0, total, limit))
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(fetch_page, offset) for offset in offsets]
-        for future in concurrent.futures.as_completed(futures):
-            all_items.extend(future.result())
-
-    print(f"Fetched {len(all_items)} tracks.")
+    # Max page size, rate limited and retried; every offset is fetched exactly once or we fail loudly.
+    from spotify_api import SpotifyClient, MAX_PAGE  # requests-backed; imported when the first call is made
+    client = SpotifyClient(headers)
+    all_items = client.fetch_pages('/me/tracks', total, limit=MAX_PAGE, transform=projector)
+    report_projection(projector)
+
+    metrics.incr('rows', len(all_items), stage='fetch_all_tracks')
+    stats = client.stats
+    print(f"Fetched {len(all_items)} tracks ({stats['requests']} requests, "
+          f"{stats['throttled']} throttled, {stats['retries']} retries).")
     return all_items
 
+def load_sync_state(path=None):
+    try:
+        with open(path or SYNC_STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_sync_state(state, path=None):
+    path = path or SYNC_STATE_PATH
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+def needs_full_sync(state):
+    if SYNC_MODE == 'full' or not state.get('watermark'):
+        return True
+    return time.time() - state.get('last_full_sync', 0) > FULL_SYNC_DAYS * 24 * 3600
+
+def fetch_total_tracks(headers):
+    from spotify_api import SpotifyClient
+    total = SpotifyClient(headers).get('https://api.spotify.com/v1/me/tracks', params={'limit': 1})['total']
+    print(f"Total tracks: {total}")
+    return total
+
+def fetch_new_tracks(headers, state, projector=None):
+    """Pages /me/tracks (newest first) until it reaches items at or before the stored watermark."""
+    watermark = state['watermark']
+    seen_at_watermark = set(state.get('ids_at_watermark', []))
+    from spotify_api import SpotifyClient, MAX_PAGE
+    client = SpotifyClient(headers)
+    new_items, offset = [], 0
+    while True:
+        page = client.get('https://api.spotify.com/v1/me/tracks', params={'offset': offset, 'limit': MAX_PAGE})
+        items = page.get('items', [])
+        for item in items:
+            added_at = item.get('added_at') or ''
+            track_id = (item.get('track') or {}).get('id')
+            if added_at < watermark:
+                print(f"Fetched {len(new_items)} new tracks since {watermark} ({client.stats['requests']} requests).")
+                report_projection(projector)
+                return new_items
+            if added_at == watermark and track_id in seen_at_watermark:
+                continue
+            new_items.append(projector(item) if projector else item)
+        offset += len(items)
+        if not items or offset >= page.get('total', 0):
+            print(f"Fetched {len(new_items)} new tracks since {watermark} ({client.stats['requests']} requests).")
+            report_projection(projector)
+            return new_items
+
+def advance_sync_state(state, items, artist_ids, full):
+    """New state after a successful load: watermark = newest added_at, plus the ids sharing it."""
+    state = dict(state)
+    if full:
+        state['last_full_sync'] = time.time()
+        state['artist_ids'] = sorted(artist_ids)
+    else:
+        state['artist_ids'] = sorted(set(state.get('artist_ids', [])) | set(artist_ids))
+    if items:
+        newest = max(item.get('added_at') or '' for item in items)
+        ids = [(i.get('track') or {}).get('id') for i in items if i.get('added_at') == newest]
+        if not full and newest == state.get('watermark'):
+            ids += state.get('ids_at_watermark', [])
+        state['watermark'], state['ids_at_watermark'] = newest, sorted(set(filter(None, ids)))
+    return state
+
 def fetch_artist_list_exploded(all_items):
     artists_by_id = {}
     for item in all_items:
         track = item.get('track', {})
         for artist in track.get('album', {}).get('artists', []):
-            artists_by_id[artist['id']] = artist['name']
+            artists_by_id[artist['id']] = artist.get('name')
     artist_list_exploded = list(artists_by_id.keys())
     print(f"Extracted {len(artist_list_exploded)} unique artists.")
     return artist_list_exploded
 
-def fetch_genre_by_artists(artist_list_exploded, headers):
+@metrics.timed('fetch_genre_by_artists')
+def fetch_genre_by_artists(artist_list_exploded, headers, cache_path=None, ttl=None):
+    from artist_cache import ArtistCache
     genre_by_artists = []
-    url2 = "https://api.spotify.com/v1/artists/"
-
-    def fetch_artist(artist_id):
-        genre_url = f"{url2}{artist_id}"
-        try:
-            response2 = requests.get(genre_url, headers=headers)
-            if response2.status_code == 200:
-                artist = response2.json()
-                return {
-                    'id': artist_id,
-                    'name': artist.get('name', None),
-                    'genres': artist.get('genres', [])
-                }
-            else:
-                return {
-                    'id': artist_id,
-                    'name': None,
-                    'genres': []
-                }
-        except Exception as e:
-            print(f"Error fetching artist {artist_id}: {e}")
-            return {
-                'id': artist_id,
-                'name': None,
-                'genres': []
-            }
 
     total_artists = len(artist_list_exploded)
     if total_artists == 0:
         print("No artists to fetch genres for.")
         return genre_by_artists
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(fetch_artist, artist_id) for artist_id in artist_list_exploded]
-        for idx, future in enumerate(concurrent.futures.as_completed(futures), start=1):
-            genre_by_artists.append(future.result())
-            if idx % 5 == 0 or idx == total_artists:
-                percent = int(idx / total_artists * 100)
-                sys.stdout.write(f'\rFetching genres: {idx}/{total_artists} ({percent}%)')
-                sys.stdout.flush()
-    sys.stdout.write('\n')
+    # Fresh entries come from the local cache; the rest go through /v1/artists?ids= in batches of 50.
+    cache = ArtistCache(cache_path or ARTIST_CACHE_PATH, ttl=ARTIST_CACHE_TTL if ttl is None else ttl)
+    try:
+        cached, missing = cache.get_many(artist_list_exploded)
+        fetched = {}
+        if missing:
+            from spotify_api import SpotifyClient, SpotifyAPIError
+            client = SpotifyClient(headers)
+            failed = 0
+            for batch, artists in client.iter_by_ids('/artists', missing, key='artists'):
+                if isinstance(artists, SpotifyAPIError):
+                    # Left uncached (retried next run); the output falls back to no name/genres
+                    failed += len(batch)
+                    print(f"Artist lookup failed for {len(batch)} artists: {artists}", file=sys.stderr)
+                    continue
+                # Ids the API answers with null are cached too (no name, no genres) so they expire
+                # with the same TTL instead of being requested again on every run.
+                entries = [{
+                    'id': artist_id,
+                    'name': (artist or {}).get('name', None),
+                    'genres': (artist or {}).get('genres', [])
+                } for artist_id, artist in zip(batch, artists)]
+                cache.put_many(entries)
+                fetched.update((e['id'], e) for e in entries)
+            metrics.incr('artist_lookup_failed', failed)
+            print(f"Artist lookups: {client.stats['requests']} requests for {len(missing)} artists"
+                  + (f", {failed} failed." if failed else "."))
+        stats = cache.stats
+        for name in ('hits', 'misses', 'expired'):
+            metrics.incr(f'artist_cache_{name}', stats[name])
+        print(f"Artist cache: {stats['hits']} hits, {stats['misses']} misses ({stats['expired']} expired).")
+    finally:
+        cache.close()
+
+    for artist_id in artist_list_exploded:
+        genre_by_artists.append(cached.get(artist_id) or fetched.get(artist_id) or {
+            'id': artist_id,
+            'name': None,
+            'genres': []
+        })
     return genre_by_artists
 
-def upload_json_to_snowflake(all_items, genre_by_artists, stage_name):
-    conn = None
-    try:
-        conn = snowflake.connector.connect(
-            user=SNOWFLAKE_USER,
-            password=SNOWFLAKE_PASSWORD,
-            account=SNOWFLAKE_ACCOUNT,
-            warehouse=SNOWFLAKE_WAREHOUSE,
-            database=SNOWFLAKE_DATABASE,
-            schema=SNOWFLAKE_SCHEMA
+def load_tables(session, sources, file_format, truncate=True):
+    """COPYs {target_table: stage location} concurrently (one pooled connection each). Returns True unless a load failed."""
+    def load_table(target_table, location):
+        if truncate:
+            print(f"Truncating target table {target_table}...")
+            session.execute(f"TRUNCATE TABLE {target_table}")
+
+        copy_cmd = f"""
+        COPY INTO {target_table} (item_data, load_timestamp)
+        FROM (
+            SELECT $1, CURRENT_TIMESTAMP()
+            FROM @{location}
         )
-        cur = conn.cursor()
-        print("Connection established successfully.")
+        FILE_FORMAT = ({file_format})
+        ON_ERROR = 'CONTINUE';
+        """
+        print(f"Executing COPY INTO {target_table} from @{location}...")
+        return target_table, session.execute(copy_cmd)
+
+    ok = True
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        loads = [executor.submit(load_table, t, loc) for t, loc in sources.items()]
+        for future in loads:
+            target_table, result = future.result()
+            for row in result:
+                status = row[1] if len(row) > 1 else row[0]
+                rows_loaded = row[3] if len(row) > 3 else None
+                print(f" -> {target_table}: {status}, rows_loaded={rows_loaded}")
+                if status == 'LOAD_FAILED':
+                    ok = False
+    return ok
+
+@metrics.timed('spotify.upload_json_to_snowflake')
+def upload_json_to_snowflake(all_items, genre_by_artists, stage_name, truncate=True):
+    """Stages and loads both payloads. truncate=False appends (incremental sync). Returns True on success."""
+    import s3_stage
+    session = None
+    try:
+        # Pooled session (sf_session.py): the two PUTs and the two table loads run on separate connections.
+        session = Session(config_from_env(database=SNOWFLAKE_DATABASE, schema=SNOWFLAKE_SCHEMA), size=2)
+        started = time.perf_counter()
 
         ALL_ITEMS_FILE = "all_items.json"
         GENRE_BY_ARTISTS_FILE = "genre_by_artists.json"
 
+        # Compact separators: indentation only added bytes to serialize, PUT and COPY
         with open(ALL_ITEMS_FILE, "w", encoding="utf-8") as f:
-            json.dump(all_items, f, indent=2)
+            json.dump(all_items, f, separators=(',', ':'))
         with open(GENRE_BY_ARTISTS_FILE, "w", encoding="utf-8") as f:
-            json.dump(genre_by_artists, f, indent=2)
+            json.dump(genre_by_artists, f, separators=(',', ':'))
 
         fully_qualified_stage = f"{SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.{stage_name}"
 
@@ -161,47 +303,107 @@ def upload_json_to_snowflake(all_items, genre_by_artists, stage_name):
             GENRE_BY_ARTISTS_FILE: "BRONZE_SP_ARTIST_GENRE"
         }
 
-        for local_file, target_table in file_mapping.items():
+        put_commands = []
+        for local_file in file_mapping:
             local_posix = os.path.abspath(local_file).replace("\\", "/")
-            filename_clean = os.path.basename(local_posix)
-
-            put_command = f"PUT 'file://{local_posix}' @{fully_qualified_stage} AUTO_COMPRESS=FALSE OVERWRITE=TRUE"
-            print(f"Uploading {filename_clean} to stage {fully_qualified_stage}...")
-            cur.execute(put_command)
-            for row in cur.fetchall():
+            put_commands.append(f"PUT 'file://{local_posix}' @{fully_qualified_stage} AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+        print(f"Uploading {', '.join(file_mapping)} to stage {fully_qualified_stage}...")
+        for result in session.run_parallel(put_commands):
+            for row in result:
                 print(row)
+        s3_stage.record_report(UPLOAD_REPORT_PATH, 'stage', sum(os.path.getsize(f) for f in file_mapping),
+                               time.perf_counter() - started)
 
-            # Always truncate before load
-            print(f"Truncating target table {target_table}...")
-            cur.execute(f"TRUNCATE TABLE {target_table}")
-
-            copy_cmd = f"""
-            COPY INTO {target_table} (item_data, load_timestamp)
-            FROM (
-                SELECT $1, CURRENT_TIMESTAMP()
-                FROM @{fully_qualified_stage}/{filename_clean}
-            )
-            FILE_FORMAT = (TYPE = 'JSON' STRIP_OUTER_ARRAY = TRUE)
-            ON_ERROR = 'CONTINUE';
-            """
-            print(f"Executing COPY INTO {target_table} from {filename_clean}...")
-            cur.execute(copy_cmd)
-            result = cur.fetchall()
-            for row in result:
-                status = row[1] if len(row) > 1 else row[0]
-                rows_loaded = row[3] if len(row) > 3 else None
-                print(f" -> {status}, rows_loaded={rows_loaded}")
+        sources = {t: f"{fully_qualified_stage}/{f}" for f, t in file_mapping.items()}
+        return load_tables(session, sources, "TYPE = 'JSON' STRIP_OUTER_ARRAY = TRUE", truncate)
 
     except Exception as e:
         print(f"CRITICAL ERROR: {e}")
+        return False
     finally:
-        if conn:
-            conn.close()
+        if session:
+            print(session.timing_report())
+            session.close()
             print("Connection closed.")
 
-if __name__ == "__main__":
-    all_items = fetch_all_tracks(total, headers)
+@metrics.timed('spotify.upload_via_s3')
+def upload_via_s3(all_items, genre_by_artists, truncate=True):
+    """Streams both payloads to S3 as gzip NDJSON (concurrent multipart, no local files), then COPYs them
+    from the external stage S3_STAGE_NAME (URL = 's3://<bucket>/<project_dir>'). Returns True on success."""
+    import s3_stage
+    session = None
+    try:
+        session = Session(config_from_env(database=SNOWFLAKE_DATABASE, schema=SNOWFLAKE_SCHEMA), size=2)
+        client = s3_stage.make_client()
+        run = time.strftime('%Y%m%d%H%M%S')
+        payloads = {"BRONZE_SP_ALL_ITEMS": ("all_items", all_items),
+                    "BRONZE_SP_ARTIST_GENRE": ("genre_by_artists", genre_by_artists)}
+
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+            uploads = {t: executor.submit(s3_stage.upload_ndjson, client, bucket_name,
+                                          f"{project_dir}{run}/{name}.ndjson.gz", records)
+                       for t, (name, records) in payloads.items()}
+            uploads = {t: f.result() for t, f in uploads.items()}
+        sent = sum(u['bytes'] for u in uploads.values())
+        for t, u in uploads.items():
+            print(f"s3://{bucket_name}/{u['key']}: {u['records']} records, {u['raw_bytes']} -> {u['bytes']} bytes "
+                  f"in {u['parts']} parts")
+        s3_stage.record_report(UPLOAD_REPORT_PATH, 's3', sent, time.perf_counter() - started)
+
+        fully_qualified_stage = f"{SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.{S3_STAGE_NAME}"
+        # The stage URL already ends in project_dir; COPY paths are relative to it.
+        sources = {t: f"{fully_qualified_stage}/{u['key'][len(project_dir):]}" for t, u in uploads.items()}
+        return load_tables(session, sources, "TYPE = 'JSON' COMPRESSION = 'GZIP'", truncate)
+
+    except Exception as e:
+        print(f"CRITICAL ERROR: {e}")
+        return False
+    finally:
+        if session:
+            print(session.timing_report())
+            session.close()
+            print("Connection closed.")
+
+def upload_payloads(all_items, genre_by_artists, truncate=True):
+    if SPOTIFY_OUTPUT == 's3':
+        return upload_via_s3(all_items, genre_by_artists, truncate=truncate)
+    return upload_json_to_snowflake(all_items, genre_by_artists, STAGE_NAME, truncate=truncate)
+
+def main(argv=None):
+    configure(dotenv=True)
+    p = argparse.ArgumentParser(prog='spotify', description='Sync Spotify saved tracks and artist genres into Snowflake')
+    p.add_argument('--dry-run', action='store_true', help='Check the configuration and print the sync plan, then exit (no auth, no network)')
+    args = p.parse_args(argv)
+    check_config()
+    state = load_sync_state()
+    full = needs_full_sync(state)
+    if args.dry_run:
+        print(f"Dry run: {'full' if full else 'incremental'} sync into {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}"
+              + (f" (watermark {state['watermark']})" if not full else ''))
+        print(f"  output: {SPOTIFY_OUTPUT} ({S3_STAGE_NAME if SPOTIFY_OUTPUT == 's3' else STAGE_NAME}), "
+              f"projection: {SPOTIFY_PROJECTION or 'default'}, artist cache: {ARTIST_CACHE_PATH}")
+        return 0
+
+    headers = authenticate()
+    projector = make_projector()
+    if full:
+        print("Full sync (reloading all saved tracks).")
+        all_items = fetch_all_tracks(fetch_total_tracks(headers), headers, projector)
+    else:
+        all_items = fetch_new_tracks(headers, state, projector)
     artist_list_exploded = fetch_artist_list_exploded(all_items)
-    genre_data = fetch_genre_by_artists(artist_list_exploded, headers)
-    upload_json_to_snowflake(all_items, genre_data, STAGE_NAME)
-    print("PIPELINE COMPLETE.")
\ No newline at end of file
+    if not full:
+        known = set(state.get('artist_ids', []))
+        artist_list_exploded = [a for a in artist_list_exploded if a not in known]
+    if full or all_items:
+        genre_data = fetch_genre_by_artists(artist_list_exploded, headers)
+        if upload_payloads(all_items, genre_data, truncate=full):
+            save_sync_state(advance_sync_state(state, all_items, artist_list_exploded, full))
+    else:
+        print("No new saved tracks since the last sync.")
+    print("PIPELINE COMPLETE.")
+
+
+if __name__ == "__main__":
+    main()
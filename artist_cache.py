@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+artist_cache.py
+
+On-disk (SQLite) cache of Spotify artist lookups keyed by artist id, with a
+TTL, so repeat runs of Spotify_To_Snowflake.py only fetch new or expired
+artists. Unknown ids are stored as negative entries (no name, empty genres)
+and expire like any other. Hit/miss/expired counts are kept on `cache.stats`.
+"""
+
+import json, sqlite3, threading, time
+
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+class ArtistCache:
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS artists (id TEXT PRIMARY KEY, payload TEXT NOT NULL, fetched_at REAL NOT NULL)")
+
+    def get_many(self, ids):
+        """Returns ({id: artist} for fresh entries, [ids to fetch])."""
+        found, now = {}, time.time()
+        ids = list(ids)
+        with self.lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                q = f"SELECT id, payload, fetched_at FROM artists WHERE id IN ({','.join('?' * len(part))})"
+                for artist_id, payload, fetched_at in self.conn.execute(q, part):
+                    if now - fetched_at <= self.ttl:
+                        found[artist_id] = json.loads(payload)
+                    else:
+                        self.stats['expired'] += 1
+        missing = [i for i in ids if i not in found]
+        self.stats['hits'] += len(found)
+        self.stats['misses'] += len(missing)
+        return found, missing
+
+    def put_many(self, artists):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO artists (id, payload, fetched_at) VALUES (?, ?, ?)",
+                                  [(a['id'], json.dumps(a), now) for a in artists])
+
+    def close(self):
+        self.conn.close()
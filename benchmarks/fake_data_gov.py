@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+fake_data_gov.py
+
+Local stand-in for catalog.data.gov used by the offline benchmarks:
+
+  GET /dataset/<slug>                       HTML page linking the rows.json file
+  GET /api/3/action/package_show?id=<slug>  CKAN response listing the resource
+  GET /api/3/action/package_search?q=...    datasets of the `catalog` sizes whose slug contains q
+  GET /files/<slug>.json                    synthetic Socrata rows.json (Range + ETag aware)
+
+Datasets are synthetic border-crossing rows written once to a cache directory,
+so a 10M-row file is generated only the first time it is requested.
+"""
+
+import json, os, random, re, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SYSTEM_COLUMNS = [':sid', ':id', ':position', ':created_at', ':created_meta', ':updated_at', ':updated_meta', ':meta']
+DATA_COLUMNS = ['port_name', 'state', 'port_code', 'border', 'date', 'measure', 'value', 'latitude', 'longitude', 'point']
+MEASURES = ['Trucks', 'Personal Vehicles', 'Pedestrians', 'Buses', 'Trains', 'Rail Containers Loaded']
+STATES = [('Washington', 'US-Canada Border'), ('Texas', 'US-Mexico Border'), ('Arizona', 'US-Mexico Border'),
+          ('Maine', 'US-Canada Border'), ('Michigan', 'US-Canada Border'), ('California', 'US-Mexico Border')]
+
+
+def dataset_meta():
+    return {'view': {'name': 'Border Crossing Entry Data (synthetic)',
+                     'columns': [{'id': i, 'fieldName': f, 'name': f.strip(':')}
+                                 for i, f in enumerate(SYSTEM_COLUMNS + DATA_COLUMNS)]}}
+
+
+def synthetic_row(i, rng):
+    state, border = STATES[i % len(STATES)]
+    port = 2000 + (i // 7) % 120
+    lat, lon = 25 + rng.random() * 24, -125 + rng.random() * 58
+    return [f"row-{i}", f"00000000-0000-0000-0000-{i:012d}", 0, 1700000000, None, 1700000000, None, '{ }',
+            f"Port {port}", state, str(port), border,
+            f"{2000 + (i // 5000) % 25}-{(i // 400) % 12 + 1:02d}-01T00:00:00", MEASURES[i % len(MEASURES)],
+            str(rng.randint(0, 50000)), f"{lat:.3f}", f"{lon:.3f}", f"POINT ({lon:.3f} {lat:.3f})"]
+
+
+def make_rows_json(path, rows, seed=42):
+    """Writes a Socrata-shaped rows.json with `rows` synthetic rows (streamed, constant memory)."""
+    rng = random.Random(seed)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('{"meta":' + json.dumps(dataset_meta()) + ',\n"data":[\n')
+        for i in range(rows):
+            if i:
+                f.write(',\n')
+            f.write(json.dumps(synthetic_row(i, rng)))
+        f.write('\n]}\n')
+    os.replace(tmp, path)
+    return path
+
+
+class FakeDataGov:
+    """Threaded HTTP server; `dataset_url(rows)` returns the catalog URL for a dataset of that size."""
+
+    def __init__(self, cache_dir, host='127.0.0.1', port=0, catalog=(1000, 10000, 100000)):
+        self.cache_dir = cache_dir
+        self.catalog = catalog
+        os.makedirs(cache_dir, exist_ok=True)
+        self._gen_lock = threading.Lock()
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @staticmethod
+    def slug(rows):
+        return f"border-crossing-synthetic-{rows}"
+
+    def dataset_url(self, rows):
+        return f"{self.base_url}/dataset/{self.slug(rows)}"
+
+    def file_for(self, slug):
+        m = re.fullmatch(r'border-crossing-synthetic-(\d+)', slug)
+        if not m:
+            return None
+        path = os.path.join(self.cache_dir, f"{slug}.json")
+        with self._gen_lock:
+            if not os.path.exists(path):
+                make_rows_json(path, int(m.group(1)))
+        return path
+
+    # -- request handling --------------------------------------------------
+
+    def _send(self, h, status, body, ctype='application/json', extra=None):
+        h.send_response(status)
+        h.send_header('Content-Type', ctype)
+        h.send_header('Content-Length', str(len(body)))
+        for k, v in (extra or {}).items():
+            h.send_header(k, v)
+        h.end_headers()
+        h.wfile.write(body)
+
+    def _package(self, slug):
+        return {'name': slug, 'resources': [
+            {'url': f"{self.base_url}/files/{slug}.json", 'format': 'JSON', 'name': 'rows.json'}]}
+
+    def handle(self, h):
+        url = urlparse(h.path)
+        query = parse_qs(url.query)
+        if url.path == '/api/3/action/package_show':
+            res = {'success': True, 'result': self._package(query.get('id', [''])[0])}
+            return self._send(h, 200, json.dumps(res).encode())
+        if url.path == '/api/3/action/package_search':
+            names = [self.slug(n) for n in self.catalog if query.get('q', [''])[0] in self.slug(n)]
+            start, rows = int(query.get('start', ['0'])[0]), int(query.get('rows', ['10'])[0])
+            res = {'success': True, 'result': {'count': len(names),
+                                               'results': [self._package(n) for n in names[start:start + rows]]}}
+            return self._send(h, 200, json.dumps(res).encode())
+        if url.path.startswith('/dataset/'):
+            slug = url.path.rsplit('/', 1)[-1]
+            html = f'<html><body><a href="/files/{slug}.json">rows.json</a></body></html>'
+            return self._send(h, 200, html.encode(), 'text/html')
+        if url.path.startswith('/files/'):
+            path = self.file_for(url.path.rsplit('/', 1)[-1][:-len('.json')])
+            if path:
+                return self._send_file(h, path)
+        self._send(h, 404, b'{"error": "not found"}')
+
+    def _send_file(self, h, path):
+        size = os.path.getsize(path)
+        etag = f'"{size:x}-{int(os.path.getmtime(path)):x}"'
+        if h.headers.get('If-None-Match') == etag:
+            h.send_response(304)
+            h.send_header('ETag', etag)
+            h.send_header('Content-Length', '0')
+            h.end_headers()
+            return
+        start, end, status = 0, size - 1, 200
+        m = re.fullmatch(r'bytes=(\d+)-(\d*)', h.headers.get('Range', ''))
+        if m:
+            start, end, status = int(m.group(1)), min(int(m.group(2) or size - 1), size - 1), 206
+        h.send_response(status)
+        h.send_header('Content-Type', 'application/json')
+        h.send_header('Content-Length', str(end - start + 1))
+        h.send_header('Accept-Ranges', 'bytes')
+        h.send_header('ETag', etag)
+        if status == 206:
+            h.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        h.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            left = end - start + 1
+            while left > 0:
+                chunk = f.read(min(1 << 20, left))
+                if not chunk:
+                    break
+                h.wfile.write(chunk)
+                left -= len(chunk)
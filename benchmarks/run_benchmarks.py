@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+run_benchmarks.py
+
+Offline benchmarks for download_data_gov.py (single dataset and harvest), combined.py and Snowflake_Upload.py.
+Nothing touches catalog.data.gov or a warehouse: a local CKAN/data.gov stand-in
+(fake_data_gov.py) serves synthetic rows.json files and Snowflake is replaced by
+the in-process recording fake (sf_fake.py, via SNOWFLAKE_CONNECTOR=fake).
+
+Each case runs in a fresh child process so its peak RSS is its own. Results
+(throughput, peak RSS, per-stage seconds) are written as JSON so runs can be
+compared between commits.
+
+Usage:
+  python benchmarks/run_benchmarks.py --rows 10000 100000
+  python benchmarks/run_benchmarks.py --rows 1000000 --cases combined-bulk combined-pipeline
+  python benchmarks/run_benchmarks.py --compare benchmarks/results/<older>.json
+"""
+
+import argparse, json, os, platform, subprocess, sys, tempfile, time
+from contextlib import contextmanager
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+CASES = ['download', 'harvest', 'combined-insert', 'combined-bulk', 'combined-pipeline',
+         'snowflake-upload-full', 'snowflake-upload-delta', 'snowflake-upload-flat',
+         'snowflake-upload-chunked', 'cli-startup', 'row-passthrough', 'json-layouts',
+         'spotify-s3', 'validate', 'projection']
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+        except Exception:
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(self.stages.get(name, 0) + time.perf_counter() - started, 4)
+
+
+# -- cases (run inside the child process) -----------------------------------
+
+def case_download(ctx, t):
+    import requests, download_data_gov
+    http = requests.Session()
+    with t.stage('ckan'):
+        resources = download_data_gov.get_ckan_resources(http, ctx['dataset_url'])
+    with t.stage('transfer'):
+        path = download_data_gov.download(http, resources[0]['url'], ctx['work'], force_filename='data.json')
+    return {'bytes': os.path.getsize(path), 'rows': ctx['rows']}
+
+
+def case_harvest(ctx, t):
+    import requests, download_data_gov
+    from fake_data_gov import FakeDataGov
+    # Three datasets (rows, rows/2, rows/4), the first listed twice to exercise resource dedupe
+    slugs = [FakeDataGov.slug(ctx['rows'] // d) for d in (1, 2, 4)]
+    with t.stage('harvest'):
+        stats = download_data_gov.harvest(requests.Session(), slugs + [(slugs[0] + '-mirror', [
+            {'url': f"{os.environ['CKAN_URL']}/files/{slugs[0]}.json", 'fmt': 'json'}])], ctx['work'])
+    return {'bytes': stats['bytes'], 'rows': ctx['rows'] * 7 // 4}
+
+
+def _combined_fetch(ctx, t):
+    import requests, combined
+    http = requests.Session()
+    with t.stage('page'):
+        html = combined.get_page(http, ctx['dataset_url'])
+    with t.stage('ckan'):
+        target = combined.find_json_resources(http, ctx['dataset_url'], html)[0]
+    return combined, http, target
+
+
+def _combined_download_parse(ctx, t):
+    combined, http, target = _combined_fetch(ctx, t)
+    with t.stage('download'):
+        path, _ = combined.download_with_progress(http, target, ctx['work'], filename='data.json')
+    with t.stage('parse'):
+        rows = sum(1 for _ in combined.parse_json_rows(path))
+    return combined, path, rows
+
+
+def case_combined_insert(ctx, t):
+    combined, path, rows = _combined_download_parse(ctx, t)
+    with t.stage('parse+upload'):
+        sent = combined.upload_rows_to_snowflake(combined.parse_json_rows(path, raw=True), batch_size=ctx['batch'])
+    return {'bytes': os.path.getsize(path), 'rows': sent}
+
+
+def case_combined_bulk(ctx, t):
+    combined, path, rows = _combined_download_parse(ctx, t)
+    with t.stage('parse+upload'):
+        sent = combined.upload_rows_bulk(combined.parse_json_rows(path, raw=True), rows_per_chunk=ctx['chunk_rows'],
+                                         work_dir=ctx['work'])
+    return {'bytes': os.path.getsize(path), 'rows': sent}
+
+
+def case_combined_pipeline(ctx, t):
+    combined, http, target = _combined_fetch(ctx, t)
+    out = os.path.join(ctx['work'], 'data.json')
+    with t.stage('pipeline'):
+        res = combined.pipelined_load(http, target, out, chunk_rows=ctx['chunk_rows'])
+    return {'bytes': os.path.getsize(out), 'rows': res['rows']}
+
+
+def _snowflake_upload(ctx):
+    os.environ['LOCAL_FILE_PATH'] = ctx['file']
+    os.environ['DELTA_STATE_PATH'] = os.path.join(ctx['work'], 'fingerprints.gz')
+    import Snowflake_Upload
+    return Snowflake_Upload
+
+
+def case_snowflake_upload_full(ctx, t):
+    mod = _snowflake_upload(ctx)
+    with t.stage('upload'):
+        mod.upload_json_to_snowflake()
+    return {'bytes': os.path.getsize(ctx['file']), 'rows': ctx['rows']}
+
+
+def case_snowflake_upload_delta(ctx, t):
+    mod = _snowflake_upload(ctx)
+    with t.stage('delta-initial'):
+        mod.upload_delta_to_snowflake()
+    with t.stage('delta-unchanged'):
+        mod.upload_delta_to_snowflake()
+    return {'bytes': os.path.getsize(ctx['file']), 'rows': ctx['rows']}
+
+
+def case_snowflake_upload_flat(ctx, t):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        os.environ.setdefault('FLAT_FORMAT', 'ndjson')
+    mod = _snowflake_upload(ctx)
+    with t.stage('flatten+upload'):
+        mod.upload_flat_to_snowflake()
+    return {'bytes': os.path.getsize(ctx['file']), 'rows': ctx['rows']}
+
+
+def case_snowflake_upload_chunked(ctx, t):
+    # Small parts so even the 10k-row dataset exercises several compress workers and concurrent PUTs
+    os.environ.setdefault('CHUNK_TARGET_MB', '1')
+    mod = _snowflake_upload(ctx)
+    with t.stage('compress+put+copy'):
+        mod.upload_chunked_to_snowflake()
+    return {'bytes': os.path.getsize(ctx['file']), 'rows': ctx['rows']}
+
+
+def case_cli_startup(ctx, t):
+    # Cold start of cli.py: --help and dry runs must not import heavy dependencies or touch the network
+    env = dict(os.environ, LOCAL_FILE_PATH=ctx['file'], SP_CREDS_CLIENT_ID='bench', SP_CREDS_CLIENT_SECRET='bench')
+    for cmd in (['--help'], ['download', '--dry-run'], ['combined', '--help'], ['combined', '--dry-run'],
+                ['load-border', '--dry-run'], ['spotify', '--dry-run'], ['transform', '--dry-run']):
+        with t.stage(' '.join(cmd)):
+            subprocess.run([sys.executable, os.path.join(ROOT, 'cli.py')] + cmd, env=env, capture_output=True,
+                           check=True)
+    return {'bytes': 0, 'rows': 0}
+
+
+def case_row_passthrough(ctx, t):
+    # Parse -> JSON text per row, as the upload needs it: decoded rows + json.dumps vs raw slices.
+    # CPU seconds per million rows, and allocations per row (memory blocks still held per row for a batch of rows).
+    import gc, json
+    from itertools import islice
+    from json_stream import JsonRowReader
+    detail = {}
+    for mode, raw in (('decoded', False), ('raw', True)):
+        cpu = time.process_time()
+        with t.stage(mode):
+            n = 0
+            for r in JsonRowReader(ctx['file'], raw=raw):
+                text = r if raw else json.dumps(r, separators=(',', ':'))
+                n += 1
+        cpu = time.process_time() - cpu
+        rows = iter(JsonRowReader(ctx['file'], raw=raw))
+        next(rows)  # buffer and meta are allocated before counting
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        batch = list(islice(rows, 10_000))
+        detail[mode] = {'cpu_s_per_m_rows': round(cpu / n * 1e6, 2),
+                        'allocs_per_row': round((sys.getallocatedblocks() - blocks) / len(batch), 1)}
+        del rows, batch
+    return {'bytes': os.path.getsize(ctx['file']) * 2, 'rows': n * 2, 'detail': detail}
+
+
+def case_json_layouts(ctx, t):
+    # The dataset rewritten in every layout json_stream reads; each must give the same rows, decoded and raw
+    # (NDJSON lines that are themselves arrays or objects used to be mistaken for one top-level document).
+    import gzip, json
+    from json_stream import JsonRowReader
+    rows = list(JsonRowReader(ctx['file']))
+    layouts = {
+        'array': lambda f: json.dump(rows, f),
+        'array-pretty': lambda f: json.dump(rows, f, indent=1),
+        'ndjson-arrays': lambda f: f.writelines(json.dumps(r) + '\n' for r in rows),
+        'ndjson-objects': lambda f: f.writelines(json.dumps({'row': r}) + '\n' for r in rows),
+    }
+    total, detail = 0, {}
+    for name, write in layouts.items():
+        for suffix, opener in (('.json', open), ('.json.gz', gzip.open)):
+            path = os.path.join(ctx['work'], name + suffix)
+            with opener(path, 'wt', encoding='utf-8') as f:
+                write(f)
+            with t.stage(name + suffix):
+                got = [len(list(JsonRowReader(path, raw=raw))) for raw in (False, True)]
+            if got != [len(rows)] * 2:
+                raise AssertionError(f"{name}{suffix}: read {got} rows (decoded, raw), expected {len(rows)}")
+            detail[name + suffix] = got[0]
+            total += 2 * got[0]
+    return {'bytes': 0, 'rows': total, 'detail': detail}
+
+
+def case_spotify_s3(ctx, t):
+    # SPOTIFY_OUTPUT=s3 against a local moto S3 (S3_ENDPOINT_URL): the streaming upload, multipart part sizing
+    # and the abort of a failed upload. Requires moto (pip install "moto[server]") and boto3.
+    import base64, gzip, random
+    from moto.server import ThreadedMotoServer
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    try:
+        os.environ.update(S3_ENDPOINT_URL=f"http://127.0.0.1:{server._server.server_port}", SPOTIFY_OUTPUT='s3',
+                          S3_BUCKET_NAME='bench-bucket', AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench',
+                          UPLOAD_REPORT_PATH=os.path.join(ctx['work'], 'upload_report.json'))
+        import s3_stage, Spotify_To_Snowflake
+        client = s3_stage.make_client()
+        client.create_bucket(Bucket='bench-bucket')
+        items = [{'added_at': f'2024-01-01T00:00:{i % 60:02d}Z',
+                  'track': {'id': f'track-{i}', 'name': f'Track {i}', 'artists': [{'id': f'artist-{i % 500}'}]}}
+                 for i in range(ctx['rows'])]
+        genres = [{'id': f'artist-{i}', 'name': f'Artist {i}', 'genres': ['rock']} for i in range(500)]
+        with t.stage('upload_via_s3'):
+            if not Spotify_To_Snowflake.upload_via_s3(items, genres):
+                raise AssertionError('upload_via_s3 failed')
+        sent = 0
+        for obj in client.list_objects_v2(Bucket='bench-bucket')['Contents']:
+            body = client.get_object(Bucket='bench-bucket', Key=obj['Key'])['Body'].read()
+            lines = gzip.decompress(body).count(b'\n')
+            expected = len(items) if 'all_items' in obj['Key'] else len(genres)
+            if lines != expected:
+                raise AssertionError(f"{obj['Key']}: {lines} records, expected {expected}")
+            sent += len(body)
+
+        # ~12 MB of gzip (random payloads barely compress) -> three parts of the 5 MB minimum
+        rnd = random.Random(0)
+        blobs = [{'i': i, 'blob': base64.b64encode(rnd.randbytes(768)).decode()} for i in range(16_000)]
+        with t.stage('multipart'):
+            up = s3_stage.upload_ndjson(client, 'bench-bucket', 'bench/parts.ndjson.gz', blobs,
+                                        part_size=s3_stage.MIN_PART)
+        size = client.head_object(Bucket='bench-bucket', Key='bench/parts.ndjson.gz')['ContentLength']
+        if up['parts'] != -(-up['bytes'] // s3_stage.MIN_PART) or size != up['bytes']:
+            raise AssertionError(f"multipart: {up['parts']} parts, {size} bytes stored for {up['bytes']} sent")
+
+        def failing():
+            yield from blobs
+            raise RuntimeError('source failed mid-upload')
+        with t.stage('abort'):
+            try:
+                s3_stage.upload_ndjson(client, 'bench-bucket', 'bench/failed.ndjson.gz', failing(),
+                                       part_size=s3_stage.MIN_PART)
+            except RuntimeError:
+                pass
+        pending = client.list_multipart_uploads(Bucket='bench-bucket').get('Uploads', [])
+        if pending or 'Contents' in client.list_objects_v2(Bucket='bench-bucket', Prefix='bench/failed'):
+            raise AssertionError(f"failed upload left {len(pending)} multipart upload(s) or an object behind")
+    finally:
+        server.stop()
+    return {'bytes': sent + up['bytes'], 'rows': len(items) + len(blobs),
+            'detail': {'parts': up['parts'], 'part_bytes': s3_stage.MIN_PART}}
+
+
+def case_validate(ctx, t):
+    # Validator throughput on already decoded rows (the parse is timed separately), quarantine file included
+    from json_stream import JsonRowReader
+    from validation import Validator
+    with t.stage('parse'):
+        reader = JsonRowReader(ctx['file'])
+        rows = list(reader)
+    with t.stage('validate'):
+        validator = Validator(rows, quarantine_path=os.path.join(ctx['work'], 'quarantine.ndjson.gz'), meta=reader.meta)
+        passed = sum(1 for _ in validator)
+    # The synthetic file repeats its natural keys; the clean path (every row passes) gets unique port codes
+    from border_flat import COLUMNS, positions
+    port = dict(zip((c[0] for c in COLUMNS), positions(reader.meta)))['PORT_CODE']
+    clean = [r[:port] + [str(i)] + r[port + 1:] for i, r in enumerate(rows)]
+    with t.stage('validate-clean'):
+        clean_passed = sum(1 for _ in Validator(clean, meta=reader.meta))
+    if clean_passed != len(clean):
+        raise AssertionError(f"clean rows: {clean_passed}/{len(clean)} passed")
+    per_s = {k: round(len(rows) / t.stages[k]) if t.stages[k] else None for k in ('validate', 'validate-clean')}
+    return {'bytes': os.path.getsize(ctx['file']), 'rows': len(rows),
+            'detail': {'validate_rows_per_s': per_s['validate'], 'clean_rows_per_s': per_s['validate-clean'],
+                       'passed': passed, 'quarantined': validator.counts['quarantined']}}
+
+
+def case_projection(ctx, t):
+    # Projector throughput on saved-track items shaped like the API's, plus the wildcard and REQUIRED rules
+    import json
+    from projection import Projector
+    markets = ['US', 'GB', 'DE', 'FR', 'JP'] * 16
+
+    def artists(i):
+        return [{'id': f'artist-{i % 500}', 'name': f'Artist {i % 500}', 'href': f'https://api/artists/{i % 500}',
+                 'external_urls': {'spotify': f'https://open/artist/{i % 500}'}}]
+
+    items = [{'added_at': f'2024-01-01T00:00:{i % 60:02d}Z',
+              'track': {'id': f'track-{i}', 'name': f'Track {i}', 'preview_url': f'https://p/{i}',
+                        'available_markets': markets, 'external_urls': {'spotify': f'https://open/track/{i}'},
+                        'artists': artists(i),
+                        'album': {'id': f'album-{i % 900}', 'name': f'Album {i % 900}', 'artists': artists(i),
+                                  'available_markets': markets, 'images': [{'url': f'https://i/{i}'}] * 3}}}
+             for i in range(ctx['rows'])]
+    projector = Projector()
+    with t.stage('project'):
+        for item in items:
+            projector(item)
+
+    item = items[0]
+    got = Projector({'keep': ['track.*.id']})(item)
+    want = {'added_at': item['added_at'], 'track': {'id': 'track-0', 'album': {
+        'id': 'album-0', 'artists': [{'id': 'artist-0', 'name': 'Artist 0'}]}}}
+    if got != want:
+        raise AssertionError(f"keep track.*.id gave {json.dumps(got)}")
+    for drop in (['track'], ['track.*'], ['track.album.artists'], ['added_at', 'track.id']):
+        got = Projector({'drop': drop})(item)
+        if (got.get('added_at'), got['track'].get('id'), got['track']['album'].get('artists')) != (
+                item['added_at'], 'track-0', [{'id': 'artist-0', 'name': 'Artist 0'}] if drop != ['added_at', 'track.id']
+                else item['track']['album']['artists']):
+            raise AssertionError(f"drop {drop} removed a REQUIRED field: {json.dumps(got)}")
+    return {'bytes': projector.bytes_in, 'rows': len(items),
+            'detail': {'bytes_out': projector.bytes_out, 'measured': projector.sampled}}
+
+
+def run_child(ctx):
+    """Entry point of the child process: runs one case and writes its metrics to ctx['result']."""
+    import sf_fake
+    t = Timer()
+    started, cpu = time.perf_counter(), time.process_time()
+    out = globals()['case_' + ctx['case'].replace('-', '_')](ctx, t)
+    seconds, cpu = time.perf_counter() - started, time.process_time() - cpu
+    result = {
+        'case': ctx['case'], 'rows': out['rows'], 'bytes': out['bytes'], 'seconds': round(seconds, 4),
+        'mb_per_s': round(out['bytes'] / 2**20 / seconds, 2) if seconds else None,
+        'rows_per_s': round(out['rows'] / seconds, 1) if seconds and out['rows'] else None,
+        'cpu_s': round(cpu, 4), 'peak_rss_mb': _peak_rss_mb(), 'stages': t.stages,
+        'statements': len(sf_fake.STATEMENTS),
+    }
+    if 'detail' in out:
+        result['detail'] = out['detail']
+    with open(ctx['result'], 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+# -- parent ------------------------------------------------------------------
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(old, new):
+    before = {(r['case'], r['requested_rows']): r for r in old['results']}
+    print(f"\nComparison with {old.get('commit')} ({old.get('created')}):")
+    for r in new['results']:
+        prev = before.get((r['case'], r['requested_rows']))
+        if not prev or 'error' in r or 'error' in prev:
+            continue
+        ratio = prev['seconds'] / r['seconds'] if r['seconds'] else float('inf')
+        print(f"  {r['case']:<24} {r['requested_rows']:>10,} rows  {prev['seconds']:>8.2f}s -> {r['seconds']:>8.2f}s "
+              f"({ratio:.2f}x)  rss {prev['peak_rss_mb']} -> {r['peak_rss_mb']} MB")
+
+
+def main():
+    p = argparse.ArgumentParser(description='Offline throughput/memory benchmarks')
+    p.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000], help='Synthetic dataset sizes (rows)')
+    p.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    p.add_argument('--batch', type=int, default=500, help='INSERT batch size for combined-insert')
+    p.add_argument('--chunk-rows', type=int, default=100_000, help='Rows per staged chunk for bulk cases')
+    p.add_argument('--cache', default=os.path.join(HERE, '.data'), help='Where synthetic datasets are kept')
+    p.add_argument('--out', default=os.path.join(HERE, 'results'), help='Directory for result JSON files')
+    p.add_argument('--compare', help='Earlier result JSON to compare against')
+    p.add_argument('--child', help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.child:
+        with open(args.child, 'r', encoding='utf-8') as f:
+            return run_child(json.load(f))
+
+    from fake_data_gov import FakeDataGov
+    env = dict(os.environ, SNOWFLAKE_CONNECTOR='fake', SNOWFLAKE_USER='bench', SNOWFLAKE_PASSWORD='bench',
+               SNOWFLAKE_ACCOUNT='bench', SNOWFLAKE_WAREHOUSE='BENCH_WH', SNOWFLAKE_DATABASE='BENCH',
+               SNOWFLAKE_SCHEMA='PUBLIC', TQDM_DISABLE='1', PYTHONPATH=os.pathsep.join([ROOT, HERE]))
+    results = []
+    with FakeDataGov(args.cache) as server:
+        env['CKAN_URL'] = server.base_url
+        for rows in args.rows:
+            print(f"Preparing {rows:,}-row dataset...")
+            path = server.file_for(server.slug(rows))
+            for case in args.cases:
+                with tempfile.TemporaryDirectory(prefix='bench_') as work:
+                    ctx = {'case': case, 'rows': rows, 'dataset_url': server.dataset_url(rows), 'file': path,
+                           'work': work, 'batch': args.batch, 'chunk_rows': args.chunk_rows,
+                           'result': os.path.join(work, 'result.json')}
+                    ctx_path = os.path.join(work, 'ctx.json')
+                    with open(ctx_path, 'w', encoding='utf-8') as f:
+                        json.dump(ctx, f)
+                    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', ctx_path],
+                                          env=env, cwd=work, capture_output=True, text=True)
+                    if proc.returncode or not os.path.exists(ctx['result']):
+                        r = {'case': case, 'error': (proc.stderr or proc.stdout)[-2000:]}
+                        print(f"  {case:<24} FAILED\n{r['error']}")
+                    else:
+                        with open(ctx['result'], 'r', encoding='utf-8') as f:
+                            r = json.load(f)
+                        print(f"  {case:<24} {r['seconds']:>8.2f}s  {r['mb_per_s'] or 0:>8.1f} MB/s  "
+                              f"{r['rows_per_s'] or 0:>12,.0f} rows/s  peak {r['peak_rss_mb']} MB  {r['stages']}"
+                              + (f"  {r['detail']}" if 'detail' in r else ''))
+                    r['requested_rows'] = rows
+                    results.append(r)
+
+    report = {'commit': _git_commit(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'platform': platform.platform(), 'results': results}
+    os.makedirs(args.out, exist_ok=True)
+    out_path = os.path.join(args.out, f"{time.strftime('%Y%m%d-%H%M%S')}_{report['commit']}.json")
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {out_path}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
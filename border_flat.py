@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+border_flat.py
+
+Client-side flattening of the border rows.json into typed columns.
+
+Instead of loading the whole Socrata object as one VARIANT and running
+LATERAL FLATTEN + positional casts in the warehouse, rows are streamed from the
+tokenizer, cast locally into the SILVER_BORDER_FLAT column types and written as
+columnar chunks that COPY loads into typed columns directly:
+
+  parquet  typed columns (date32, int64, float64, string), snappy (requires pyarrow)
+  ndjson   gzip NDJSON objects keyed by column name (stdlib fallback)
+
+Positions are resolved by fieldName from meta.view.columns; the fixed positions
+used by transformations.sql (value[8]..value[16]) are the fallback.
+"""
+
+import datetime, gzip, json, os
+
+from bulk_load import FORMATS, chunk_path
+
+# (SILVER_BORDER_FLAT column, Socrata fieldName, fallback position, type)
+COLUMNS = [
+    ('PORT_NAME', 'port_name', 8, 'string'),
+    ('STATE_NAME', 'state', 9, 'string'),
+    ('PORT_CODE', 'port_code', 10, 'string'),
+    ('BORDER_TYPE', 'border', 11, 'string'),
+    ('DATE_KEY', 'date', 12, 'date'),
+    ('MEASURE', 'measure', 13, 'string'),
+    ('VALUE', 'value', 14, 'int'),
+    ('LATITUDE', 'latitude', 15, 'float'),
+    ('LONGITUDE', 'longitude', 16, 'float'),
+]
+NAMES = [c[0] for c in COLUMNS] + ['LOCATION_POINT']
+
+
+def _string(v):
+    return None if v is None else str(v)
+
+
+def _int(v):
+    if v is None or v == '':
+        return None
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return int(round(float(v)))
+
+
+def _float(v):
+    return None if v is None or v == '' else float(v)
+
+
+def _date(v):
+    # Socrata floating timestamps: '2024-01-01T00:00:00' (same result as ::DATE)
+    return None if not v else datetime.date.fromisoformat(str(v)[:10])
+
+
+CASTS = {'string': _string, 'int': _int, 'float': _float, 'date': _date}
+
+
+def positions(meta):
+    """Source position of every column, by fieldName from meta.view.columns, falling back to the fixed layout."""
+    columns = ((meta or {}).get('view') or {}).get('columns') or []
+    names = [c.get('fieldName') for c in columns]
+    return [names.index(field) if field in names else pos for _, field, pos, _ in COLUMNS]
+
+
+class Flattener:
+    """Turns positional rows into typed column values; `.counts` tracks flattened, skipped and rejected rows."""
+
+    def __init__(self, meta=None):
+        self.positions = positions(meta) if meta else None
+        self.casts = [CASTS[c[3]] for c in COLUMNS]
+        self.counts = {'rows': 0, 'skipped': 0, 'rejected': 0}
+
+    def flatten(self, row):
+        """Typed tuple in NAMES order, or None for rows without a port code (as the MERGE filters them)."""
+        try:
+            picked = [row[p] for p in self.positions]
+        except (IndexError, TypeError):
+            self.counts['skipped'] += 1
+            return None
+        if picked[2] is None:
+            self.counts['skipped'] += 1
+            return None
+        out = []
+        for cast, v in zip(self.casts, picked):
+            try:
+                out.append(cast(v))
+            except (TypeError, ValueError):
+                # Like ON_ERROR = 'CONTINUE' at column level: keep the row, null the bad value
+                self.counts['rejected'] += 1
+                out.append(None)
+        lat, lon = out[7], out[8]
+        out.append(f"POINT({lon} {lat})" if lat is not None and lon is not None else None)
+        self.counts['rows'] += 1
+        return tuple(out)
+
+    def rows(self, reader):
+        """Flattens every row of a JsonRowReader; positions are resolved from reader.meta once streaming starts."""
+        for row in reader:
+            if self.positions is None:
+                self.positions = positions(getattr(reader, 'meta', None))
+            flat = self.flatten(row)
+            if flat is not None:
+                yield flat
+
+
+def _arrow_schema():
+    import pyarrow as pa
+    types = {'string': pa.string(), 'int': pa.int64(), 'float': pa.float64(), 'date': pa.date32()}
+    return pa.schema([(name, types[t]) for name, _, _, t in COLUMNS] + [('LOCATION_POINT', pa.string())])
+
+
+def _write_parquet(path, columns):
+    try:
+        import pyarrow as pa, pyarrow.parquet as pq
+    except ModuleNotFoundError:
+        raise RuntimeError("Parquet staging requires pyarrow. Install with: pip install pyarrow")
+    schema = _arrow_schema()
+    table = pa.Table.from_arrays([pa.array(col, type=f.type) for col, f in zip(columns, schema)], schema=schema)
+    pq.write_table(table, path, compression='snappy')
+
+
+def _write_ndjson(path, columns):
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        for values in zip(*columns):
+            f.write(json.dumps(dict(zip(NAMES, values)), separators=(',', ':'), default=str))
+            f.write('\n')
+
+
+def write_flat_chunks(rows, out_dir, prefix, fmt='parquet', rows_per_chunk=500_000):
+    """Writes flattened tuples column-wise into numbered chunk files; yields (path, row_count) like bulk_load.write_chunks."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown staging format {fmt!r}; expected one of {FORMATS}")
+    write = _write_parquet if fmt == 'parquet' else _write_ndjson
+    os.makedirs(out_dir, exist_ok=True)
+    columns, n, idx = [[] for _ in NAMES], 0, 0
+    for row in rows:
+        for col, v in zip(columns, row):
+            col.append(v)
+        n += 1
+        if n >= rows_per_chunk:
+            path = chunk_path(out_dir, prefix, idx, fmt)
+            write(path, columns)
+            yield path, n
+            columns, n, idx = [[] for _ in NAMES], 0, idx + 1
+    if n:
+        path = chunk_path(out_dir, prefix, idx, fmt)
+        write(path, columns)
+        yield path, n
+
+
+def copy_sql(table, stage_path, fmt, pattern):
+    """COPY INTO the typed table straight from the staged chunks (no FLATTEN, no positional casts)."""
+    file_format = "TYPE = 'PARQUET'" if fmt == 'parquet' else "TYPE = 'JSON' COMPRESSION = 'GZIP'"
+    types = {'string': 'VARCHAR', 'int': 'INTEGER', 'float': 'FLOAT', 'date': 'DATE'}
+    select = [f'$1:{name}::{types[t]}' for name, _, _, t in COLUMNS] + ['$1:LOCATION_POINT::VARCHAR']
+    return f"""
+        COPY INTO {table} ({', '.join(NAMES)}, SOURCE_FILE, INGESTION_TIME)
+        FROM (
+            SELECT {', '.join(select)}, METADATA$FILENAME, CURRENT_TIMESTAMP()
+            FROM @{stage_path}
+        )
+        PATTERN = '{pattern}'
+        FILE_FORMAT = ({file_format})
+        ON_ERROR = 'ABORT_STATEMENT'
+        """
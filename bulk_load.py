@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+bulk_load.py
+
+Staged bulk loading helpers: write rows to compressed chunk files, PUT them to
+an internal stage in parallel and load them all with one COPY INTO.
+
+Formats:
+  ndjson   gzip-compressed newline-delimited JSON (stdlib only)
+  parquet  one JSON-text column per row, snappy-compressed (requires pyarrow)
+
+For pre-serialized records, `write_parts` + `compress_and_put` split the output
+into size-targeted plain NDJSON parts, gzip them on a process pool and PUT
+each part as soon as it is compressed.
+"""
+
+import gzip, json, os, shutil, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+FORMATS = ('ndjson', 'parquet')
+EXTENSIONS = {'ndjson': '.ndjson.gz', 'parquet': '.parquet'}
+
+
+def _write_ndjson(path, batch, raw=False):
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        if raw:
+            for i in range(0, len(batch), 10_000):
+                f.write('\n'.join(batch[i:i + 10_000]))
+                f.write('\n')
+            return
+        for r in batch:
+            f.write(json.dumps(r, separators=(',', ':')))
+            f.write('\n')
+
+
+def _write_parquet(path, batch, raw=False):
+    try:
+        import pyarrow as pa, pyarrow.parquet as pq
+    except ModuleNotFoundError:
+        raise RuntimeError("Parquet staging requires pyarrow. Install with: pip install pyarrow")
+    col = pa.array(batch if raw else [json.dumps(r, separators=(',', ':')) for r in batch], type=pa.string())
+    pq.write_table(pa.table({'data': col}), path, compression='snappy')
+
+
+def write_chunk(path, batch, fmt='ndjson', raw=False):
+    """Writes one list of rows as a single chunk file in `fmt` (`raw`: the rows are JSON text already)."""
+    (_write_parquet if fmt == 'parquet' else _write_ndjson)(path, batch, raw)
+    return path
+
+
+def chunk_path(out_dir, prefix, idx, fmt='ndjson'):
+    return os.path.join(out_dir, f"{prefix}_{idx:05d}{EXTENSIONS[fmt]}")
+
+
+def write_chunks(rows, out_dir, prefix, fmt='ndjson', rows_per_chunk=100_000, raw=False):
+    """Writes `rows` (any iterable) into numbered chunk files and yields (path, row_count) as each one closes."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown staging format {fmt!r}; expected one of {FORMATS}")
+    os.makedirs(out_dir, exist_ok=True)
+    batch, idx = [], 0
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= rows_per_chunk:
+            yield write_chunk(chunk_path(out_dir, prefix, idx, fmt), batch, fmt, raw), len(batch)
+            batch, idx = [], idx + 1
+    if batch:
+        yield write_chunk(chunk_path(out_dir, prefix, idx, fmt), batch, fmt, raw), len(batch)
+
+
+class ChunkSizer:
+    """Raw-bytes target for parts so they compress to about `target_bytes`; the ratio adapts to finished parts."""
+
+    def __init__(self, target_bytes, ratio=6.0):
+        self.target_bytes, self.ratio = target_bytes, ratio
+        self.raw = self.compressed = 0
+
+    def raw_target(self):
+        return int(self.target_bytes * self.ratio)
+
+    def observe(self, raw, compressed):
+        self.raw += raw
+        self.compressed += compressed
+        if self.compressed:
+            self.ratio = self.raw / self.compressed
+
+
+def write_parts(lines, out_dir, prefix, target_bytes):
+    """Writes text lines into numbered plain `.ndjson` parts of about `target_bytes` (an int or a callable returning one).
+
+    Yields (path, line_count) as each part closes.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    target = target_bytes if callable(target_bytes) else (lambda: target_bytes)
+    idx, f, n, size = 0, None, 0, 0
+    for line in lines:
+        if f is None:
+            path = os.path.join(out_dir, f"{prefix}_{idx:05d}.ndjson")
+            f = open(path, 'w', encoding='utf-8', newline='\n')
+        f.write(line)
+        f.write('\n')
+        n += 1
+        size += len(line) + 1
+        if size >= target():
+            f.close()
+            yield path, n
+            idx, f, n, size = idx + 1, None, 0, 0
+    if f is not None:
+        f.close()
+        yield path, n
+
+
+def gzip_file(src, level=6):
+    """Compresses `src` to `src + '.gz'` and removes `src` (runs in a worker process). Returns (path, raw, compressed bytes)."""
+    dst = src + '.gz'
+    with open(src, 'rb') as fin, gzip.open(dst, 'wb', compresslevel=level) as fout:
+        shutil.copyfileobj(fin, fout, 1 << 20)
+    raw = os.path.getsize(src)
+    os.remove(src)
+    return dst, raw, os.path.getsize(dst)
+
+
+def compress_and_put(session, parts, stage_path, processes=None, parallel=4, compress=True, keep_local=False,
+                     sizer=None, level=6):
+    """Gzips (path, n) parts from write_parts on a process pool and PUTs each one as soon as it is ready.
+
+    With compress=False the plain parts are PUT as they are (debug mode; COPY with COMPRESSION = 'NONE').
+    Returns {'files', 'records', 'raw_bytes', 'staged_bytes'}.
+    """
+    stats = {'files': 0, 'records': 0, 'raw_bytes': 0, 'staged_bytes': 0}
+
+    def _put(path):
+        put_file(session, path, stage_path)
+        if not keep_local:
+            os.remove(path)
+
+    def _staged(path, raw, size):
+        stats['files'] += 1
+        stats['raw_bytes'] += raw
+        stats['staged_bytes'] += size
+        if sizer:
+            sizer.observe(raw, size)
+        return put_pool.submit(_put, path)
+
+    from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing; only needed here
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as gz_pool, ThreadPoolExecutor(max_workers=parallel) as put_pool:
+        compressing, puts = set(), []
+
+        def _drain(block):
+            done, _ = wait(compressing, return_when=FIRST_COMPLETED) if block else (
+                {f for f in compressing if f.done()}, None)
+            for f in done:
+                compressing.discard(f)
+                puts.append(_staged(*f.result()))
+
+        for path, n in parts:
+            stats['records'] += n
+            if not compress:
+                size = os.path.getsize(path)
+                puts.append(_staged(path, size, size))
+                continue
+            compressing.add(gz_pool.submit(gzip_file, path, level))
+            # Bound the plain parts waiting on disk to about two per worker process
+            while len(compressing) >= 2 * processes:
+                _drain(block=True)
+            _drain(block=False)
+        while compressing:
+            _drain(block=True)
+        for f in puts:
+            f.result()
+    return stats
+
+
+def put_file(session, path, stage_path, threads=4):
+    """PUTs one already-compressed file through an sf_session.Session (so concurrent PUTs use separate connections)."""
+    local_posix = os.path.abspath(path).replace('\\', '/')
+    metrics.incr('bytes', os.path.getsize(path), stage='put')
+    return session.execute(f"PUT 'file://{local_posix}' @{stage_path} AUTO_COMPRESS=FALSE "
+                           f"SOURCE_COMPRESSION=AUTO_DETECT PARALLEL={threads} OVERWRITE=TRUE")
+
+
+def put_chunks(session, chunks, stage_path, parallel=4, keep_local=False, progress=None):
+    """PUTs (path, row_count) pairs from write_chunks concurrently while later chunks are still being written.
+
+    Local chunk files are removed once staged unless `keep_local`. Returns the number of rows staged.
+    """
+    def _put(path):
+        put_file(session, path, stage_path)
+        if not keep_local:
+            os.remove(path)
+
+    staged = 0
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = []
+        for path, n in chunks:
+            futures.append(pool.submit(_put, path))
+            staged += n
+            if progress:
+                progress(n)
+        for f in futures:
+            f.result()
+    return staged
+
+
+def copy_sql(table, column, stage_path, fmt, pattern):
+    """COPY INTO statement that loads every staged chunk matching `pattern` into `table(column)`."""
+    if fmt == 'parquet':
+        select, file_format = "PARSE_JSON($1:data)", "TYPE = 'PARQUET'"
+    else:
+        select, file_format = "$1", "TYPE = 'JSON' COMPRESSION = 'GZIP'"
+    return f"""
+        COPY INTO {table} ({column})
+        FROM (SELECT {select} FROM @{stage_path})
+        PATTERN = '{pattern}'
+        FILE_FORMAT = ({file_format})
+        ON_ERROR = 'ABORT_STATEMENT'
+        """
+
+
+def rows_loaded(copy_result):
+    """Sums rows_loaded over COPY INTO result rows (column 3), ignoring files that failed."""
+    total = 0
+    for row in copy_result:
+        if len(row) > 3 and row[1] != 'LOAD_FAILED' and isinstance(row[3], int):
+            total += row[3]
+    return total
+
+
+def pattern_for(prefix, fmt=None, ext=None):
+    """Regex for the chunk files of one run; dots are bracketed since backslashes are escapes in SQL literals."""
+    return f".*{prefix}_[0-9]+{ext or EXTENSIONS[fmt]}".replace('.', '[.]').replace('[.]*', '.*', 1)
+
+
+def append_report(path, entry):
+    """Appends `entry` (a dict with a 'mode') to the JSON list of runs in `path`. Returns (runs, latest run per mode)."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            runs = json.load(f)
+    except (FileNotFoundError, ValueError):
+        runs = []
+    runs.append(dict(entry, at=time.strftime('%Y-%m-%dT%H:%M:%S')))
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(runs, f, indent=2)
+    latest = {}
+    for run in runs:
+        latest[run['mode']] = run
+    return runs, latest
+
+
+def record_report(path, mode, rows, seconds):
+    """Appends one load measurement to a JSON report and prints the latest rows/s per mode."""
+    runs, latest = append_report(path, {'mode': mode, 'rows': rows, 'seconds': round(seconds, 3),
+                                        'rows_per_s': round(rows / seconds, 1) if seconds else None})
+    print('Load report (latest run per mode):')
+    for m, run in sorted(latest.items()):
+        print(f"  {m:<8} {run['rows']:>12,} rows  {run['seconds']:>9.2f}s  {run['rows_per_s'] or 0:>12,.0f} rows/s")
+    if 'insert' in latest and 'bulk' in latest and latest['insert']['rows_per_s']:
+        print(f"  bulk/insert speedup: {latest['bulk']['rows_per_s'] / latest['insert']['rows_per_s']:.1f}x")
+    return runs
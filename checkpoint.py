@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+checkpoint.py
+
+Durable progress journal for batched INSERT loads, so an interrupted upload
+resumes at the first uncommitted batch instead of at row 0.
+
+The journal is a small JSON file, replaced atomically (and fsynced) after every
+committed batch. It holds the source file's SHA-256, the target table, the
+batch size, the number of source rows committed and the byte offset just past
+the last of them. On restart the reader seeks straight to that offset (see
+json_stream.JsonRowReader), so recovery only reads the remaining rows. A
+journal written for another file hash or table is ignored. A resumed load keeps
+the journal's batch size, because the load ids depend on it.
+
+Every batch carries a load id made of the file hash, the run that started the
+journal and the batch's first source row. The INSERT only adds rows when no row
+with that load id exists, so a batch that committed just before a crash, or one
+retried by the session, is never inserted twice. A new run (e.g. a --force
+reload after the journal was finished) gets new load ids.
+"""
+
+import json, os, time
+
+
+def load_id(sha256, run, start):
+    return f"{sha256[:16]}-{run}-{start:012d}"
+
+
+def insert_batch(session, table, batch_id, rows, raw=False):
+    """Inserts `rows` as VARIANTs tagged with `batch_id`, unless that load id is already in `table` (one statement).
+
+    `raw`: the rows are JSON text already (json_stream raw mode).
+    """
+    sql = (f"INSERT INTO {table} (data, load_id) "
+           f"SELECT PARSE_JSON(column1), %s FROM VALUES {', '.join(['(%s)'] * len(rows))} "
+           f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE load_id = %s)")
+    # Safe to retry after a dropped connection: the load id guard skips a batch that did commit
+    return session.execute(sql, [batch_id] + (rows if raw else [json.dumps(r) for r in rows]) + [batch_id], retry=True)
+
+
+class Checkpoint:
+    """Journal of one (file, table) load; `.rows` / `.offset` / `.layout` say where to resume."""
+
+    def __init__(self, path, sha256, table, batch_size):
+        self.path = path
+        self.state = {'sha256': sha256, 'table': table, 'batch_size': batch_size, 'rows': 0, 'offset': 0,
+                      'layout': None, 'batches': 0, 'inserted': 0, 'run': time.strftime('%Y%m%d%H%M%S')}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        if all(saved.get(k) == self.state[k] for k in ('sha256', 'table')):
+            self.state.update(saved)
+
+    @classmethod
+    def for_file(cls, source, sha256, table, batch_size):
+        return cls(source + '.checkpoint.json', sha256, table, batch_size)
+
+    @property
+    def batch_size(self):
+        return self.state['batch_size']
+
+    @property
+    def rows(self):
+        return self.state['rows']
+
+    @property
+    def offset(self):
+        return self.state['offset']
+
+    @property
+    def layout(self):
+        return self.state['layout']
+
+    @property
+    def batches(self):
+        return self.state['batches']
+
+    @property
+    def inserted(self):
+        """Rows inserted by this load so far (source rows minus those filtered out before insert)."""
+        return self.state['inserted']
+
+    @property
+    def resuming(self):
+        return self.state['rows'] > 0
+
+    def load_id(self, start=None):
+        """Load id of the batch starting at source row `start` (default: the next uncommitted one)."""
+        return load_id(self.state['sha256'], self.state['run'], self.rows if start is None else start)
+
+    def begin(self):
+        """Writes the journal before the first batch, so its run id (and load ids) survive a crash in batch one."""
+        if not self.batches:
+            self._write()
+
+    def commit(self, rows, offset, layout, inserted=None):
+        """Records that `rows` more source rows, ending at byte `offset`, are committed (`inserted` of them loaded)."""
+        self.state.update(rows=self.rows + rows, offset=offset, layout=layout, batches=self.batches + 1,
+                          inserted=self.inserted + (rows if inserted is None else inserted))
+        self._write()
+
+    def _write(self):
+        self.state['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def finish(self):
+        """The load completed: drop the journal so the next load of this file starts fresh."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+cli.py
+
+Single entry point for the pipelines:
+
+  python cli.py download [URL] [--harvest SLUG ...]    download_data_gov.py
+  python cli.py load-border [--mode delta]             Snowflake_Upload.py
+  python cli.py spotify                                Spotify_To_Snowflake.py
+  python cli.py combined [URL] [--pipeline]            combined.py
+  python cli.py transform [--source stream]            transform.py
+
+Only the module of the chosen subcommand is imported, and those modules import
+their heavy dependencies (requests, bs4, tqdm, spotipy, the Snowflake
+connector, numpy, pyarrow) only where a real run needs them. Config checks,
+OAuth and network calls happen when the command runs, so `--help` and
+`--dry-run` return quickly and every module can be imported on its own.
+"""
+
+import argparse, importlib, sys
+
+# subcommand -> (module, description)
+COMMANDS = {
+    'download': ('download_data_gov', 'Download Data.gov dataset resources (one dataset or a harvest)'),
+    'load-border': ('Snowflake_Upload', 'Load the downloaded border rows.json into Snowflake'),
+    'spotify': ('Spotify_To_Snowflake', 'Sync Spotify saved tracks and artist genres into Snowflake'),
+    'combined': ('combined', 'Download the border dataset and load it in one run'),
+    'transform': ('transform', 'Incremental bronze -> silver MERGE with a query history'),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in COMMANDS:
+        # Everything after the subcommand is parsed by the module itself (including --help)
+        return importlib.import_module(COMMANDS[argv[0]][0]).main(argv[1:])
+    p = argparse.ArgumentParser(prog='cli.py', description='Data.gov / Spotify to Snowflake pipelines',
+                                epilog="Run 'cli.py <command> --help' for the options of a command.")
+    sub = p.add_subparsers(dest='command', metavar='command', required=True)
+    for name, (_, description) in COMMANDS.items():
+        sub.add_parser(name, help=description)
+    p.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,27 +3,35 @@
 combined.py
 
 Downloads the Data.gov dataset (JSON by default) and uploads its rows into
-Snowflake using batched INSERT ... PARSE_JSON. Shows a progress bar for both
-download and upload (accurate for upload because we control the row inserts).
+Snowflake, either as compressed chunk files PUT to a stage and loaded with a
+single COPY INTO (default), or with batched INSERT ... PARSE_JSON. Rows are
+streamed from the file (see json_stream.py) so memory stays flat regardless of
+dataset size. Shows a progress bar for both download and upload.
 
 Usage:
-  python combined.py [DATASET_URL] --out downloads --batch 500
+  python combined.py [DATASET_URL] --out downloads                 # bulk: chunk files + PUT + one COPY INTO
+  python combined.py [DATASET_URL] --mode insert --batch 500       # small loads: batched INSERT ... PARSE_JSON
+  python combined.py [DATASET_URL] --gzip                          # keep the download as .json.gz, decompress while parsing
+  python combined.py [DATASET_URL] --rollup port,measure,border,month --rollup-only   # gold rollup only
 
 Requires: requests, beautifulsoup4, tqdm, python-dotenv, snowflake-connector-python
 Set Snowflake credentials in environment or a .env file: SNOWFLAKE_USER, SNOWFLAKE_PASSWORD,
 SNOWFLAKE_ACCOUNT, SNOWFLAKE_WAREHOUSE, SNOWFLAKE_DATABASE, SNOWFLAKE_SCHEMA
+(optional: TABLE_NAME, STAGE_NAME for bulk mode, ROLLUP_TABLE for --rollup)
 """
 
-import os, sys, argparse, re, json
+import os, sys, argparse, re, json, shutil, tempfile, threading, time, hashlib, gzip, zlib
+from itertools import count, islice
 from urllib.parse import urljoin, urlparse
 
-try:
-    import requests
-    from bs4 import BeautifulSoup
-    from tqdm import tqdm
-    import snowflake.connector
-except ModuleNotFoundError as e:
-    sys.exit(f"Missing package: {e.name}. Install with: pip install requests beautifulsoup4 tqdm snowflake-connector-python")
+from json_stream import JsonRowReader, read_meta
+from pipeline import Pipeline, Stage
+import bulk_load, http_download, metrics
+from validation import Validator
+from rollup import Rollup, copy_sql as rollup_copy_sql, parse_spec as parse_rollup_spec
+from download_cache import Manifest
+from checkpoint import Checkpoint, insert_batch
+from sf_session import Session, config_from_env
 
 try:
     from dotenv import load_dotenv
@@ -39,11 +47,27 @@ SF_WAREHOUSE = os.getenv('SNOWFLAKE_WAREHOUSE')
 SF_DATABASE = os.getenv('SNOWFLAKE_DATABASE')
 SF_SCHEMA = os.getenv('SNOWFLAKE_SCHEMA')
 SF_TABLE = os.getenv('TABLE_NAME', 'BRONZE_BORDER')
+SF_STAGE = os.getenv('STAGE_NAME', 'BORDER_STAGE')
+SF_ROLLUP_TABLE = os.getenv('ROLLUP_TABLE', 'GOLD_BORDER_ROLLUP')
+CKAN_URL = os.getenv('CKAN_URL', 'https://catalog.data.gov').rstrip('/')
 
 REQUIRED = [('SNOWFLAKE_USER', SF_USER), ('SNOWFLAKE_PASSWORD', SF_PASSWORD), ('SNOWFLAKE_ACCOUNT', SF_ACCOUNT), ('SNOWFLAKE_DATABASE', SF_DATABASE), ('SNOWFLAKE_SCHEMA', SF_SCHEMA)]
-missing = [n for n,v in REQUIRED if not v]
-if missing:
-    sys.exit(f"Missing env vars: {', '.join(missing)}. Add them or create a .env file.")
+
+
+def check_config():
+    """Exits when required env vars are missing (checked when a run starts, not on import)."""
+    missing = [n for n,v in REQUIRED if not v]
+    if missing:
+        sys.exit(f"Missing env vars: {', '.join(missing)}. Add them or create a .env file.")
+
+
+def import_deps():
+    """Imports the HTTP/progress dependencies of a real run; exits with install instructions if one is missing."""
+    try:
+        import requests, bs4, tqdm
+    except ModuleNotFoundError as e:
+        sys.exit(f"Missing package: {e.name}. Install with: pip install requests beautifulsoup4 tqdm snowflake-connector-python")
+    return requests
 
 
 def get_page(session, url):
@@ -52,15 +76,19 @@ def get_page(session, url):
     return r.text
 
 
-def find_json_resources(page_url, html):
+@metrics.timed('get_ckan_resources')
+def find_json_resources(session, page_url, html, manifest=None, force=False):
     # Try CKAN
     p = urlparse(page_url)
     out = []
-    if 'catalog.data.gov' in p.netloc.lower():
+    if urlparse(CKAN_URL).netloc.lower() == p.netloc.lower():
         try:
             slug = p.path.strip('/').split('/')[-1]
-            api = f'https://catalog.data.gov/api/3/action/package_show?id={slug}'
-            r = session.get(api, timeout=10); r.raise_for_status(); data = r.json()
+            api = f'{CKAN_URL}/api/3/action/package_show?id={slug}'
+            if manifest:
+                data = manifest.get_json(session, api, force=force)
+            else:
+                r = session.get(api, timeout=10); r.raise_for_status(); data = r.json()
             for res in data.get('result', {}).get('resources', []):
                 url = res.get('url') or res.get('download_url')
                 if not url: continue
@@ -71,6 +99,7 @@ def find_json_resources(page_url, html):
         except Exception:
             pass
     # Fallback: scrape
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
     for a in soup.find_all('a', href=True):
         href = a['href'].strip()
@@ -80,85 +109,394 @@ def find_json_resources(page_url, html):
     return out
 
 
-def download_with_progress(session, url, out_dir, filename=None):
-    with session.get(url, stream=True, timeout=60) as r:
-        r.raise_for_status()
-        if filename:
-            name = filename
-        else:
-            name = os.path.basename(urlparse(r.url).path) or 'data.json'
-        name = re.sub(r"[\\/:*?\"<>|]", '_', name)
-        out_path = os.path.join(out_dir, name)
-        total = r.headers.get('content-length')
-        total = int(total) if total and total.isdigit() else None
-        if total:
-            with open(out_path, 'wb') as f, tqdm(total=total, unit='B', unit_scale=True, desc=name) as bar:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        bar.update(len(chunk))
-        else:
-            with open(out_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-        return out_path
-
-
-def parse_json_rows(path):
-    rows = []
-    with open(path, 'r', encoding='utf-8') as fh:
-        text = fh.read().strip()
-        try:
-            parsed = json.loads(text)
-            if isinstance(parsed, list):
-                rows = parsed
-            elif isinstance(parsed, dict):
-                rows = [parsed]
-        except json.JSONDecodeError:
-            # try NDJSON
-            fh.seek(0)
-            for line in fh:
-                line = line.strip()
-                if not line: continue
-                try:
-                    rows.append(json.loads(line))
-                except Exception:
-                    continue
-    return rows
-
-
-def upload_rows_to_snowflake(rows, batch_size=500):
-    conn = snowflake.connector.connect(user=SF_USER, password=SF_PASSWORD, account=SF_ACCOUNT, warehouse=SF_WAREHOUSE, database=SF_DATABASE, schema=SF_SCHEMA)
-    cur = conn.cursor()
-    try:
+@metrics.timed('download')
+def download_with_progress(session, url, out_dir, filename=None, connections=4, manifest=None, force=False,
+                           compressed=False):
+    """Returns (path, changed). With a `manifest` the GET is conditional and a 304 reuses the cached file.
+
+    With `compressed` the file is requested with gzip and kept gzip-compressed as `<name>.gz`.
+    """
+    from tqdm import tqdm
+    validators = manifest.conditional_headers(url) if manifest and not force else {}
+    probed = http_download.probe(session, url, headers=validators, compressed=compressed)
+    if probed.not_modified:
+        probed.response.close()
+        metrics.incr('not_modified', stage='download')
+        return manifest.get(url)['path'], False
+    if filename:
+        name = filename
+    else:
+        name = os.path.basename(urlparse(probed.url).path) or 'data.json'
+    name = re.sub(r"[\\/:*?\"<>|]", '_', name)
+    if compressed and not name.endswith('.gz'):
+        name += '.gz'
+    out_path = os.path.join(out_dir, name)
+    sha256 = manifest.expected_sha256(url, probed) if manifest and not compressed else None
+    with tqdm(total=None if compressed else probed.size, unit='B', unit_scale=True, desc=name) as bar:
+        out_path = http_download.fetch(session, url, out_path, connections=connections, sha256=sha256,
+                                       progress=bar.update, probed=probed, compressed=compressed)
+    metrics.incr('bytes', os.path.getsize(out_path), stage='download')
+    if not manifest:
+        return out_path, True
+    return out_path, manifest.record(url, out_path, probed.headers, http_download.sha256_file(out_path)) or force
+
+
+@metrics.timed_iter('parse_json_rows', counter='rows')
+def parse_json_rows(source, start=0, layout=None, meta=None, raw=False):
+    """Yields rows lazily from a path or HTTP/file stream (Socrata rows.json, JSON array or NDJSON).
+
+    The reader keeps `.meta`, `.layout` and `.tell()`; `start`/`layout`/`meta` resume a file mid-way (see json_stream.py).
+    With `raw` the rows are their JSON text, passed to the upload as is; use it when nothing needs the decoded values.
+    """
+    return JsonRowReader(source, start=start, layout=layout, meta=meta, raw=raw)
+
+
+def iter_batches(rows, batch_size):
+    it = iter(rows)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def open_session(size=1):
+    """Pooled Snowflake session (see sf_session.py) built from the SNOWFLAKE_* settings above."""
+    return Session(config_from_env(user=SF_USER, password=SF_PASSWORD, account=SF_ACCOUNT, warehouse=SF_WAREHOUSE,
+                                   database=SF_DATABASE, schema=SF_SCHEMA), size=size)
+
+
+@metrics.timed('upload_rows_to_snowflake')
+def upload_rows_to_snowflake(rows, batch_size=500, total=None, checkpoint=None, prepare=None):
+    """Inserts rows from any iterable (e.g. the parse_json_rows generator). Returns the row count.
+
+    With a `checkpoint` (checkpoint.py), `rows` must be a parse_json_rows reader: each batch is inserted under its
+    load id and then journaled with the reader's byte offset. `prepare` maps a source batch to the rows to insert
+    (e.g. Validator.check), so the journal counts source rows. Raw rows (parse_json_rows(raw=True)) are sent as is.
+    """
+    from tqdm import tqdm
+    sent = 0
+    raw = getattr(rows, 'raw', False)
+    with open_session() as session:
         full_table = f"{SF_DATABASE}.{SF_SCHEMA}.{SF_TABLE}"
         insert_sql = f"INSERT INTO {full_table} (data) VALUES (PARSE_JSON(%s))"
-        total = len(rows)
-        with tqdm(total=total, desc='Upload rows', unit='rows') as bar:
-            for i in range(0, total, batch_size):
-                batch = rows[i:i+batch_size]
-                params = [(json.dumps(r),) for r in batch]
-                cur.executemany(insert_sql, params)
-                conn.commit()
+        if total is None and hasattr(rows, '__len__'):
+            total = len(rows)
+        with tqdm(total=total, initial=checkpoint.rows if checkpoint else 0, desc='Upload rows', unit='rows') as bar:
+            if checkpoint:
+                checkpoint.begin()
+            for batch in iter_batches(rows, batch_size):
+                payload = prepare(batch) if prepare else batch
+                if checkpoint:
+                    with metrics.span('insert_batch', rows=len(payload)):
+                        if payload:
+                            insert_batch(session, full_table, checkpoint.load_id(), payload, raw)
+                    checkpoint.commit(len(batch), rows.tell(), rows.layout, len(payload))
+                elif payload:
+                    params = [(r,) for r in payload] if raw else [(json.dumps(r),) for r in payload]
+                    # autocommit: each batch is committed when the statement completes
+                    with metrics.span('executemany_batch', rows=len(payload)):
+                        session.executemany(insert_sql, params)
+                sent += len(payload)
+                metrics.incr('rows', len(payload), stage='upload_rows_to_snowflake')
                 bar.update(len(batch))
+        print(session.timing_report())
+    return sent
+
+
+def upload_file_checkpointed(path, sha256, batch_size=500, quarantine=None, rollup=None):
+    """Insert-mode load of a local file that survives interruptions (see checkpoint.py).
+
+    A rerun after a crash seeks to the first uncommitted batch; batches are never inserted twice. Returns the rows
+    inserted for this file across all runs of the load. When validating or aggregating, the committed rows are
+    replayed locally first, so duplicate keys and the rollup still cover the whole file.
+    """
+    ckpt = Checkpoint.for_file(path, sha256, f"{SF_DATABASE}.{SF_SCHEMA}.{SF_TABLE}", batch_size)
+    meta = None
+    validator = Validator(None, quarantine_path=quarantine, append=ckpt.resuming) if quarantine else None
+    if ckpt.resuming:
+        print(f"Resuming: {ckpt.rows} rows in {ckpt.batches} batches already committed, continuing at byte {ckpt.offset}")
+        meta = read_meta(path)
+        if quarantine or rollup:
+            replay = Validator(None, meta=meta) if quarantine else None
+            for batch in iter_batches(islice(JsonRowReader(path), ckpt.rows), ckpt.batch_size):
+                batch = replay.check(batch) if replay else batch
+                if rollup and batch:
+                    rollup.add(batch, meta)
+            if replay:
+                validator.seen = replay.seen
+    rows = parse_json_rows(path, start=ckpt.offset, layout=ckpt.layout, meta=meta, raw=not (quarantine or rollup))
+    if validator:
+        validator.source = rows
+
+    def prepare(batch):
+        if validator:
+            batch = validator.check(batch)
+        if rollup and batch:
+            rollup.add(batch, rows.meta)
+        return batch
+
+    try:
+        upload_rows_to_snowflake(rows, batch_size=ckpt.batch_size, checkpoint=ckpt, prepare=prepare)
     finally:
-        try: cur.close()
-        except: pass
-        try: conn.close()
-        except: pass
+        if validator:
+            validator.close()
+    if validator:
+        print(validator.report())
+    ckpt.finish()
+    return ckpt.inserted
 
 
-if __name__ == '__main__':
-    p = argparse.ArgumentParser()
-    p.add_argument('url', nargs='?', default='https://catalog.data.gov/dataset/border-crossing-entry-data-683ae')
+@metrics.timed('upload_rows_bulk')
+def upload_rows_bulk(rows, fmt='ndjson', rows_per_chunk=100_000, parallel=4, work_dir=None):
+    """Writes rows to compressed chunk files, PUTs them in parallel and loads them with one COPY INTO.
+
+    Returns the number of rows COPY reported as loaded.
+    """
+    from tqdm import tqdm
+    prefix = f"{SF_TABLE.lower()}_{time.strftime('%Y%m%d%H%M%S')}"
+    stage_path = f"{SF_DATABASE}.{SF_SCHEMA}.{SF_STAGE}/combined"
+    pattern = bulk_load.pattern_for(prefix, fmt)
+    tmp = tempfile.mkdtemp(prefix='sf_chunks_', dir=work_dir)
+    try:
+        with open_session(size=parallel) as session:
+            with tqdm(desc='Stage rows', unit='rows') as bar:
+                chunks = bulk_load.write_chunks(rows, tmp, prefix, fmt=fmt, rows_per_chunk=rows_per_chunk,
+                                                raw=getattr(rows, 'raw', False))
+                staged = bulk_load.put_chunks(session, chunks, stage_path, parallel=parallel, progress=bar.update)
+            if not staged:
+                return 0
+            print(f'COPY INTO {SF_TABLE} from {stage_path} ({staged} rows staged)...')
+            loaded = bulk_load.rows_loaded(session.execute(
+                bulk_load.copy_sql(f"{SF_DATABASE}.{SF_SCHEMA}.{SF_TABLE}", 'data', stage_path, fmt, pattern)))
+            session.execute(f"REMOVE @{stage_path} PATTERN = '{pattern}'")
+            print(session.timing_report())
+            metrics.incr('rows', loaded, stage='upload_rows_bulk')
+            return loaded
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+@metrics.timed('upload_rollup')
+def upload_rollup(rollup, parallel=4):
+    """Replaces the rollup's grouping in the gold table with its current rows (one gzip NDJSON COPY).
+
+    Returns the number of gold rows loaded.
+    """
+    table = f"{SF_DATABASE}.{SF_SCHEMA}.{SF_ROLLUP_TABLE}"
+    prefix = f"rollup_{time.strftime('%Y%m%d%H%M%S')}"
+    stage_path = f"{SF_DATABASE}.{SF_SCHEMA}.{SF_STAGE}/rollup"
+    pattern = bulk_load.pattern_for(prefix, 'ndjson')
+    tmp = tempfile.mkdtemp(prefix='sf_rollup_')
+    try:
+        with open_session(size=parallel) as session:
+            chunks = bulk_load.write_chunks(rollup.rows(), tmp, prefix, fmt='ndjson')
+            staged = bulk_load.put_chunks(session, chunks, stage_path, parallel=parallel)
+            if not staged:
+                return 0
+            print(f'Replacing rollup {rollup.name!r} in {SF_ROLLUP_TABLE} ({staged} rows staged)...')
+            session.execute(f"DELETE FROM {table} WHERE GROUPING = '{rollup.name}'", retry=True)
+            loaded = bulk_load.rows_loaded(session.execute(rollup_copy_sql(table, stage_path, rollup.name, pattern)))
+            session.execute(f"REMOVE @{stage_path} PATTERN = '{pattern}'")
+            metrics.incr('rows', loaded, stage='upload_rollup')
+            return loaded
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+@metrics.timed('pipelined_load')
+def pipelined_load(http, url, out_path, mode='bulk', fmt='ndjson', batch_size=500, chunk_rows=100_000,
+                   serialize_workers=2, upload_workers=4, queue_size=8, validators=None, quarantine=None,
+                   rollup=None, compressed=False):
+    """Download -> parse -> serialize -> upload with bounded queues between the stages, so the
+    network transfer, JSON parsing and Snowflake round-trips overlap.
+
+    The download is a single stream (parsing needs the bytes in order) that is also written to
+    `out_path`. Returns a dict with rows sent, the response headers, the file's SHA-256 and
+    whether the server answered 304 (nothing was loaded then). With `quarantine` (a path) rows are
+    validated in the parse stage and failures are written there instead of being uploaded. With
+    `rollup` (a rollup.Rollup) the uploaded rows are also aggregated in the parse stage. With
+    `compressed` the body is requested with gzip and `out_path` (e.g. `rows.json.gz`) keeps it
+    gzip-compressed, while the parse stage gets it decompressed chunk by chunk.
+    """
+    from tqdm import tqdm
+    result = {'rows': 0, 'headers': {}, 'sha256': None, 'not_modified': False}
+    lock = threading.Lock()
+    seq = count()
+    prefix = f"{SF_TABLE.lower()}_{time.strftime('%Y%m%d%H%M%S')}"
+    stage_path = f"{SF_DATABASE}.{SF_SCHEMA}.{SF_STAGE}/combined"
+    insert_sql = f"INSERT INTO {SF_DATABASE}.{SF_SCHEMA}.{SF_TABLE} (data) VALUES (PARSE_JSON(%s))"
+    tmp = tempfile.mkdtemp(prefix='sf_chunks_')
+    raw = not (quarantine or rollup)  # nothing needs decoded rows: pass their JSON text through
+
+    def download(_):
+        headers = {'Accept-Encoding': 'gzip', **(validators or {})} if compressed else validators or {}
+        try:
+            with http.get(url, stream=True, timeout=60, headers=headers) as r:
+                if r.status_code == 304:
+                    result['not_modified'] = True
+                    return
+                r.raise_for_status()
+                result['headers'] = r.headers
+                if compressed:
+                    yield from download_gzip(r)
+                    return
+                digest = hashlib.sha256()
+                with open(out_path + '.part', 'wb') as f:
+                    for chunk in r.iter_content(http_download.CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            digest.update(chunk)
+                            yield chunk
+            os.replace(out_path + '.part', out_path)
+            result['sha256'] = digest.hexdigest()
+        finally:
+            # Left behind only when this or a later stage failed (the pipeline closes this generator then)
+            if os.path.exists(out_path + '.part'):
+                os.remove(out_path + '.part')
+
+    def download_gzip(r):
+        # Gzip bytes go to disk as received and through a decompressor to the parser;
+        # an identity body is passed to the parser as is and gzipped on the way to disk.
+        inflate, out = zlib.decompressobj(16 + zlib.MAX_WBITS), None
+        with open(out_path + '.part', 'wb') as f:
+            try:
+                for chunk in r.raw.stream(http_download.CHUNK_SIZE, decode_content=False):
+                    if not chunk:
+                        continue
+                    if out is None:
+                        out = f if chunk[:2] == b'\x1f\x8b' else gzip.GzipFile(fileobj=f, mode='wb', mtime=0)
+                    out.write(chunk)
+                    data = inflate.decompress(chunk) if out is f else chunk
+                    if data:
+                        yield data
+            finally:
+                if out is not None and out is not f:
+                    out.close()
+        if out is f and not inflate.eof:
+            raise http_download.DownloadError(f"Truncated gzip body from {url}")
+        os.replace(out_path + '.part', out_path)
+        result['sha256'] = http_download.sha256_file(out_path)
+
+    def parse(chunks):
+        rows = JsonRowReader(chunks, raw=raw)
+        if quarantine:
+            rows = Validator(rows, quarantine_path=quarantine)
+        yield from iter_batches(rollup.tap(rows) if rollup else rows, chunk_rows if mode == 'bulk' else batch_size)
+        if quarantine:
+            print(rows.report())
+
+    def serialize(batches):
+        for batch in batches:
+            if mode == 'bulk':
+                yield bulk_load.write_chunk(bulk_load.chunk_path(tmp, prefix, next(seq), fmt), batch, fmt, raw), len(batch)
+            else:
+                yield [(r,) for r in batch] if raw else [(json.dumps(r),) for r in batch], len(batch)
+
+    try:
+        with open_session(size=upload_workers) as session, tqdm(desc='Upload rows', unit='rows') as bar:
+            def upload(items):
+                for payload, n in items:
+                    if mode == 'bulk':
+                        bulk_load.put_file(session, payload, stage_path)
+                        os.remove(payload)
+                    else:
+                        session.executemany(insert_sql, payload)
+                    with lock:
+                        result['rows'] += n
+                        bar.update(n)
+                    yield n
+
+            stats = Pipeline([
+                Stage('download', download),
+                Stage('parse', parse),
+                Stage('serialize', serialize, workers=serialize_workers),
+                Stage('upload', upload, workers=upload_workers),
+            ], maxsize=queue_size).run()
+            print('Pipeline stages (items, busy seconds): ' + ', '.join(f'{k}={v}' for k, v in stats.items()))
+            for name, (items, seconds) in stats.items():
+                metrics.record_span(f'pipeline.{name}', seconds, items=items)
+
+            if mode == 'bulk' and result['rows']:
+                pattern = bulk_load.pattern_for(prefix, fmt)
+                print(f"COPY INTO {SF_TABLE} from {stage_path} ({result['rows']} rows staged)...")
+                result['rows'] = bulk_load.rows_loaded(session.execute(
+                    bulk_load.copy_sql(f"{SF_DATABASE}.{SF_SCHEMA}.{SF_TABLE}", 'data', stage_path, fmt, pattern)))
+                session.execute(f"REMOVE @{stage_path} PATTERN = '{pattern}'")
+            print(session.timing_report())
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return result
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='combined', description='Download the border dataset and load it into Snowflake in one run')
+    p.add_argument('url', nargs='?', default=f'{CKAN_URL}/dataset/border-crossing-entry-data-683ae')
     p.add_argument('--out', '-o', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads'))
-    p.add_argument('--batch', type=int, default=500)
-    args = p.parse_args()
+    p.add_argument('--connections', type=int, default=4, help='Parallel Range connections for the download')
+    p.add_argument('--batch', type=int, default=500, help='Rows per INSERT batch (insert mode)')
+    p.add_argument('--mode', choices=['insert', 'bulk'], default='bulk', help='bulk: staged chunks + one COPY INTO; insert: batched INSERT ... PARSE_JSON (small loads)')
+    p.add_argument('--format', dest='fmt', choices=bulk_load.FORMATS, default='ndjson', help='Chunk file format for bulk mode')
+    p.add_argument('--chunk-rows', type=int, default=100_000, help='Rows per staged chunk file (bulk mode)')
+    p.add_argument('--put-threads', type=int, default=4, help='Concurrent PUTs (bulk mode)')
+    p.add_argument('--report', default='load_report.json', help='JSON file that accumulates rows/s per load mode')
+    p.add_argument('--pipeline', action='store_true', help='Overlap download, parse and upload through bounded queues')
+    p.add_argument('--serialize-workers', type=int, default=2, help='Chunk-writer threads (pipeline mode)')
+    p.add_argument('--upload-workers', type=int, default=4, help='PUT/INSERT threads (pipeline mode)')
+    p.add_argument('--queue-size', type=int, default=8, help='Bounded queue length between pipeline stages')
+    p.add_argument('--force', action='store_true', help='Bypass the download manifest: re-download and reload even if unchanged')
+    p.add_argument('--validate', action='store_true', help='Check rows locally (dates, values, lat/lon, port code, duplicate keys) and quarantine failures instead of loading them')
+    p.add_argument('--quarantine', help='Quarantine file for --validate (default: <out>/border_crossing_dataset.quarantine.ndjson.gz)')
+    p.add_argument('--rollup', nargs='?', const='port,measure,border,month', help='Also aggregate rows locally into a gold rollup grouped by these dimensions (port, state, border, measure, month, year; default: port,measure,border,month) and load it into ROLLUP_TABLE')
+    p.add_argument('--rollup-aggs', default='sum,count,min,max', help='Rollup aggregates over VALUE (sum, count, min, max)')
+    p.add_argument('--rollup-only', action='store_true', help='Load only the rollup, not the raw rows')
+    p.add_argument('--rollup-state', help='Saved rollup to update incrementally (default: <out>/border_rollup_<dimensions>.json)')
+    p.add_argument('--since', help='Incremental rollup: re-aggregate only rows dated from this period (YYYY-MM or YYYY) and keep the saved groups before it')
+    p.add_argument('--gzip', dest='compressed', action='store_true', help='Request gzip and keep the download gzip-compressed on disk (border_crossing_dataset.json.gz); rows are decompressed while parsing')
+    p.add_argument('--no-checkpoint', action='store_true', help='Insert mode: plain batched INSERTs without the resume journal and load ids')
+    p.add_argument('--dry-run', action='store_true', help='Check the configuration and print the load plan, then exit (no network)')
+    args = p.parse_args(argv)
+    if (args.rollup_only or args.since) and not args.rollup:
+        args.rollup = 'port,measure,border,month'
 
+    check_config()
+    if args.dry_run:
+        try:
+            group_by, aggs = parse_rollup_spec(args.rollup, args.rollup_aggs) if args.rollup else ((), ())
+        except ValueError as e:
+            sys.exit(str(e))
+        target = f"{SF_DATABASE}.{SF_SCHEMA}"
+        print(f"Dry run: {args.url} -> {args.out}" + (' (kept gzip-compressed)' if args.compressed else ''))
+        print(f"  raw rows: {'skipped (--rollup-only)' if args.rollup_only else f'{args.mode} mode into {target}.{SF_TABLE}'}"
+              + (f" ({args.fmt} chunks of {args.chunk_rows} rows via @{SF_STAGE})" if args.mode == 'bulk' else '')
+              + (', pipelined' if args.pipeline and not args.rollup_only else '')
+              + (', checkpointed' if args.mode == 'insert' and not args.pipeline and not args.no_checkpoint else ''))
+        if args.validate:
+            print("  validation: on")
+        if args.rollup:
+            print(f"  rollup: {','.join(group_by)} ({','.join(aggs)}) into {target}.{SF_ROLLUP_TABLE}"
+                  + (f", since {args.since}" if args.since else ''))
+        manifest = Manifest.for_dir(args.out)
+        print(f"  manifest: {len(manifest.entries)} known URL(s){' (ignored: --force)' if args.force else ''}")
+        return 0
+
+    requests = import_deps()
     os.makedirs(args.out, exist_ok=True)
     session = requests.Session()
     session.headers.update({'User-Agent': 'combined-downloader/1.0'})
+    manifest = Manifest.for_dir(args.out)
+    quarantine = (args.quarantine or os.path.join(args.out, 'border_crossing_dataset.quarantine.ndjson.gz')) if args.validate else None
+    rollup = None
+    if args.rollup:
+        try:
+            rollup = Rollup(args.rollup, args.rollup_aggs, since=args.since)
+            rollup_state = args.rollup_state or os.path.join(args.out, f"border_rollup_{rollup.name.replace(',', '_')}.json")
+            if args.since:
+                if not os.path.exists(rollup_state):
+                    sys.exit(f'--since updates a saved rollup, but {rollup_state} does not exist; run once without --since first')
+                rollup.load(rollup_state)
+        except (RuntimeError, ValueError) as e:
+            sys.exit(str(e))
 
     print('Fetching dataset page...')
     try:
@@ -166,7 +504,7 @@ if __name__ == '__main__':
     except Exception as e:
         sys.exit(f'Failed to fetch page: {e}')
 
-    resources = find_json_resources(args.url, html)
+    resources = find_json_resources(session, args.url, html, manifest=manifest, force=args.force)
     if not resources:
         sys.exit('No JSON resources found on the page')
 
@@ -178,17 +516,89 @@ if __name__ == '__main__':
     if not target:
         target = resources[0]
 
+    def load_rollup():
+        rollup.save(rollup_state)
+        print(rollup.report())
+        gold = upload_rollup(rollup, parallel=args.put_threads)
+        print(f'Rollup loaded: {gold} rows into {SF_ROLLUP_TABLE} (state saved to {rollup_state})')
+
+    if args.pipeline and not args.rollup_only:
+        out_path = os.path.join(args.out, 'border_crossing_dataset.json' + ('.gz' if args.compressed else ''))
+        validators = {} if args.force or not manifest.is_loaded(target, 'combined') else manifest.conditional_headers(target)
+        print(f'Pipelined download -> parse -> upload ({args.mode} mode):', target)
+        started = time.perf_counter()
+        res = pipelined_load(session, target, out_path, mode=args.mode, fmt=args.fmt, batch_size=args.batch,
+                             chunk_rows=args.chunk_rows, serialize_workers=args.serialize_workers,
+                             upload_workers=args.upload_workers, queue_size=args.queue_size, validators=validators,
+                             quarantine=quarantine, rollup=rollup, compressed=args.compressed)
+        if res['not_modified']:
+            print('Dataset unchanged since the last successful load; nothing to do (use --force to reload)')
+            return 0
+        manifest.record(target, out_path, res['headers'], res['sha256'])
+        if not res['rows']:
+            sys.exit('No rows to upload')
+        print(f"Upload complete: {res['rows']} rows")
+        if rollup:
+            load_rollup()
+        manifest.mark_loaded(target, 'combined')
+        bulk_load.record_report(args.report, args.mode, res['rows'], time.perf_counter() - started)
+        return 0
+
     print('Downloading:', target)
-    local = download_with_progress(session, target, args.out, filename='border_crossing_dataset.json')
-    print('Downloaded to', local)
+    local, changed = download_with_progress(session, target, args.out, filename='border_crossing_dataset.json',
+                                            connections=args.connections, manifest=manifest, force=args.force,
+                                            compressed=args.compressed)
+    print('Downloaded to' if changed else 'Unchanged, cached at', local)
+    consumer = f'rollup:{rollup.name}' if args.rollup_only else 'combined'
+    if not args.force and manifest.is_loaded(target, consumer):
+        print('Dataset unchanged since the last successful load; skipping parse and upload (use --force to reload)')
+        return 0
+
+    started = time.perf_counter()
+    if args.mode == 'insert' and not args.rollup_only and not args.no_checkpoint:
+        print('Streaming rows to Snowflake (insert mode, checkpointed)...')
+        sha256 = (manifest.get(target) or {}).get('sha256') or http_download.sha256_file(local)
+        sent = upload_file_checkpointed(local, sha256, batch_size=args.batch, quarantine=quarantine, rollup=rollup)
+        if not sent:
+            sys.exit('No rows to upload')
+        print(f'Upload complete: {sent} rows')
+        if rollup:
+            load_rollup()
+        manifest.mark_loaded(target, 'combined')
+        bulk_load.record_report(args.report, args.mode, sent, time.perf_counter() - started)
+        return 0
 
-    print('Parsing JSON rows...')
-    rows = parse_json_rows(local)
-    print(f'Parsed {len(rows)} rows')
+    rows = parse_json_rows(local, raw=not (quarantine or rollup))
+    if quarantine:
+        rows = validator = Validator(rows, quarantine_path=quarantine)
+    if args.rollup_only:
+        print('Aggregating rows locally (rollup only)...')
+        rollup.consume(rows)
+        if quarantine:
+            print(validator.report())
+        if not rollup.groups:
+            sys.exit('No rows to aggregate')
+        load_rollup()
+        manifest.mark_loaded(target, consumer)
+        return 0
 
-    if not rows:
+    print(f'Streaming rows to Snowflake ({args.mode} mode)...')
+    if rollup:
+        rows = rollup.tap(rows)
+    if args.mode == 'bulk':
+        sent = upload_rows_bulk(rows, fmt=args.fmt, rows_per_chunk=args.chunk_rows, parallel=args.put_threads)
+    else:
+        sent = upload_rows_to_snowflake(rows, batch_size=args.batch)
+    if quarantine:
+        print(validator.report())
+    if not sent:
         sys.exit('No rows to upload')
+    print(f'Upload complete: {sent} rows')
+    if rollup:
+        load_rollup()
+    manifest.mark_loaded(target, 'combined')
+    bulk_load.record_report(args.report, args.mode, sent, time.perf_counter() - started)
 
-    print('Uploading rows to Snowflake...')
-    upload_rows_to_snowflake(rows, batch_size=args.batch)
-    print('Upload complete')
+
+if __name__ == '__main__':
+    main()
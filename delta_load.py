@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+delta_load.py
+
+Row fingerprints for incremental (delta) loads of the border dataset.
+
+Each Socrata data row is identified by its natural key (port code, measure,
+date) and fingerprinted with a hash of its non-system values. Comparing the
+fingerprints of the new file against the snapshot saved by the previous run
+gives the inserted, updated and deleted rows, so only those are staged.
+
+A key that occurs several times in one file counts as one row, the last copy
+(the others are counted as `duplicates`). Changed rows are therefore spilled to
+an anonymous temp file while the source is read and emitted once it is known
+which copy is the last.
+
+The snapshot is a gzip text file of `key<TAB>hash` lines, the key as a JSON
+array; it is replaced only after the caller confirms the delta was loaded
+(`commit_snapshot`).
+"""
+
+import gzip, hashlib, json, os, tempfile
+
+KEY_FIELDS = ('port_code', 'measure', 'date')
+# Positions used by transformations.sql when meta.view.columns is unavailable.
+DEFAULT_KEY_POSITIONS = (10, 13, 12)
+DEFAULT_FIRST_VALUE = 8
+
+
+def key_positions(meta):
+    """Returns (key positions, value positions) from Socrata meta.view.columns, with fixed fallbacks."""
+    columns = ((meta or {}).get('view') or {}).get('columns') or []
+    names = [c.get('fieldName') or '' for c in columns]
+    if all(f in names for f in KEY_FIELDS):
+        keys = tuple(names.index(f) for f in KEY_FIELDS)
+        values = tuple(i for i, n in enumerate(names) if not n.startswith(':'))
+        return keys, values
+    return DEFAULT_KEY_POSITIONS, None
+
+
+def fingerprint(row, keys, values):
+    """(natural key, value hash) for one positional row; key is None when a key field is missing."""
+    try:
+        parts = [row[i] for i in keys]
+    except (IndexError, TypeError):
+        return None, None
+    if any(p is None for p in parts):
+        return None, None
+    picked = [row[i] for i in values] if values else row[DEFAULT_FIRST_VALUE:]
+    digest = hashlib.blake2b(json.dumps(picked, separators=(',', ':')).encode('utf-8'), digest_size=8).hexdigest()
+    return json.dumps(parts, separators=(',', ':')), digest
+
+
+def load_snapshot(path):
+    snapshot = {}
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                key, _, digest = line.rstrip('\n').rpartition('\t')
+                if key and not key.startswith('['):
+                    # Snapshot written before keys were JSON arrays: 'port|measure|date'
+                    key = json.dumps(key.split('|'), separators=(',', ':'))
+                if key:
+                    snapshot[key] = digest
+    except FileNotFoundError:
+        pass
+    return snapshot
+
+
+def commit_snapshot(path, fingerprints):
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        for key, digest in fingerprints.items():
+            f.write(f"{key}\t{digest}\n")
+    os.replace(tmp, path)
+
+
+class Delta:
+    """Streams change records {"op": "I"|"U"|"D", "row": ...} and collects counts and the new fingerprints."""
+
+    def __init__(self, snapshot):
+        self.previous = snapshot
+        self.current = {}
+        self.counts = {'I': 0, 'U': 0, 'D': 0, 'unchanged': 0, 'skipped': 0, 'duplicates': 0}
+        self.keys = self.values = None
+
+    def changes(self, rows):
+        """Yields inserts/updates for the last copy of each changed key, then deletes for keys no longer present.
+
+        `rows` may be a json_stream.JsonRowReader; its `meta` (known once the first row is
+        read) is used to locate the key columns. Records are yielded after `rows` is exhausted.
+        """
+        prev, cur, counts = self.previous, self.current, self.counts
+        last = {}  # key -> position of its last copy, for keys seen more than once
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as spill:
+            for seq, row in enumerate(rows):
+                if self.keys is None:
+                    self.keys, self.values = key_positions(getattr(rows, 'meta', None))
+                key, digest = fingerprint(row, self.keys, self.values)
+                if key is None:
+                    counts['skipped'] += 1
+                    continue
+                if key in cur:
+                    counts['duplicates'] += 1
+                    last[key] = seq
+                cur[key] = digest
+                if prev.get(key) != digest:
+                    spill.write(json.dumps([seq, key, row], separators=(',', ':')) + '\n')
+            spill.seek(0)
+            for line in spill:
+                seq, key, row = json.loads(line)
+                if last.get(key, seq) != seq or prev.get(key) == cur[key]:
+                    continue  # an earlier copy, or the last copy is unchanged
+                op = 'I' if key not in prev else 'U'
+                counts[op] += 1
+                yield {'op': op, 'row': row}
+        counts['unchanged'] = len(cur) - counts['I'] - counts['U']
+        for key in prev.keys() - cur.keys():
+            counts['D'] += 1
+            yield {'op': 'D', 'row': json.loads(key)}
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+download_cache.py
+
+Local manifest of downloaded resources, keyed by URL, so unchanged upstream
+files are neither re-downloaded nor reloaded.
+
+Each entry stores the ETag, Last-Modified, size and SHA-256 of the last copy
+on disk, plus the hash each consumer (e.g. 'combined') last loaded. The next
+request sends If-None-Match / If-Modified-Since; a 304, or a re-download with
+an identical hash, means there is nothing new to parse or load. Updates are
+serialized with a lock so concurrent downloads can share one manifest.
+"""
+
+import json, os, threading, time
+
+MANIFEST_NAME = '.download_manifest.json'
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    @classmethod
+    def for_dir(cls, out_dir):
+        return cls(os.path.join(out_dir, MANIFEST_NAME))
+
+    def get(self, url):
+        return self.entries.get(url)
+
+    def conditional_headers(self, url):
+        """Validators for `url`, sent only while the cached copy is still on disk and intact."""
+        e = self.entries.get(url)
+        if not e:
+            return {}
+        if e.get('path') and not (os.path.exists(e['path']) and os.path.getsize(e['path']) == e.get('size')):
+            return {}
+        headers = {}
+        if e.get('etag'):
+            headers['If-None-Match'] = e['etag']
+        if e.get('last_modified'):
+            headers['If-Modified-Since'] = e['last_modified']
+        return headers
+
+    def expected_sha256(self, url, probed):
+        """SHA-256 the body of `probed` must have, or None when the manifest can't vouch for it.
+
+        The stored hash applies only when the server still sends the same strong ETag (or, without
+        one, the same Last-Modified) and the same size, i.e. the bytes are the ones hashed last time.
+        A weak ETag or a gzip transfer (size unknown) is not enough.
+        """
+        e = self.entries.get(url)
+        if not e or not e.get('sha256') or probed.size is None or probed.size != e.get('size'):
+            return None
+        etag = probed.validator['etag']
+        if etag:
+            same = not etag.startswith('W/') and etag == e.get('etag')
+        else:
+            same = bool(probed.validator['last_modified']) and probed.validator['last_modified'] == e.get('last_modified')
+        return e['sha256'] if same else None
+
+    def record(self, url, path, headers, sha256):
+        """Stores a fresh download. Returns True if the content differs from the previous copy."""
+        with self.lock:
+            prev = self.entries.get(url) or {}
+            self.entries[url] = {
+                'path': path,
+                'etag': headers.get('etag'),
+                'last_modified': headers.get('last-modified'),
+                'size': os.path.getsize(path),
+                'sha256': sha256,
+                'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'loaded': prev.get('loaded', {}),
+            }
+            self.save()
+        return prev.get('sha256') != sha256
+
+    def is_loaded(self, url, consumer):
+        e = self.entries.get(url)
+        return bool(e and e.get('sha256') and e.get('loaded', {}).get(consumer) == e['sha256'])
+
+    def mark_loaded(self, url, consumer):
+        with self.lock:
+            e = self.entries.get(url)
+            if e:
+                e.setdefault('loaded', {})[consumer] = e.get('sha256')
+                self.save()
+
+    def get_json(self, session, url, force=False, timeout=10):
+        """Conditional GET for small JSON documents (e.g. CKAN package_show); the body is cached in the manifest."""
+        e = self.entries.get(url) or {}
+        headers = {} if force or 'body' not in e else {
+            k: v for k, v in (('If-None-Match', e.get('etag')), ('If-Modified-Since', e.get('last_modified'))) if v}
+        r = session.get(url, timeout=timeout, headers=headers)
+        if r.status_code == 304:
+            return e['body']
+        r.raise_for_status()
+        body = r.json()
+        with self.lock:
+            self.entries[url] = {'etag': r.headers.get('etag'), 'last_modified': r.headers.get('last-modified'),
+                                 'body': body, 'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            self.save()
+        return body
+
+    def save(self):
+        with self.lock:
+            tmp = self.path + '.tmp'
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp, self.path)
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 """Compact Data.gov downloader (JSON preferred)."""
 
-import argparse, os, re, sys
+import argparse, hashlib, os, re, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from urllib.parse import urlparse, unquote
-import requests
-from bs4 import BeautifulSoup
-from tqdm import tqdm
+
+import http_download, metrics
+from download_cache import Manifest
+
+# CKAN catalog the dataset URLs belong to (overridable, e.g. for the offline benchmarks)
+CKAN_URL = os.getenv('CKAN_URL', 'https://catalog.data.gov').rstrip('/')
 
 
 def get_filename(response, url):
@@ -20,22 +25,34 @@ def get_filename(response, url):
             return clean_name
     return os.path.basename(urlparse(url).path) or "downloaded_data.json"
 
-def get_ckan_resources(session, url):
-    """Attempts to fetch resources via CKAN API."""
-    if "catalog.data.gov" not in url: return []
+@metrics.timed('get_ckan_resources')
+def get_ckan_resources(session, url, manifest=None, force=False, strict=False):
+    """Attempts to fetch resources via CKAN API (conditional GET through `manifest` when given).
+
+    A failed package_show gives [] (the caller falls back to scraping), or raises with `strict`.
+    """
+    if urlparse(CKAN_URL).netloc not in url: return []
     try:
         dataset_id = urlparse(url).path.strip('/').split('/')[-1]
-        api = f"https://catalog.data.gov/api/3/action/package_show?id={dataset_id}"
-        res = session.get(api, timeout=10).json()
+        api = f"{CKAN_URL}/api/3/action/package_show?id={dataset_id}"
+        if manifest:
+            res = manifest.get_json(session, api, force=force)
+        else:
+            r = session.get(api, timeout=10)
+            r.raise_for_status()
+            res = r.json()
         return [
             {'url': r.get('url'), 'fmt': r.get('format', '').lower()} 
             for r in res.get('result', {}).get('resources', [])
         ]
     except Exception:
+        if strict:
+            raise
         return []
 
 def scrape_fallback(url, html):
     """Fallback: Scrapes simple hrefs ending in data extensions."""
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
     links = set()
     for a in soup.find_all('a', href=True):
@@ -44,44 +61,258 @@ def scrape_fallback(url, html):
             links.add(full)
     return [{'url': l, 'fmt': 'unknown'} for l in links]
 
-def download(session, url, out_dir, force_filename=None):
+@metrics.timed('download')
+def download(session, url, out_dir, force_filename=None, connections=4, manifest=None, force=False, compressed=False,
+             claim=None):
+    """Ranged, resumable download (see http_download.py); falls back to a single stream.
+
+    With a `manifest`, the request is conditional and an unchanged file is not fetched again.
+    With `compressed`, gzip is requested and the file is kept gzip-compressed as `<name>.gz`.
+    `claim(dest, url)` may replace the destination path, e.g. to keep concurrent downloads apart.
+    """
+    from tqdm import tqdm
     try:
-        with session.get(url, stream=True, timeout=60) as r:
-            r.raise_for_status()
-            
-            # Use forced filename if provided, otherwise detect from headers/url
-            if force_filename:
-                name = force_filename
-            else:
-                name = re.sub(r"[\\/:*?\"<>|]", '_', get_filename(r, url))
-            
-            dest = os.path.join(out_dir, name)
-            
-            total = int(r.headers.get('content-length', 0))
-            with open(dest, 'wb') as f, tqdm(total=total, unit='B', unit_scale=True, desc=name) as bar:
-                for chunk in r.iter_content(8192):
-                    f.write(chunk)
-                    bar.update(len(chunk))
-            return dest
+        validators = manifest.conditional_headers(url) if manifest and not force else {}
+        probed = http_download.probe(session, url, headers=validators, compressed=compressed)
+        if probed.not_modified:
+            probed.response.close()
+            print(f" -> Unchanged since last run: {url}")
+            metrics.incr('not_modified', stage='download')
+            return manifest.get(url)['path']
+
+        # Use forced filename if provided, otherwise detect from headers/url
+        if force_filename:
+            name = force_filename
+        else:
+            name = re.sub(r"[\\/:*?\"<>|]", '_', get_filename(probed.response, url))
+
+        dest = os.path.join(out_dir, name)
+        if compressed and not dest.endswith('.gz'):
+            dest += '.gz'
+        if claim:
+            dest = claim(dest, url)
+
+        sha256 = manifest.expected_sha256(url, probed) if manifest and not compressed else None
+        with tqdm(total=probed.size or 0, unit='B', unit_scale=True, desc=name) as bar:
+            dest = http_download.fetch(session, url, dest, connections=connections, sha256=sha256,
+                                       progress=bar.update, probed=probed, compressed=compressed)
+        metrics.incr('bytes', os.path.getsize(dest), stage='download')
+        if manifest and not manifest.record(url, dest, probed.headers, http_download.sha256_file(dest)):
+            print(f" -> Content unchanged since last run: {url}")
+        return dest
     except Exception as e:
         print(f"Failed {url}: {e}", file=sys.stderr)
         return None
 
-def main():
-    p = argparse.ArgumentParser()
-    p.add_argument('url', nargs='?', default='https://catalog.data.gov/dataset/border-crossing-entry-data-683ae')
+class HostLimiter:
+    """Caps open connections per host; a ranged download takes all the connections it will use at once."""
+
+    def __init__(self, per_host=6):
+        self.per_host = per_host
+        self.in_use = {}
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def hold(self, url, n=1):
+        """Waits until `n` connections (capped at the per-host limit) to url's host are free; yields n."""
+        host = urlparse(url).netloc
+        n = max(1, min(n, self.per_host))
+        with self.cond:
+            self.cond.wait_for(lambda: self.in_use.get(host, 0) + n <= self.per_host)
+            self.in_use[host] = self.in_use.get(host, 0) + n
+        try:
+            yield n
+        finally:
+            with self.cond:
+                self.in_use[host] -= n
+                self.cond.notify_all()
+
+
+def search_ckan(session, query, limit=100, page_size=100):
+    """CKAN package_search; returns (slug, resources) for up to `limit` datasets (results already list resources)."""
+    found, start = [], 0
+    while len(found) < limit:
+        res = session.get(f"{CKAN_URL}/api/3/action/package_search", timeout=30,
+                          params={'q': query, 'rows': min(page_size, limit - len(found)), 'start': start})
+        res.raise_for_status()
+        packages = res.json().get('result', {}).get('results', [])
+        if not packages:
+            break
+        for pkg in packages:
+            found.append((pkg.get('name'), [{'url': r.get('url'), 'fmt': (r.get('format') or '').lower()}
+                                            for r in pkg.get('resources', [])]))
+        start += len(packages)
+    return found[:limit]
+
+
+@metrics.timed('harvest')
+def harvest(session, datasets, out_dir, manifest=None, only_json=True, connections=4, per_host=6, workers=8,
+            force=False, compressed=False):
+    """Resolves many datasets concurrently and downloads their resources through one bounded pool.
+
+    `datasets` holds slugs / dataset URLs (metadata via package_show) or (slug, resources) pairs from
+    search_ckan. Each dataset downloads into <out_dir>/<slug>; a resource URL listed by several datasets
+    is fetched once, for the first of them. Returns the summary printed by print_summary.
+    """
+    limiter = HostLimiter(per_host)
+    started = time.perf_counter()
+    pending = {}
+    for item in datasets:
+        slug, resources = (item, None) if isinstance(item, str) else item
+        pending.setdefault(urlparse(slug).path.strip('/').split('/')[-1], resources)
+
+    def resolve(slug):
+        if pending[slug] is not None:
+            return slug, pending[slug]
+        try:
+            with limiter.hold(CKAN_URL):
+                return slug, get_ckan_resources(session, f"{CKAN_URL}/dataset/{slug}", manifest=manifest,
+                                                force=force, strict=True)
+        except Exception as e:
+            print(f"Failed package_show for {slug}: {e}", file=sys.stderr)
+            return slug, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        resolved = list(pool.map(resolve, pending))
+    stats = {'datasets': len(resolved), 'empty': 0, 'resources': 0, 'shared': 0, 'downloaded': 0, 'unchanged': 0,
+             'failed': 0, 'bytes': 0, 'hosts': {}, 'metadata_seconds': round(time.perf_counter() - started, 3)}
+    owner = {}
+    for slug, resources in resolved:
+        if resources is None:  # metadata request failed
+            stats['failed'] += 1
+            continue
+        if only_json:
+            resources = [r for r in resources if 'json' in r['fmt'] or (r['url'] or '').lower().endswith('.json')]
+        resources = [r for r in resources if r['url']]
+        stats['empty'] += not resources
+        for r in resources:
+            stats['resources'] += 1
+            if r['url'] in owner:
+                stats['shared'] += 1
+            else:
+                owner[r['url']] = slug
+    lock = threading.Lock()
+    # Destination path -> URL. Resources of one dataset whose names resolve alike (e.g. two .../rows.json) would
+    # share a file and its .part; the later one gets the URL's hash in its name. Paths the manifest already
+    # records are reserved first, so every URL keeps its file across runs.
+    claimed = {}
+    for url in owner if manifest else ():
+        e = manifest.get(url)
+        if e and e.get('path'):
+            claimed[e['path']] = url
+
+    def claim(dest, url):
+        with lock:
+            if claimed.setdefault(dest, url) == url:
+                return dest
+            head, name = os.path.split(dest)
+            stem, dot, ext = name.partition('.')
+            dest = os.path.join(head, f"{stem}-{hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]}{dot}{ext}")
+            claimed[dest] = url
+            return dest
+
+    def fetch(url):
+        dest_dir = os.path.join(out_dir, owner[url])
+        os.makedirs(dest_dir, exist_ok=True)
+        before = manifest.get(url) if manifest else None
+        with limiter.hold(url, 1 if compressed else connections) as n:
+            path = download(session, url, dest_dir, connections=n, manifest=manifest, force=force,
+                            compressed=compressed, claim=claim)
+        # record() stores a new entry for every completed transfer; a 304 leaves the old one in place
+        fresh = bool(path) and (not manifest or manifest.get(url) is not before)
+        size = os.path.getsize(path) if fresh else 0
+        with lock:
+            stats['downloaded' if fresh else 'unchanged' if path else 'failed'] += 1
+            stats['bytes'] += size
+            host = stats['hosts'].setdefault(urlparse(url).netloc, {'files': 0, 'bytes': 0})
+            host['files'] += 1
+            host['bytes'] += size
+        return path
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(fetch, owner))
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    metrics.incr('datasets', stats['datasets'], stage='harvest')
+    metrics.incr('shared_skipped', stats['shared'], stage='harvest')
+    return stats
+
+
+def print_summary(stats):
+    mb = stats['bytes'] / 2**20
+    print(f"Harvested {stats['datasets']} dataset(s) ({stats['empty']} without matching resources) in "
+          f"{stats['seconds']:.1f}s (metadata {stats['metadata_seconds']:.1f}s)")
+    print(f"  {stats['resources']} resource(s), {stats['shared']} shared duplicate(s) skipped: "
+          f"{stats['downloaded']} downloaded, {stats['unchanged']} unchanged, {stats['failed']} failed")
+    print(f"  {mb:.1f} MB at {mb / stats['seconds'] if stats['seconds'] else 0:.1f} MB/s aggregate")
+    for host, h in sorted(stats['hosts'].items(), key=lambda kv: -kv[1]['bytes']):
+        print(f"    {host:<40} {h['files']:>5} file(s) {h['bytes'] / 2**20:>10.1f} MB")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='download', description='Download Data.gov dataset resources (JSON by default)')
+    p.add_argument('url', nargs='?', default=f'{CKAN_URL}/dataset/border-crossing-entry-data-683ae')
     p.add_argument('--out', '-o', default='downloads')
     p.add_argument('--all', dest='only_json', action='store_false', help="Download all formats, not just JSON")
+    p.add_argument('--connections', '-c', type=int, default=4, help="Parallel Range connections per file")
+    p.add_argument('--force', action='store_true', help="Ignore the download manifest and re-fetch everything")
+    p.add_argument('--gzip', dest='compressed', action='store_true', help="Request gzip and keep files gzip-compressed on disk as <name>.gz (single stream per file)")
+    p.add_argument('--harvest', nargs='+', metavar='SLUG', help="Harvest mode: dataset slugs or URLs, each into <out>/<slug>")
+    p.add_argument('--harvest-file', help="Harvest mode: file with one dataset slug or URL per line")
+    p.add_argument('--search', help="Harvest mode: datasets matching this CKAN package_search query")
+    p.add_argument('--search-limit', type=int, default=100, help="Max datasets taken from --search")
+    p.add_argument('--workers', type=int, default=8, help="Concurrent metadata requests / file downloads (harvest)")
+    p.add_argument('--per-host', type=int, default=6, help="Max open connections per host (harvest)")
+    p.add_argument('--dry-run', action='store_true', help="Print what would be fetched and exit (no network)")
     p.set_defaults(only_json=True)
-    args = p.parse_args()
+    args = p.parse_args(argv)
+    harvesting = bool(args.harvest or args.harvest_file or args.search)
+
+    if args.dry_run:
+        manifest = Manifest.for_dir(args.out)
+        targets = list(args.harvest or []) + ([f"@{args.harvest_file}"] if args.harvest_file else []) + \
+            ([f"package_search q={args.search!r} (up to {args.search_limit})"] if args.search else [])
+        print(f"Dry run: {'harvest' if harvesting else 'single dataset'} from {CKAN_URL} into {args.out}")
+        for t in targets or [args.url]:
+            print(f"  {t}")
+        print(f"  formats: {'JSON only' if args.only_json else 'all'}, "
+              + ("kept gzip-compressed, 1 stream" if args.compressed else f"{args.connections} connections") + " per file"
+              + (f", {args.workers} workers, {args.per_host} per host" if harvesting else ''))
+        print(f"  manifest: {len(manifest.entries)} known URL(s){' (ignored: --force)' if args.force else ''}")
+        return 0
 
+    import requests
+    from requests.adapters import HTTPAdapter
     os.makedirs(args.out, exist_ok=True)
     session = requests.Session()
     session.headers.update({"User-Agent": "downloader/2.0"})
+    manifest = Manifest.for_dir(args.out)
+
+    if harvesting:
+        adapter = HTTPAdapter(pool_connections=args.workers, pool_maxsize=args.workers * args.connections)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        datasets = list(args.harvest or [])
+        try:
+            if args.harvest_file:
+                with open(args.harvest_file, 'r', encoding='utf-8') as f:
+                    datasets += [l.strip() for l in f if l.strip() and not l.startswith('#')]
+            if args.search:
+                print(f"Searching {CKAN_URL} for: {args.search}")
+                datasets += search_ckan(session, args.search, limit=args.search_limit)
+        except Exception as e:
+            sys.exit(f"Error collecting datasets: {e}")
+        if not datasets:
+            sys.exit("No datasets to harvest.")
+        print(f"Harvesting {len(datasets)} dataset(s) with {args.workers} workers, {args.per_host} connections per host...")
+        stats = harvest(session, datasets, args.out, manifest=manifest, only_json=args.only_json,
+                        connections=args.connections, per_host=args.per_host, workers=args.workers, force=args.force,
+                        compressed=args.compressed)
+        print_summary(stats)
+        sys.exit(1 if stats['failed'] else 0)
 
     print(f"Fetching metadata for: {args.url}")
     try:
-        resources = get_ckan_resources(session, args.url)
+        resources = get_ckan_resources(session, args.url, manifest=manifest, force=args.force)
         if not resources:
             html = session.get(args.url).text
             resources = scrape_fallback(args.url, html)
@@ -100,7 +331,8 @@ def main():
         # Force the filename for JSON resources
         target_name = "border_crossing_dataset.json" if args.only_json else None
         
-        path = download(session, res['url'], args.out, force_filename=target_name)
+        path = download(session, res['url'], args.out, force_filename=target_name,
+                        connections=args.connections, manifest=manifest, force=args.force, compressed=args.compressed)
         if path:
             print(f" -> Saved to: {path}")
 
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+http_download.py
+
+Download engine shared by download_data_gov.py and combined.py.
+
+- Splits the file into byte ranges fetched over several connections when the
+  server answers a Range probe with 206; otherwise falls back to one stream.
+- Data goes to `<dest>.part`; progress is journaled in `<dest>.part.json` so a
+  crashed or interrupted run resumes each range where it stopped (the journal is
+  discarded if the remote ETag/Last-Modified/size changed).
+- Dropped connections are retried from the last byte received.
+- The finished file is checked against the expected size (and SHA-256 when one
+  is given) before it is renamed into place. Without a SHA-256, resumed and
+  parallel segments are trusted on size alone; callers pass the manifest's hash
+  when the server's validators show the content is the one hashed before
+  (download_cache.Manifest.expected_sha256).
+- `compressed=True` asks for gzip and keeps the body gzip-compressed on disk:
+  the encoded bytes are written as received (or gzipped while writing when the
+  server sends identity). Such downloads are a single stream, never ranged.
+"""
+
+import gzip, hashlib, json, os, re, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+CHUNK_SIZE = 1 << 20
+MIN_SEGMENT = 8 << 20
+JOURNAL_EVERY = 8 << 20
+_CONTENT_RANGE = re.compile(r'bytes\s+\d+-\d+/(\d+)', re.I)
+
+
+class DownloadError(Exception):
+    pass
+
+
+class Probe:
+    """Result of the initial ranged GET: final URL, headers, total size and whether ranges work."""
+
+    def __init__(self, response):
+        self.response = response
+        self.url = response.url
+        self.headers = response.headers
+        self.gzip = response.headers.get('content-encoding', '').lower() == 'gzip'
+        self.not_modified = response.status_code == 304
+        m = _CONTENT_RANGE.match(response.headers.get('content-range', ''))
+        # A 206 without a known total (`bytes 0-0/*`) can't be split into ranges; its
+        # Content-Length is the probe's single byte, not the file's size.
+        self.ranged = response.status_code == 206 and m is not None
+        if m:
+            self.size = int(m.group(1))
+        elif response.status_code == 206:
+            self.size = None
+        else:
+            length = response.headers.get('content-length', '')
+            self.size = int(length) if length.isdigit() and not response.headers.get('content-encoding') else None
+        self.validator = {'etag': response.headers.get('etag'), 'last_modified': response.headers.get('last-modified')}
+
+
+def probe(session, url, timeout=60, headers=None, compressed=False):
+    """Opens `url` asking for its first byte only. A 206 means the server honours Range requests.
+
+    The returned Probe owns an open streaming response; for a plain 200 it is reused as the
+    single-stream fallback so no second request is made. Extra `headers` (e.g. conditional
+    validators) are sent along; a 304 shows up as `not_modified`. With `compressed` the whole
+    body is requested with gzip transfer encoding instead. A 206 that doesn't state the total
+    size is closed and replaced by a plain GET of the whole body.
+    """
+    want = {'Accept-Encoding': 'gzip'} if compressed else {'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'}
+    r = session.get(url, stream=True, timeout=timeout, headers={**want, **(headers or {})})
+    r.raise_for_status()
+    p = Probe(r)
+    if r.status_code == 206 and not p.ranged:
+        r.close()
+        r = session.get(url, stream=True, timeout=timeout, headers={'Accept-Encoding': 'identity', **(headers or {})})
+        r.raise_for_status()
+        p = Probe(r)
+    return p
+
+
+def sha256_file(path, chunk_size=CHUNK_SIZE):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _Journal:
+    """Sidecar JSON recording, per segment, how many bytes are durably on disk."""
+
+    def __init__(self, path, url, size, validator, segments):
+        self.path = path
+        self.state = {'url': url, 'size': size, 'validator': validator, 'segments': segments}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, url, size, validator):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if state.get('url') != url or state.get('size') != size or state.get('validator') != validator:
+            return None
+        return cls(path, url, size, validator, state['segments'])
+
+    def advance(self, idx, done):
+        with self.lock:
+            self.state['segments'][idx][2] = done
+            self._save()
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+def _remove_journal(path):
+    for p in (path, path + '.tmp'):
+        try: os.remove(p)
+        except FileNotFoundError: pass
+
+
+def _plan(size, connections):
+    n = max(1, min(connections, size // MIN_SEGMENT or 1))
+    step = -(-size // n)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+
+def _fetch_segment(session, url, part, journal, idx, progress, retries, timeout, chunk_size):
+    start, end, done = journal.state['segments'][idx]
+    attempt = 0
+    while start + done <= end:
+        try:
+            headers = {'Range': f'bytes={start + done}-{end}', 'Accept-Encoding': 'identity'}
+            with session.get(url, stream=True, timeout=timeout, headers=headers) as r:
+                if r.status_code != 206:
+                    raise DownloadError(f"Server ignored Range for bytes {start + done}-{end} (HTTP {r.status_code})")
+                with open(part, 'r+b') as f:
+                    f.seek(start + done)
+                    unsaved = 0
+                    for chunk in r.iter_content(chunk_size):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        done += len(chunk)
+                        unsaved += len(chunk)
+                        if progress:
+                            progress(len(chunk))
+                        if unsaved >= JOURNAL_EVERY:
+                            f.flush(); os.fsync(f.fileno())
+                            journal.advance(idx, done)
+                            unsaved = 0
+                    f.flush(); os.fsync(f.fileno())
+                    journal.advance(idx, done)
+            if start + done <= end:
+                raise DownloadError(f"Connection closed early at byte {start + done} of segment {start}-{end}")
+        except DownloadError:
+            if attempt >= retries:
+                raise
+            attempt += 1
+            metrics.incr('retries', stage='download')
+            time.sleep(min(2 ** attempt, 30))
+        except Exception as e:
+            if attempt >= retries:
+                raise DownloadError(f"Segment {start}-{end} failed after {retries} retries: {e}") from e
+            attempt += 1
+            metrics.incr('retries', stage='download')
+            time.sleep(min(2 ** attempt, 30))
+
+
+def _single_stream(response, part, progress, chunk_size):
+    with response as r, open(part, 'wb') as f:
+        for chunk in r.iter_content(chunk_size):
+            if chunk:
+                f.write(chunk)
+                if progress:
+                    progress(len(chunk))
+
+
+def _gzip_stream(response, part, progress, chunk_size):
+    """Writes the body gzip-compressed without decoding it: as received when it is gzip already
+    (gzip transfer encoding or a .gz file), compressed while writing otherwise. Returns the body bytes received."""
+    received, out = 0, None
+    with response as r, open(part, 'wb') as f:
+        try:
+            for chunk in r.raw.stream(chunk_size, decode_content=False):
+                if chunk:
+                    if out is None:
+                        out = f if chunk[:2] == b'\x1f\x8b' else gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6, mtime=0)
+                    out.write(chunk)
+                    received += len(chunk)
+                    if progress:
+                        progress(len(chunk))
+        finally:
+            if out is not None and out is not f:
+                out.close()
+    return received
+
+
+def fetch(session, url, dest, connections=4, sha256=None, progress=None, retries=5, timeout=60,
+          chunk_size=CHUNK_SIZE, probed=None, compressed=False):
+    """Downloads `url` to `dest`, ranged/resumable when possible. Returns `dest`.
+
+    `progress` is called with the number of bytes received (e.g. tqdm's `update`).
+    Pass `probed` to reuse a Probe the caller already made (e.g. to read headers first).
+    With `compressed`, `dest` (e.g. `rows.json.gz`) holds the body gzip-compressed.
+    Without `sha256` the result is only checked for size, so corrupted segment bytes go unnoticed.
+    """
+    p = probed or probe(session, url, timeout, compressed=compressed)
+    part, journal_path = dest + '.part', dest + '.part.json'
+
+    if compressed:
+        length = p.headers.get('content-length', '')
+        got = _gzip_stream(p.response, part, progress, chunk_size)
+        if length.isdigit() and got != int(length):
+            raise DownloadError(f"Size mismatch for {url}: expected {length} bytes, got {got}")
+    elif not p.ranged or not p.size:
+        _single_stream(p.response, part, progress, chunk_size)
+    else:
+        p.response.close()
+        journal = _Journal.load(journal_path, p.url, p.size, p.validator)
+        if journal is None or not os.path.exists(part):
+            journal = _Journal(journal_path, p.url, p.size, p.validator, _plan(p.size, connections))
+            with open(part, 'wb') as f:
+                f.truncate(p.size)
+            journal._save()
+        elif progress:
+            progress(sum(seg[2] for seg in journal.state['segments']))
+        pending = [i for i, (s, e, d) in enumerate(journal.state['segments']) if s + d <= e]
+        with ThreadPoolExecutor(max_workers=max(1, len(pending))) as pool:
+            futures = [pool.submit(_fetch_segment, session, p.url, part, journal, i, progress,
+                                   retries, timeout, chunk_size) for i in pending]
+            for f in futures:
+                f.result()
+
+    got = os.path.getsize(part)
+    if p.size is not None and got != p.size and not compressed:
+        raise DownloadError(f"Size mismatch for {url}: expected {p.size} bytes, got {got}")
+    if sha256 and sha256_file(part).lower() != sha256.lower():
+        # Corrupt rather than incomplete: start over next time instead of resuming.
+        os.remove(part)
+        _remove_journal(journal_path)
+        raise DownloadError(f"SHA-256 mismatch for {url}")
+    os.replace(part, dest)
+    _remove_journal(journal_path)
+    return dest
+
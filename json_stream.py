@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+json_stream.py
+
+Constant-memory row reader for the JSON files this project downloads. Rows are
+yielded one at a time from a local file (gzip-compressed when it ends in .gz),
+an open binary file/HTTP stream, or an iterable of byte chunks (e.g.
+`response.iter_content(...)`).
+
+Understands three layouts:
+  - Socrata rows.json: {"meta": {...}, "data": [[...], [...], ...]}
+    (the rows of "data" are streamed; "meta" is kept on `reader.meta`)
+  - a plain JSON array: [{...}, {...}, ...]
+  - NDJSON: one JSON value per line (undecodable lines are skipped)
+
+A top-level object without a "meta"/"data" pair is yielded as a single row,
+which matches what the old whole-file parser did.
+
+With `raw=True` rows are yielded as their JSON text, sliced unchanged out of
+the document (e.g. '["row-1", 0, null, ...]'; line breaks between tokens
+become spaces so each row is one line). Loaders that send JSON text
+anyway (PARSE_JSON, NDJSON chunk files) then skip json.dumps and keep one
+string per row instead of a list of values. Raw NDJSON lines are still
+decoded once to check them, and a bad line is skipped as in decoded mode.
+
+`reader.tell()` is the byte offset just past the last row yielded; a reader
+opened with `start=<offset>, layout=<reader.layout>` on the same file resumes
+right after that row without parsing what comes before it (for a .gz file the
+offset counts decompressed bytes, and resuming decompresses up to it).
+"""
+
+import codecs, gzip, json, os, re
+
+CHUNK_SIZE = 1 << 20
+_WS = re.compile(r'\s*')
+_NUM_TAIL = re.compile(r'[-+.eE0-9]*\Z')
+_TAIL = 16  # a decode error this close to the end of the buffer may just be a value cut off by the chunk boundary
+_decoder = json.JSONDecoder()
+
+
+def _iter_chunks(source, chunk_size, start=0):
+    """Yields raw byte chunks from a path, a binary file-like object or an iterable of bytes.
+
+    A path ending in .gz is decompressed as it is read.
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, '__fspath__'):
+        gz = os.fspath(source)[-3:] in ('.gz', b'.gz')
+        with (gzip.open if gz else open)(source, 'rb') as fh:
+            yield from _iter_chunks(fh, chunk_size, start)
+        return
+    if start:
+        if not hasattr(source, 'seek'):
+            raise ValueError("Resuming at a byte offset needs a path or a seekable file")
+        source.seek(start)
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+        return
+    for chunk in source:
+        if chunk:
+            yield chunk
+
+
+class JsonRowReader:
+    """Iterates the rows of a JSON document while holding only a sliding window of it in memory."""
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE, start=0, layout=None, meta=None, raw=False):
+        self.meta = meta or {}
+        self.layout = layout
+        self.raw = raw
+        self._row = self._text if raw else self._value
+        self._chunks = _iter_chunks(source, chunk_size, start)
+        self._utf8 = codecs.getincrementaldecoder('utf-8-sig' if not start else 'utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._chunk_size = self._want = chunk_size
+        self._resume = bool(start)
+        self._consumed = start  # bytes of input before the current buffer
+        self._dropped = 0  # characters dropped from the front of the buffer
+
+    def __iter__(self):
+        return self._rows() if not self._resume else self._resumed()
+
+    def tell(self):
+        """Byte offset of the cursor (just past the last value read) in the source."""
+        return self._consumed + len(self._buf[:self._pos].encode('utf-8'))
+
+    # -- buffer management -------------------------------------------------
+
+    def _fill(self, need_more=False):
+        """Appends the next chunk(s) to the buffer. Returns False once the source is exhausted."""
+        if self._eof:
+            return False
+        if self._pos:
+            self._consumed += len(self._buf[:self._pos].encode('utf-8'))
+            self._dropped += self._pos
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        # Grow the read size while a single value keeps spanning the buffer so a
+        # large value (typically Socrata "meta") isn't re-decoded once per chunk.
+        target = len(self._buf) + (self._want if need_more else 1)
+        while len(self._buf) < target:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._buf += self._utf8.decode(b'', final=True)
+                self._eof = True
+                break
+            if not self._consumed and not self._buf and chunk.startswith(codecs.BOM_UTF8):
+                self._consumed = len(codecs.BOM_UTF8)  # stripped by the utf-8-sig decoder
+            self._buf += self._utf8.decode(chunk)
+        if need_more:
+            self._want *= 2
+        return True
+
+    def _peek(self):
+        """Skips whitespace and returns the next character ('' at end of input)."""
+        while True:
+            self._pos = _WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise ValueError(f"Expected one of {chars!r} at offset {self._pos}, got {c!r}")
+        self._pos += 1
+        return c
+
+    def _value(self):
+        """Decodes one complete JSON value at the cursor, reading more input as needed."""
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as e:
+                # Read on only when the value may be cut off; malformed input fails here, not at the end of the file
+                truncated = e.pos >= len(self._buf) - _TAIL or e.msg.startswith('Unterminated string')
+                if truncated and self._fill(need_more=True):
+                    continue
+                raise
+            # A number at the end of the buffer (e.g. "12." or "1e") may continue in the next chunk.
+            if not self._eof and _NUM_TAIL.match(self._buf, end) and self._fill(need_more=True):
+                continue
+            self._want = self._chunk_size
+            self._pos = end
+            return value
+
+    def _text(self):
+        """Returns the JSON text of the value at the cursor, exactly as it appears in the input."""
+        # The C scanner is the fastest way to find where the value ends; what it builds is dropped right away
+        self._peek()
+        start = self._dropped + self._pos
+        self._value()
+        text = self._buf[start - self._dropped:self._pos]
+        if '\n' in text:
+            # Only whitespace between tokens can be a line break; keep every row on one line (NDJSON)
+            text = text.replace('\r', ' ').replace('\n', ' ')
+        return text
+
+    # -- layouts -----------------------------------------------------------
+
+    def _array(self, resume=False):
+        if resume:
+            # The cursor sits right after a value: continue with the next one, if any
+            if self._expect(',]') == ']':
+                return
+        else:
+            self._expect('[')
+            if self._peek() == ']':
+                self._pos += 1
+                return
+        while True:
+            yield self._row()
+            if self._expect(',]') == ']':
+                return
+
+    def _object(self):
+        """Walks a top-level object key by key, streaming "data" when it follows "meta"."""
+        self._expect('{')
+        doc, streamed = {}, False
+        if self._peek() == '}':
+            self._pos += 1
+        else:
+            while True:
+                key = self._value()
+                self._expect(':')
+                if key == 'data' and 'meta' in doc and self._peek() == '[':
+                    self.layout, self.meta = 'socrata', doc['meta'] or {}
+                    yield from self._array()
+                    streamed = True
+                else:
+                    doc[key] = self._value()
+                if self._expect(',}') == '}':
+                    break
+        if not streamed:
+            self.layout = 'object'
+            yield json.dumps(doc) if self.raw else doc
+
+    def _ndjson(self):
+        """Decodes one line at a time; a bad line is skipped without reading past it."""
+        self.layout = 'ndjson'
+        while self._peek():
+            nl = self._buf.find('\n', self._pos)
+            while nl < 0 and self._fill():
+                nl = self._buf.find('\n', self._pos)
+            end = nl if nl >= 0 else len(self._buf)
+            line, self._pos = self._buf[self._pos:end], end
+            if self.raw:
+                # Checked like a decoded line, so one bad line can't fail a whole PARSE_JSON batch downstream
+                line = line.strip()
+                try:
+                    if line and _decoder.raw_decode(line)[1] == len(line):
+                        yield line
+                except ValueError:
+                    pass
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+    def _first_line_is_value(self):
+        """True when the first line is one complete JSON value and another value follows (NDJSON of arrays/objects)."""
+        while True:
+            nl = self._buf.find('\n', self._pos)
+            after = _WS.match(self._buf, nl).end() if nl >= 0 else -1
+            if after >= 0 and (after < len(self._buf) or self._eof):
+                break
+            # A single-line document has no newline to find: give up after a few chunks instead of reading it all
+            if len(self._buf) - self._pos >= 8 * self._chunk_size or not self._fill():
+                break
+        if nl < 0 or after >= len(self._buf):
+            return False
+        try:
+            _, end = _decoder.raw_decode(self._buf[:nl], self._pos)
+        except json.JSONDecodeError:
+            return False  # e.g. a pretty-printed document whose first line is just '['
+        return not self._buf[end:nl].strip()
+
+    def _rows(self):
+        first = self._peek()
+        if first and first in '[{' and self._first_line_is_value():
+            yield from self._ndjson()
+        elif first == '[':
+            self.layout = 'array'
+            yield from self._array()
+        elif first == '{':
+            yield from self._object()
+        else:
+            yield from self._ndjson()
+            return
+        if self._peek():
+            # More values after the first document: treat the rest as NDJSON.
+            yield from self._ndjson()
+
+
+    def _resumed(self):
+        if self.layout in ('socrata', 'array'):
+            yield from self._array(resume=True)
+        elif self.layout == 'ndjson':
+            yield from self._ndjson()
+
+
+def read_meta(source):
+    """`meta` of a Socrata rows.json, parsing only up to its first row."""
+    reader = JsonRowReader(source)
+    next(iter(reader), None)
+    return reader.meta
+
+
+def iter_json_rows(source, chunk_size=CHUNK_SIZE):
+    """Convenience wrapper: yields the rows of `source` without keeping the reader around."""
+    return iter(JsonRowReader(source, chunk_size))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+metrics.py
+
+Lightweight run instrumentation for the downloaders and loaders: span timings,
+counters (bytes, rows, retries, ...) and export as a JSON run report and a
+Prometheus textfile (for node_exporter's textfile collector).
+
+    @metrics.timed('download')                 # span per call
+    def download(...): ...
+
+    @metrics.timed_iter('parse_json_rows', counter='rows')   # time spent producing items
+    def parse_json_rows(...): ...
+
+    metrics.incr('bytes', n, stage='download')
+
+Set METRICS_REPORT=<path.json> and/or METRICS_PROM=<path.prom> to have the
+report written when the process exits; `export()` can also be called directly.
+"""
+
+import atexit, functools, json, os, threading, time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_spans = []
+_counters = {}
+_started = time.time()
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def incr(name, value=1, **labels):
+    """Adds `value` to the counter `name` with the given labels (e.g. stage='download')."""
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def record_span(name, seconds, error=None, **attrs):
+    with _lock:
+        _spans.append({'name': name, 'seconds': round(seconds, 6), 'at': round(time.time() - seconds - _started, 3),
+                       'thread': threading.current_thread().name, 'error': error, **attrs})
+
+
+@contextmanager
+def span(name, **attrs):
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record_span(name, time.perf_counter() - started, error=error, **attrs)
+
+
+def timed(name):
+    """Decorator: one span per call."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def timed_iter(name, counter='rows'):
+    """Decorator for functions returning iterables: counts items and times only the work of producing them."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            return _TimedIterator(name, counter, fn(*args, **kwargs))
+        return inner
+    return wrap
+
+
+class _TimedIterator:
+    def __init__(self, name, counter, iterable):
+        self.name, self.counter = name, counter
+        self.it = iter(iterable)
+        self.source = iterable
+        self.busy = 0.0
+        self.items = 0
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __getattr__(self, attr):
+        # Keep attributes of the wrapped iterable reachable (e.g. JsonRowReader.meta).
+        return getattr(self.source, attr)
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            item = next(self.it)
+        except StopIteration:
+            self._finish(started)
+            raise
+        except BaseException as e:
+            self._finish(started, type(e).__name__)
+            raise
+        self.busy += time.perf_counter() - started
+        self.items += 1
+        return item
+
+    def _finish(self, started, error=None):
+        if self.done:
+            return
+        self.done = True
+        self.busy += time.perf_counter() - started
+        incr(self.counter, self.items, stage=self.name)
+        record_span(self.name, self.busy, error=error, items=self.items)
+
+
+def snapshot():
+    with _lock:
+        spans = list(_spans)
+        counters = dict(_counters)
+    stages = {}
+    for s in spans:
+        st = stages.setdefault(s['name'], {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0})
+        st['count'] += 1
+        st['seconds'] = round(st['seconds'] + s['seconds'], 6)
+        st['max_seconds'] = max(st['max_seconds'], s['seconds'])
+        st['errors'] += bool(s['error'])
+    return {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_started)),
+        'wall_seconds': round(time.time() - _started, 3),
+        'stages': stages,
+        'counters': [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(counters.items())],
+        'spans': spans,
+    }
+
+
+def write_report(path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f, indent=2)
+    os.replace(tmp, path)
+
+
+def _labels(d):
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in sorted(d.items())) + '}' if d else ''
+
+
+def write_prometheus(path, prefix='elt'):
+    """Writes the run in Prometheus text exposition format (atomically, as the textfile collector expects)."""
+    snap = snapshot()
+    lines = [f'# HELP {prefix}_stage_seconds Total seconds spent per stage in the last run.',
+             f'# TYPE {prefix}_stage_seconds gauge']
+    lines += [f'{prefix}_stage_seconds{_labels({"stage": n})} {s["seconds"]}' for n, s in snap['stages'].items()]
+    lines += [f'# TYPE {prefix}_stage_calls gauge']
+    lines += [f'{prefix}_stage_calls{_labels({"stage": n})} {s["count"]}' for n, s in snap['stages'].items()]
+    lines += [f'# TYPE {prefix}_stage_errors gauge']
+    lines += [f'{prefix}_stage_errors{_labels({"stage": n})} {s["errors"]}' for n, s in snap['stages'].items()]
+    typed = set()
+    for c in snap['counters']:
+        name = f'{prefix}_{c["name"]}_total'
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name}{_labels(c["labels"])} {c["value"]}')
+    lines += [f'# TYPE {prefix}_run_wall_seconds gauge', f'{prefix}_run_wall_seconds {snap["wall_seconds"]}',
+              f'{prefix}_run_timestamp_seconds {int(time.time())}']
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+
+
+def export():
+    """Writes the outputs configured via METRICS_REPORT / METRICS_PROM (no-op when neither is set)."""
+    if os.getenv('METRICS_REPORT'):
+        write_report(os.environ['METRICS_REPORT'])
+    if os.getenv('METRICS_PROM'):
+        write_prometheus(os.environ['METRICS_PROM'])
+
+
+atexit.register(export)
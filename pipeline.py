@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+pipeline.py
+
+Small threaded pipeline: stages connected by bounded queues so download,
+parse/serialize and upload overlap instead of running back to back.
+
+Each Stage wraps a function that takes an iterator of inputs (None for the
+first stage) and yields outputs; a stage with several workers runs the function
+once per worker, all pulling from the same queue. Bounded queues give
+backpressure (a fast producer blocks until the next stage catches up). The
+first exception in any worker cancels every stage and is re-raised by `run`.
+"""
+
+import queue, threading, time
+
+_DONE = object()
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1):
+        self.name, self.fn, self.workers = name, fn, workers
+        self.items = 0
+        self.busy = 0.0  # seconds spent in fn, summed over workers; time blocked on a queue is not counted
+
+
+class Pipeline:
+    def __init__(self, stages, maxsize=8, poll=0.1):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize) for _ in stages[1:]]
+        self.cancel = threading.Event()
+        self.errors = []
+        self.poll = poll
+        self._lock = threading.Lock()
+
+    def _get(self, q, waited):
+        while True:
+            if self.cancel.is_set():
+                raise Cancelled()
+            t = time.perf_counter()
+            try:
+                item = q.get(timeout=self.poll)
+            except queue.Empty:
+                continue
+            finally:
+                waited[0] += time.perf_counter() - t
+            if item is _DONE:
+                return
+            yield item
+
+    def _put(self, q, item):
+        while True:
+            if self.cancel.is_set():
+                raise Cancelled()
+            try:
+                q.put(item, timeout=self.poll)
+                return
+            except queue.Full:
+                continue
+
+    def _worker(self, idx, remaining):
+        stage = self.stages[idx]
+        waited = [0.0]
+        inbox = self._get(self.queues[idx - 1], waited) if idx else None
+        outbox = self.queues[idx] if idx < len(self.queues) else None
+        outputs = None
+        try:
+            started = time.perf_counter()
+            outputs = stage.fn(inbox)
+            for out in outputs:
+                with self._lock:
+                    stage.items += 1
+                if outbox is not None:
+                    t = time.perf_counter()
+                    self._put(outbox, out)
+                    waited[0] += time.perf_counter() - t
+            with self._lock:
+                stage.busy += time.perf_counter() - started - waited[0]
+        except Cancelled:
+            if hasattr(outputs, 'close'):
+                outputs.close()  # run the stage's cleanup (finally blocks) now
+            return
+        except BaseException as e:
+            with self._lock:
+                self.errors.append(e)
+            self.cancel.set()
+            return
+        with self._lock:
+            remaining[idx] -= 1
+            last = remaining[idx] == 0
+        if last and outbox is not None:
+            # Tell every worker of the next stage that its input is exhausted.
+            for _ in range(self.stages[idx + 1].workers):
+                try:
+                    self._put(outbox, _DONE)
+                except Cancelled:
+                    return
+
+    def run(self):
+        """Runs all stages to completion. Returns {stage name: (items produced, seconds of work)}."""
+        remaining = [s.workers for s in self.stages]
+        threads = [threading.Thread(target=self._worker, args=(i, remaining), name=f"{s.name}-{w}", daemon=True)
+                   for i, s in enumerate(self.stages) for w in range(s.workers)]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(self.poll)
+        except KeyboardInterrupt:
+            self.cancel.set()
+            raise
+        if self.errors:
+            raise self.errors[0]
+        return {s.name: (s.items, round(s.busy, 3)) for s in self.stages}
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+projection.py
+
+Declarative field projection for JSON payloads (Spotify saved-track items).
+
+A spec has a keep-list and a drop-list of paths:
+
+    {"keep": ["added_at", "track.id", "track.name", "track.album.artists[].id"],
+     "drop": ["track.available_markets", "track.*.external_urls"]}
+
+Path segments are dict keys separated by dots; `[]` after a key walks every
+element of a list and `*` matches any key. An empty keep-list keeps everything;
+drops apply after keeps, and never remove a REQUIRED path. Items are projected
+as pages arrive, so the dropped fields never reach serialization.
+"""
+
+import json, threading
+
+# Fields the sync itself reads (watermark, artist extraction); always kept.
+REQUIRED = ['added_at', 'track.id', 'track.album.artists[].id', 'track.album.artists[].name']
+
+DEFAULT_TRACK_SPEC = {
+    'keep': [],
+    'drop': [
+        'track.available_markets',
+        'track.album.available_markets',
+        'track.album.images',
+        'track.external_urls',
+        'track.album.external_urls',
+        'track.artists[].external_urls',
+        'track.album.artists[].external_urls',
+        'track.preview_url',
+    ],
+}
+
+
+def _compile(paths):
+    """Path list -> nested dict tree; a leaf (True) selects the whole subtree. `[]` is its own node."""
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = []
+        for seg in path.split('.'):
+            if seg.endswith('[]'):
+                parts += [seg[:-2], '[]']
+            else:
+                parts.append(seg)
+        for i, seg in enumerate(parts):
+            if i == len(parts) - 1:
+                node[seg] = True
+            else:
+                child = node.get(seg)
+                if child is True:
+                    break
+                node = node.setdefault(seg, {})
+    return _spread(tree)
+
+
+def _merge(a, b):
+    """Union of two compiled trees; a leaf (True) covers anything merged into it."""
+    if a is True or b is True:
+        return True
+    out = dict(a)
+    for k, sub in b.items():
+        out[k] = _merge(out[k], sub) if k in out else sub
+    return out
+
+
+def _spread(tree):
+    """Merges each `*` subtree into its explicit sibling keys, so an explicit key never hides the wildcard."""
+    if not isinstance(tree, dict):
+        return tree
+    wild = tree.get('*')
+    return {k: _spread(_merge(sub, wild) if wild is not None and k not in ('*', '[]') else sub)
+            for k, sub in tree.items()}
+
+
+def _exempt(tree, protect):
+    """Drop tree with the `protect` paths carved out, so a drop can't remove a required field.
+
+    A protected leaf becomes False (kept as is); a dropped subtree holding protected paths
+    becomes `{'*': True, <protected children>}`, i.e. everything else in it is still dropped.
+    """
+    if protect is True:
+        return False
+    out = {'*': True} if tree is True else dict(tree)
+    for k, sub in protect.items():
+        rule = True if tree is True else tree.get(k) if k == '[]' else tree.get(k, tree.get('*'))
+        if rule:
+            out[k] = _exempt(rule, sub)
+    return out
+
+
+_NOTHING = object()
+
+
+def _keep(value, tree):
+    """Kept part of `value`, or _NOTHING when the paths in `tree` go deeper than the value does."""
+    if tree is True:
+        return value
+    if isinstance(value, list):
+        sub = tree.get('[]')
+        if sub is None:
+            return _NOTHING
+        return [v for v in (_keep(v, sub) for v in value) if v is not _NOTHING]
+    if not isinstance(value, dict):
+        return _NOTHING
+    out = {}
+    for k, v in value.items():
+        sub = tree.get(k, tree.get('*'))
+        if sub is not None:
+            v = _keep(v, sub)
+            if v is not _NOTHING:
+                out[k] = v
+    return out if out or not value else _NOTHING
+
+
+def _drop(value, tree):
+    if isinstance(value, list):
+        sub = tree.get('[]')
+        return [_drop(v, sub) for v in value] if isinstance(sub, dict) else value
+    if not isinstance(value, dict):
+        return value
+    out = {}
+    for k, v in value.items():
+        sub = tree.get(k, tree.get('*'))
+        if sub is True:
+            continue
+        out[k] = _drop(v, sub) if sub else v
+    return out
+
+
+def load_spec(path=None):
+    """Spec from a JSON file, or the default track spec when no path is given."""
+    if not path:
+        return DEFAULT_TRACK_SPEC
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class Projector:
+    """Applies a spec to items; byte counters estimate compact JSON sizes before and after.
+
+    Only every `sample`-th item is serialized to measure it (1 measures all, 0 or False none);
+    `bytes_in`/`bytes_out` scale the sampled sizes up to all items.
+    """
+
+    def __init__(self, spec=None, required=REQUIRED, measure=32):
+        spec = spec or DEFAULT_TRACK_SPEC
+        keep = list(spec.get('keep') or [])
+        self.keep = _compile(keep + list(required)) if keep else None
+        self.drop = _exempt(_compile(spec.get('drop') or []), _compile(required))
+        self.sample = int(measure)
+        self.items = self.sampled = self._in = self._out = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        out = item
+        if self.keep:
+            out = _keep(item, self.keep)
+            if out is _NOTHING:
+                out = {}
+        if self.drop:
+            out = _drop(out, self.drop)
+        with self._lock:
+            n = self.items
+            self.items += 1
+        if self.sample and n % self.sample == 0:
+            before, after = size(item), size(out)
+            with self._lock:
+                self.sampled += 1
+                self._in += before
+                self._out += after
+        return out
+
+    @property
+    def bytes_in(self):
+        return self._in * self.items // self.sampled if self.sampled else 0
+
+    @property
+    def bytes_out(self):
+        return self._out * self.items // self.sampled if self.sampled else 0
+
+    def report(self):
+        bytes_in, bytes_out = self.bytes_in, self.bytes_out
+        ratio = bytes_in / bytes_out if bytes_out else 0
+        return (f"Projection: {self.items} items, ~{bytes_in / 2**20:.2f} MB -> ~{bytes_out / 2**20:.2f} MB "
+                f"({bytes_in - bytes_out} bytes saved, {ratio:.1f}x smaller; {self.sampled} items measured)")
+
+
+def size(value):
+    return len(json.dumps(value, separators=(',', ':')).encode('utf-8'))
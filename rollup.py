@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+rollup.py
+
+Local pre-aggregation of border rows into small gold rollups.
+
+Rows are aggregated in column batches with NumPy: every dimension is
+dictionary-encoded (np.unique), the codes are combined into one group id and
+the measures are reduced with bincount / reduceat. Batch results are merged
+into a running {group key: [sum, count, min, max]} table, so memory depends on
+the number of groups, not rows.
+
+Dimensions: port (code + name), state, border, measure, month, year.
+Aggregates over VALUE: sum, count, min, max.
+
+A rollup can be saved and updated incrementally: `since='2024-01'` drops the
+saved groups for that period onwards and re-aggregates only rows from then on.
+`since` is widened to the start of the grouping's own period, so with a yearly
+grouping '2024-03' recomputes all of 2024.
+Requires numpy (pip install numpy).
+"""
+
+import json, os
+from itertools import islice
+
+from border_flat import COLUMNS, positions
+
+# dimension -> (output columns, source column, width of the date prefix for periods)
+DIMENSIONS = {
+    'port': (('PORT_CODE', 'PORT_NAME'), ('PORT_CODE', 'PORT_NAME'), None),
+    'state': (('STATE_NAME',), ('STATE_NAME',), None),
+    'border': (('BORDER_TYPE',), ('BORDER_TYPE',), None),
+    'measure': (('MEASURE',), ('MEASURE',), None),
+    'month': (('MONTH',), ('DATE_KEY',), 7),
+    'year': (('YEAR',), ('DATE_KEY',), 4),
+}
+AGGREGATES = ('sum', 'count', 'min', 'max')
+DEFAULT_GROUP_BY = ('port', 'measure', 'border', 'month')
+
+
+def _np():
+    try:
+        import numpy
+    except ModuleNotFoundError:
+        raise RuntimeError("Rollups require numpy. Install with: pip install numpy")
+    return numpy
+
+
+def parse_spec(group_by, aggs=None):
+    """'port,measure,month' / 'sum,count' -> validated tuples."""
+    dims = tuple(d.strip() for d in group_by.split(',')) if isinstance(group_by, str) else tuple(group_by)
+    aggs = tuple(a.strip() for a in aggs.split(',')) if isinstance(aggs, str) else tuple(aggs or AGGREGATES)
+    bad = [d for d in dims if d not in DIMENSIONS] + [a for a in aggs if a not in AGGREGATES]
+    if bad or not dims:
+        raise ValueError(f"Unknown rollup dimension/aggregate {bad}; dimensions: {sorted(DIMENSIONS)}, "
+                         f"aggregates: {AGGREGATES}")
+    return dims, aggs
+
+
+class Rollup:
+    def __init__(self, group_by=DEFAULT_GROUP_BY, aggs=AGGREGATES, since=None, batch_size=200_000):
+        self.group_by, self.aggs = parse_spec(group_by, aggs)
+        self.since = since
+        self.cutoff = None
+        if since:
+            width = self._period_width()
+            if width is None:
+                raise ValueError("Incremental rollups (since) need a month or year dimension")
+            # Start of the grouping's period containing `since`: with a yearly grouping '2024-03' re-aggregates
+            # all of 2024, because the saved 2024 groups are dropped as a whole
+            self.cutoff = since[:width]
+        self.batch_size = batch_size
+        self.groups = {}
+        self.counts = {'rows': 0, 'aggregated': 0, 'skipped': 0}
+        self._np = _np()
+        self._pos = None
+
+    @property
+    def name(self):
+        """Identifies the grouping, e.g. 'port,measure,border,month'."""
+        return ','.join(self.group_by)
+
+    def _period_width(self):
+        widths = [DIMENSIONS[d][2] for d in self.group_by if DIMENSIONS[d][2]]
+        return max(widths) if widths else None
+
+    # -- aggregation ---------------------------------------------------------
+
+    def _positions(self, meta):
+        if self._pos is None:
+            by_name = dict(zip((c[0] for c in COLUMNS), positions(meta)))
+            self._pos = by_name
+        return self._pos
+
+    def add(self, batch, meta=None):
+        """Aggregates one list of positional rows into the running groups."""
+        np = self._np
+        pos = self._positions(meta)
+        n = len(batch)
+        self.counts['rows'] += n
+        width = max(pos.values()) + 1
+        batch = [r for r in batch if type(r) is list and len(r) >= width]
+        dates = np.array([r[pos['DATE_KEY']] for r in batch], dtype='U10')
+        values, valid = self._values([r[pos['VALUE']] for r in batch])
+        if self.cutoff:
+            valid &= dates >= self.cutoff
+        idx = np.flatnonzero(valid)
+        self.counts['aggregated'] += len(idx)
+        self.counts['skipped'] += n - len(idx)
+        if not len(idx):
+            return
+        values = values[idx]
+
+        # Dictionary-encode every key column and combine the codes into one group id (mixed radix)
+        uniques, gid = [], np.zeros(len(idx), dtype=np.int64)
+        for dim in self.group_by:
+            _, sources, period = DIMENSIONS[dim]
+            for src in sources:
+                if period:
+                    col = dates[idx].astype(f'U{period}')
+                else:
+                    col = np.array([batch[i][pos[src]] for i in idx.tolist()], dtype=str)
+                u, codes = np.unique(col, return_inverse=True)
+                uniques.append(u)
+                gid = gid * len(u) + codes
+        groups, gid = np.unique(gid, return_inverse=True)
+
+        sums = np.bincount(gid, weights=values, minlength=len(groups))
+        cnts = np.bincount(gid, minlength=len(groups))
+        order = np.lexsort((values, gid))
+        starts = np.searchsorted(gid[order], np.arange(len(groups)))
+        mins = np.minimum.reduceat(values[order], starts)
+        maxs = np.maximum.reduceat(values[order], starts)
+
+        # Decode group ids back into key tuples and merge (groups are few; this loop is per group, not per row)
+        codes = groups.copy()
+        parts = []
+        for u in reversed(uniques):
+            parts.append(u[codes % len(u)])
+            codes //= len(u)
+        keys = list(zip(*(p.tolist() for p in reversed(parts))))
+        for key, s, c, lo, hi in zip(keys, sums.tolist(), cnts.tolist(), mins.tolist(), maxs.tolist()):
+            g = self.groups.get(key)
+            if g is None:
+                self.groups[key] = [s, c, lo, hi]
+            else:
+                g[0] += s
+                g[1] += c
+                g[2] = min(g[2], lo)
+                g[3] = max(g[3], hi)
+
+    def _values(self, raw):
+        np = self._np
+        try:
+            values = np.fromiter(map(float, raw), dtype=np.float64, count=len(raw))
+        except (TypeError, ValueError):
+            values = np.empty(len(raw))
+            for i, v in enumerate(raw):
+                try:
+                    values[i] = float(v)
+                except (TypeError, ValueError):
+                    values[i] = np.nan
+        return values, ~np.isnan(values)
+
+    def tap(self, rows):
+        """Yields `rows` unchanged while aggregating them in batches (to load raw and rollup in one pass)."""
+        batch = []
+        for r in rows:
+            batch.append(r)
+            if len(batch) >= self.batch_size:
+                self.add(batch, getattr(rows, 'meta', None))
+                batch = []
+            yield r
+        if batch:
+            self.add(batch, getattr(rows, 'meta', None))
+
+    def consume(self, rows):
+        """Aggregates every row of `rows` (e.g. a JsonRowReader); returns self."""
+        it = iter(rows)
+        while True:
+            batch = list(islice(it, self.batch_size))
+            if not batch:
+                return self
+            self.add(batch, getattr(rows, 'meta', None))
+
+    # -- output / state --------------------------------------------------------
+
+    def columns(self):
+        return [c for d in self.group_by for c in DIMENSIONS[d][0]]
+
+    def rows(self):
+        """Gold rows as dicts: the group columns plus VALUE_SUM / ROW_COUNT / VALUE_MIN / VALUE_MAX as configured."""
+        cols = self.columns()
+        out = []
+        for key in sorted(self.groups):
+            s, c, lo, hi = self.groups[key]
+            row = dict(zip(cols, key))
+            if 'sum' in self.aggs:
+                row['VALUE_SUM'] = int(s) if float(s).is_integer() else s
+            if 'count' in self.aggs:
+                row['ROW_COUNT'] = c
+            if 'min' in self.aggs:
+                row['VALUE_MIN'] = int(lo) if float(lo).is_integer() else lo
+            if 'max' in self.aggs:
+                row['VALUE_MAX'] = int(hi) if float(hi).is_integer() else hi
+            out.append(row)
+        return out
+
+    def load(self, path):
+        """Merges a saved rollup; with `since`, its groups from that period on are dropped (they are recomputed)."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return self
+        if tuple(saved['group_by']) != self.group_by:
+            raise ValueError(f"Saved rollup {path} groups by {saved['group_by']}, not {list(self.group_by)}")
+        period_at = None
+        if self.cutoff:
+            cols = self.columns()
+            period_at = cols.index('MONTH' if 'MONTH' in cols else 'YEAR')
+        for entry in saved['groups']:
+            key, agg = tuple(entry[:-4]), entry[-4:]
+            if period_at is not None and key[period_at] >= self.cutoff:
+                continue
+            self.groups[key] = agg
+        return self
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'group_by': list(self.group_by),
+                       'groups': [list(k) + v for k, v in sorted(self.groups.items())]}, f)
+        os.replace(tmp, path)
+
+    def report(self):
+        c = self.counts
+        return (f"Rollup ({self.name}): {c['aggregated']} of {c['rows']} rows aggregated into "
+                f"{len(self.groups)} groups" + (f" since {self.cutoff}" if self.cutoff else ''))
+
+
+def copy_sql(table, stage_path, grouping, pattern):
+    """COPY INTO the gold table from staged gzip NDJSON gold rows, tagged with their grouping."""
+    return f"""
+        COPY INTO {table} (GROUPING, DATA, INGESTION_TIME)
+        FROM (SELECT '{grouping}', $1, CURRENT_TIMESTAMP() FROM @{stage_path})
+        PATTERN = '{pattern}'
+        FILE_FORMAT = (TYPE = 'JSON' COMPRESSION = 'GZIP')
+        ON_ERROR = 'ABORT_STATEMENT'
+        """
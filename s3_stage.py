@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+s3_stage.py
+
+Streams records as gzip NDJSON straight into S3 objects with concurrent
+multipart uploads, so nothing is written to local disk before an external-stage
+COPY. Compressed bytes are buffered in memory only up to one part at a time per
+upload worker.
+
+The client honours S3_ENDPOINT_URL, so the same code runs against a local S3
+stand-in (e.g. `moto_server` or LocalStack) in tests.
+"""
+
+import gzip, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from bulk_load import append_report
+
+MIN_PART = 5 * 2**20  # S3 minimum for every part but the last
+
+
+def make_client(**kwargs):
+    """boto3 S3 client; S3_ENDPOINT_URL / AWS_DEFAULT_REGION point it at a local stand-in when set."""
+    import boto3
+    kwargs.setdefault('endpoint_url', os.getenv('S3_ENDPOINT_URL') or None)
+    kwargs.setdefault('region_name', os.getenv('AWS_DEFAULT_REGION', 'us-east-1'))
+    return boto3.client('s3', **kwargs)
+
+
+class MultipartWriter:
+    """Write-only binary file object that uploads what it receives as S3 multipart parts, `workers` at a time."""
+
+    def __init__(self, client, bucket, key, part_size=8 * 2**20, workers=4):
+        self.client, self.bucket, self.key = client, bucket, key
+        self.part_size = max(part_size, MIN_PART)
+        self.upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.Semaphore(workers)  # bounds the parts held in memory
+        self.buffer = bytearray()
+        self.futures = []
+        self.error = None  # first failed part, raised by the next write()
+        self.bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.buffer += data
+        self.bytes += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._submit(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _submit(self, body):
+        self.slots.acquire()
+        number = len(self.futures) + 1
+
+        def _upload():
+            try:
+                res = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                              PartNumber=number, Body=body)
+                return {'PartNumber': number, 'ETag': res['ETag']}
+            except BaseException as e:
+                self.error = self.error or e
+                raise
+            finally:
+                self.slots.release()
+        self.futures.append(self.pool.submit(_upload))
+
+    def close(self):
+        """Uploads the remainder and completes the upload (aborts it if any part failed)."""
+        try:
+            if self.buffer or not self.futures:
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+            parts = [f.result() for f in self.futures]
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                  MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self.pool.shutdown(wait=True)
+        return len(self.futures)
+
+    def abort(self):
+        """Cancels the queued parts, waits for the ones in flight, then aborts the upload (so no part outlives it)."""
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception:
+            pass
+
+
+def upload_ndjson(client, bucket, key, records, part_size=8 * 2**20, workers=4, level=6):
+    """Streams `records` (JSON-serializable) to s3://bucket/key as gzip NDJSON.
+
+    Returns {'key', 'records', 'raw_bytes', 'bytes', 'parts', 'seconds'}.
+    """
+    started = time.perf_counter()
+    out = MultipartWriter(client, bucket, key, part_size=part_size, workers=workers)
+    n = raw = 0
+    try:
+        with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=level) as gz:
+            for r in records:
+                line = json.dumps(r, separators=(',', ':')).encode('utf-8') + b'\n'
+                gz.write(line)
+                raw += len(line)
+                n += 1
+    except BaseException:
+        out.abort()
+        raise
+    parts = out.close()
+    return {'key': key, 'records': n, 'raw_bytes': raw, 'bytes': out.bytes, 'parts': parts,
+            'seconds': round(time.perf_counter() - started, 3)}
+
+
+def record_report(path, mode, sent_bytes, seconds):
+    """Appends one upload measurement and prints the latest bytes/time per mode (e.g. stage vs s3)."""
+    runs, latest = append_report(path, {'mode': mode, 'bytes': sent_bytes, 'seconds': round(seconds, 3)})
+    print('Upload report (latest run per mode):')
+    for m, run in sorted(latest.items()):
+        print(f"  {m:<6} {run['bytes'] / 2**20:>10.2f} MB  {run['seconds']:>9.2f}s")
+    if 'stage' in latest and 's3' in latest and latest['s3']['bytes']:
+        print(f"  s3 vs stage: {latest['stage']['bytes'] / latest['s3']['bytes']:.1f}x fewer bytes, "
+              f"{latest['stage']['seconds'] / (latest['s3']['seconds'] or 1e-9):.1f}x time ratio")
+    return runs
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+sf_fake.py
+
+In-process stand-in for `snowflake.connector`, used through sf_session
+(SNOWFLAKE_CONNECTOR=fake) by tests and benchmarks. It records every
+statement and answers the ones the loaders care about with result rows shaped
+like Snowflake's:
+
+  PUT    -> (source, target, source_size, target_size, ..., 'UPLOADED', '')
+  COPY   -> one row per file: (file, 'LOADED', rows_parsed, rows_loaded, ...)
+  INSERT -> rowcount = number of parameter sets
+
+No SQL is interpreted beyond that.
+"""
+
+import itertools, os, re, threading
+
+STATEMENTS = []
+_lock = threading.Lock()
+_qid = itertools.count(1)
+_put_re = re.compile(r"PUT\s+'file://([^']+)'", re.I)
+
+
+class TransientError(Exception):
+    pass
+
+
+TRANSIENT_ERRORS = (TransientError,)
+
+
+def reset():
+    with _lock:
+        STATEMENTS.clear()
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = None
+        self.sfqid = None
+        self._rows = []
+
+    def _record(self, sql, params=None, many=0):
+        self.sfqid = f"fake-{next(_qid)}"
+        with _lock:
+            STATEMENTS.append({'sql': sql, 'params': params, 'many': many, 'query_id': self.sfqid})
+
+    def execute(self, sql, params=None):
+        self._record(sql, params)
+        self._rows, self.rowcount = self.conn.server.answer(sql), None
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        seq = list(seq_of_params)
+        self._record(sql, many=len(seq))
+        self.conn.server.inserted += len(seq)
+        self._rows, self.rowcount = [], len(seq)
+        return self
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    """Shared state of all fake connections: staged files and their row counts."""
+
+    def __init__(self):
+        self.staged = {}
+        self.inserted = 0
+        self.lock = threading.Lock()
+
+    def answer(self, sql):
+        head = sql.lstrip().upper()
+        if head.startswith('PUT'):
+            m = _put_re.search(sql)
+            path = m.group(1) if m else ''
+            name = os.path.basename(path)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            with self.lock:
+                self.staged[name] = _count_rows(path)
+            return [(name, name, size, size, 'NONE', 'NONE', 'UPLOADED', '')]
+        if head.startswith('COPY'):
+            with self.lock:
+                files, self.staged = self.staged, {}
+            return [(name, 'LOADED', n, n, 1, 0, None, None, None, None) for name, n in files.items()]
+        return []
+
+
+def _count_rows(path):
+    """Rows in a staged chunk: lines for (gzip) NDJSON, 1 for anything else."""
+    if not os.path.exists(path):
+        return 0
+    if path.endswith('.gz'):
+        import gzip
+        with gzip.open(path, 'rb') as f:
+            return sum(1 for _ in f)
+    if path.endswith(('.ndjson', '.jsonl')):
+        with open(path, 'rb') as f:
+            return sum(1 for _ in f)
+    return 1
+
+
+SERVER = FakeServer()
+
+
+class FakeConnection:
+    def __init__(self, server=None, **kwargs):
+        self.server = server or SERVER
+        self.kwargs = kwargs
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def connect(**kwargs):
+    return FakeConnection(**kwargs)
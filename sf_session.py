@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+sf_session.py
+
+Shared Snowflake session layer for Snowflake_Upload.py, Spotify_To_Snowflake.py
+and combined.py.
+
+- one config reader for the SNOWFLAKE_* environment variables
+- a bounded pool of keep-alive connections, opened lazily and reused
+- transparent retry with exponential backoff on transient errors (the broken
+  connection is discarded and a fresh one is opened), for statements that are
+  safe to run twice: PUT, COPY INTO (its load history skips files already
+  loaded), queries, TRUNCATE and DDL. A plain INSERT may have committed before
+  the connection dropped, so it is not retried unless the caller says it is
+  idempotent (`retry=True`, e.g. the load-id guarded INSERT in checkpoint.py).
+- `run_parallel` to spread independent statements (PUTs, COPYs) over the pool
+- per-statement timings on `session.timings`
+
+The connector is pluggable: anything with a `connect(**kwargs)` function that
+returns DB-API style connections works. Set SNOWFLAKE_CONNECTOR=fake (or call
+`set_connector`) to use the in-process fake from sf_fake.py for tests and
+benchmarks.
+"""
+
+import importlib, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+
+CONNECTORS = {'snowflake': 'snowflake.connector', 'fake': 'sf_fake'}
+# Statement kinds that give the same result when run again after a dropped connection
+IDEMPOTENT = {'put', 'get', 'copy', 'select', 'with', 'show', 'describe', 'desc', 'list', 'ls', 'remove', 'rm',
+              'truncate', 'create', 'alter', 'drop', 'use'}
+_connector = None
+
+
+def set_connector(connector):
+    """Installs the connector module/object used by new sessions (e.g. sf_fake)."""
+    global _connector
+    _connector = connector
+
+
+def get_connector():
+    global _connector
+    if _connector is None:
+        name = os.getenv('SNOWFLAKE_CONNECTOR', 'snowflake')
+        _connector = importlib.import_module(CONNECTORS.get(name, name))
+    return _connector
+
+
+def config_from_env(**overrides):
+    """Connection kwargs from SNOWFLAKE_* env vars; explicit overrides (e.g. database/schema) win."""
+    cfg = {
+        'user': os.getenv('SNOWFLAKE_USER'),
+        'password': os.getenv('SNOWFLAKE_PASSWORD'),
+        'account': os.getenv('SNOWFLAKE_ACCOUNT'),
+        'warehouse': os.getenv('SNOWFLAKE_WAREHOUSE'),
+        'database': os.getenv('SNOWFLAKE_DATABASE'),
+        'schema': os.getenv('SNOWFLAKE_SCHEMA'),
+    }
+    cfg.update({k: v for k, v in overrides.items() if v is not None})
+    return cfg
+
+
+def _transient_errors(connector):
+    errors = getattr(connector, 'TRANSIENT_ERRORS', None)
+    if errors is None:
+        try:
+            from snowflake.connector.errors import OperationalError, InterfaceError
+            errors = (OperationalError, InterfaceError)
+        except ImportError:
+            errors = ()
+    return tuple(errors) + (ConnectionError, TimeoutError)
+
+
+def _kind(sql):
+    return (sql.split(None, 1) or ['?'])[0].lower()
+
+
+class Session:
+    def __init__(self, config=None, size=4, retries=3, backoff=1.0, connector=None):
+        self.config = dict(config or config_from_env())
+        self.config.setdefault('client_session_keep_alive', True)
+        self.size, self.retries, self.backoff = size, retries, backoff
+        self.connector = connector or get_connector()
+        self.transient = _transient_errors(self.connector)
+        self.timings = []
+        self._idle = []
+        self._opened = 0
+        self._lock = threading.Lock()
+        # Signalled whenever a connection is returned or a broken one frees a slot
+        self._available = threading.Condition(self._lock)
+        self._all = []
+
+    # -- pool --------------------------------------------------------------
+
+    def _acquire(self):
+        with self._available:
+            while not self._idle and self._opened >= self.size:
+                self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+        try:
+            conn = self.connector.connect(**self.config)
+        except Exception:
+            with self._available:
+                self._opened -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def _release(self, conn, broken=False):
+        with self._available:
+            if broken:
+                self._opened -= 1
+                if conn in self._all:
+                    self._all.remove(conn)
+            else:
+                self._idle.append(conn)
+            self._available.notify()
+        if broken:
+            try: conn.close()
+            except Exception: pass
+
+    @contextmanager
+    def connection(self):
+        """Borrows a pooled connection (for multi-statement work such as INSERT batches + commit)."""
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except self.transient:
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def close(self):
+        with self._available:
+            conns, self._all = self._all, []
+            self._opened = 0
+            self._idle.clear()
+            self._available.notify_all()
+        for conn in conns:
+            try: conn.close()
+            except Exception: pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- statements --------------------------------------------------------
+
+    def _run(self, method, sql, params, fetch, retry=None):
+        if retry is None:
+            retry = _kind(sql) in IDEMPOTENT
+        attempt = 0
+        while True:
+            conn = self._acquire()
+            started = time.perf_counter()
+            try:
+                cur = conn.cursor()
+                try:
+                    if method == 'executemany':
+                        cur.executemany(sql, params)
+                    elif params is None:
+                        cur.execute(sql)
+                    else:
+                        cur.execute(sql, params)
+                    rows = cur.fetchall() if fetch else None
+                    rowcount = getattr(cur, 'rowcount', None)
+                    query_id = getattr(cur, 'sfqid', None)
+                finally:
+                    try: cur.close()
+                    except Exception: pass
+            except self.transient as e:
+                self._release(conn, broken=True)
+                self._record(sql, started, attempt + 1, None, None, error=str(e))
+                if not retry or attempt >= self.retries:
+                    raise
+                attempt += 1
+                metrics.incr('retries', stage='snowflake')
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+                continue
+            except Exception as e:
+                self._release(conn)
+                self._record(sql, started, attempt + 1, None, None, error=str(e))
+                raise
+            self._release(conn)
+            self._record(sql, started, attempt + 1, rowcount, query_id)
+            return rows
+
+    def _record(self, sql, started, attempts, rowcount, query_id, error=None):
+        seconds = time.perf_counter() - started
+        # Per statement kind (snowflake.put, snowflake.copy, snowflake.insert, ...) in the run metrics
+        kind = _kind(sql)
+        metrics.record_span(f'snowflake.{kind}', seconds, error=error, query_id=query_id)
+        entry = {'statement': ' '.join(sql.split())[:120], 'seconds': round(seconds, 4),
+                 'attempts': attempts, 'rowcount': rowcount, 'query_id': query_id}
+        if error:
+            entry['error'] = error
+        with self._lock:
+            self.timings.append(entry)
+
+    def execute(self, sql, params=None, fetch=True, retry=None):
+        """Runs one statement on a pooled connection; returns fetchall() rows.
+
+        Transient errors are retried when `retry` is true; by default only for IDEMPOTENT statement kinds.
+        """
+        return self._run('execute', sql, params, fetch, retry)
+
+    def executemany(self, sql, seq_of_params, retry=None):
+        return self._run('executemany', sql, seq_of_params, fetch=False, retry=retry)
+
+    def run_parallel(self, statements, workers=None):
+        """Executes independent statements concurrently across pooled connections; results keep input order."""
+        statements = list(statements)
+        if not statements:
+            return []
+        with ThreadPoolExecutor(max_workers=workers or min(self.size, len(statements))) as pool:
+            return list(pool.map(self.execute, statements))
+
+    def timing_report(self):
+        total = sum(t['seconds'] for t in self.timings)
+        lines = [f"{len(self.timings)} statements, {total:.2f}s total"]
+        for t in sorted(self.timings, key=lambda t: -t['seconds'])[:10]:
+            lines.append(f"  {t['seconds']:>8.3f}s  x{t['attempts']}  {t['statement']}")
+        return '\n'.join(lines)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+spotify_api.py
+
+Rate-limit aware client for the Spotify Web API paging used by
+Spotify_To_Snowflake.py.
+
+- one pooled keep-alive requests.Session shared by all worker threads
+- a token bucket that every request draws from; a 429 pauses the bucket for
+  the server's Retry-After so all workers back off together
+- adaptive concurrency (AIMD): the number of in-flight requests is halved on a
+  429 and grows by one after a run of clean responses
+- transient failures (429/5xx/connection errors) are retried; a page that still
+  fails raises instead of being silently dropped
+"""
+
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+API = 'https://api.spotify.com/v1'
+MAX_PAGE = 50
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SpotifyAPIError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Allows `rate` requests per second with bursts up to `capacity`; can be paused until a deadline."""
+
+    def __init__(self, rate=10.0, capacity=10):
+        self.rate, self.capacity = rate, capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class AdaptiveLimit:
+    """Concurrency gate whose width shrinks multiplicatively on throttling and grows additively when clean."""
+
+    def __init__(self, initial=4, minimum=1, maximum=16, grow_after=20):
+        self.limit, self.minimum, self.maximum, self.grow_after = initial, minimum, maximum, grow_after
+        self.active = 0
+        self.clean = 0
+        self.cond = threading.Condition()
+
+    def __enter__(self):
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def throttled(self):
+        with self.cond:
+            self.limit = max(self.minimum, self.limit // 2)
+            self.clean = 0
+
+    def succeeded(self):
+        with self.cond:
+            self.clean += 1
+            if self.clean >= self.grow_after and self.limit < self.maximum:
+                self.limit += 1
+                self.clean = 0
+                self.cond.notify_all()
+
+
+class SpotifyClient:
+    def __init__(self, headers, rate=10.0, max_concurrency=16, retries=6, timeout=30):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(headers)
+        self.bucket = TokenBucket(rate=rate, capacity=max(1, int(rate)))
+        self.gate = AdaptiveLimit(maximum=max_concurrency)
+        self.retries, self.timeout = retries, timeout
+        self.stats = {'requests': 0, 'throttled': 0, 'retries': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+        metrics.incr(name, stage='spotify')
+
+    def get(self, url, params=None):
+        """GETs JSON, retrying throttled/transient failures; raises SpotifyAPIError when retries run out."""
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            with self.gate:
+                self._count('requests')
+                try:
+                    resp = self.session.get(url, params=params, timeout=self.timeout)
+                except requests.RequestException as e:
+                    resp, error = None, e
+            if resp is not None and resp.status_code == 200:
+                self.gate.succeeded()
+                return resp.json()
+            if resp is not None and resp.status_code not in RETRY_STATUSES:
+                raise SpotifyAPIError(f"GET {url} params={params} -> HTTP {resp.status_code}: {resp.text[:200]}")
+            if attempt == self.retries:
+                break
+            self._count('retries')
+            if resp is not None and resp.status_code == 429:
+                self._count('throttled')
+                self.gate.throttled()
+                retry_after = resp.headers.get('Retry-After', '')
+                self.bucket.pause(float(retry_after) if retry_after.replace('.', '', 1).isdigit() else 2 ** attempt)
+            else:
+                time.sleep(min(2 ** attempt, 30))
+        reason = f"HTTP {resp.status_code}" if resp is not None else error
+        raise SpotifyAPIError(f"GET {url} params={params} failed after {self.retries} retries: {reason}")
+
+    def fetch_pages(self, path, total, limit=MAX_PAGE, key='items', transform=None):
+        """Fetches every offset of a paged collection exactly once and returns the items in offset order.
+
+        `transform` (e.g. a projection.Projector) is applied to each item as its page arrives.
+        """
+        offsets = range(0, total, limit)
+        url = f"{API}{path}"
+        workers = self.gate.maximum
+
+        def fetch(offset):
+            items = self.get(url, params={'offset': offset, 'limit': limit}).get(key, [])
+            return offset, [transform(i) for i in items] if transform else items
+
+        pages = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for offset, items in pool.map(fetch, offsets):
+                pages[offset] = items
+        return [item for offset in offsets for item in pages[offset]]
+
+    def iter_by_ids(self, path, ids, key, batch_size=MAX_PAGE):
+        """Looks up `ids` through a multi-id endpoint (e.g. /artists?ids=) in concurrent batches.
+
+        Yields (batch ids, results aligned with them) in order; results are None for ids Spotify
+        doesn't know. A batch that still fails after retries yields its SpotifyAPIError as the
+        results instead of stopping the other batches.
+        """
+        ids = list(ids)
+        url = f"{API}{path}"
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+        def fetch(batch):
+            try:
+                return batch, self.get(url, params={'ids': ','.join(batch)}).get(key) or [None] * len(batch)
+            except SpotifyAPIError as e:
+                return batch, e
+
+        with ThreadPoolExecutor(max_workers=self.gate.maximum) as pool:
+            yield from pool.map(fetch, batches)
+
+    def fetch_by_ids(self, path, ids, key, batch_size=MAX_PAGE):
+        """List aligned with `ids` (None for unknown ids); raises the first failed batch's SpotifyAPIError."""
+        out = []
+        for _, results in self.iter_by_ids(path, ids, key, batch_size):
+            if isinstance(results, SpotifyAPIError):
+                raise results
+            out.extend(results)
+        return out
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+transform.py
+
+Incremental bronze -> silver refresh of SILVER_BORDER_FLAT, run right after a
+successful load (Snowflake_Upload.py --transform) or on demand, instead of
+REFRESH_SILVER_FLAT_TASK re-flattening all of BRONZE_BORDER on a schedule.
+
+Only new bronze rows go through the MERGE, found in one of two ways:
+  watermark  rows with INGESTION_TIME after the last refreshed one, less an
+             overlap (TRANSFORM_OVERLAP_SECONDS, default 900): a concurrent
+             load stamps its rows when it starts but commits later, possibly
+             after the high mark was read. Re-merging the overlap is a no-op
+             for rows already in silver. The high mark is read before the
+             MERGE, so rows landing during it wait for the next run. The first
+             run (or --full) covers all of bronze.
+  stream     the append-only BRONZE_BORDER_STREAM (transformations.sql). The
+             MERGE consumes it, so Snowflake keeps the offset.
+
+Every run appends one JSON line to the history file (TRANSFORM_HISTORY,
+default transform_history.jsonl) with the query id, elapsed time, bytes
+scanned and rows affected of each statement, taken from
+INFORMATION_SCHEMA.QUERY_HISTORY. The watermark of the last successful run is
+read back from the same file.
+
+Usage:
+  python transform.py                      # watermark refresh
+  python transform.py --source stream
+  python transform.py --full --dry-run     # print the MERGE without running it
+"""
+
+import argparse, json, os, sys, time
+from datetime import datetime
+
+from sf_session import Session, config_from_env
+
+SOURCES = ('watermark', 'stream')
+
+
+def configure(dotenv=False):
+    """Reads the settings below from the environment; with `dotenv`, a .env file is loaded into it first (main)."""
+    global SF_DATABASE, SF_SCHEMA, BRONZE_TABLE, BRONZE_STREAM, SILVER_TABLE, HISTORY_PATH, OVERLAP_SECONDS, REQUIRED
+    if dotenv:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+    SF_DATABASE = os.getenv('SNOWFLAKE_DATABASE')
+    SF_SCHEMA = os.getenv('SNOWFLAKE_SCHEMA')
+    BRONZE_TABLE = os.getenv('TABLE_NAME', 'BRONZE_BORDER')
+    BRONZE_STREAM = os.getenv('BRONZE_STREAM', 'BRONZE_BORDER_STREAM')
+    SILVER_TABLE = os.getenv('SILVER_TABLE', 'SILVER_BORDER_FLAT')
+    HISTORY_PATH = os.getenv('TRANSFORM_HISTORY', 'transform_history.jsonl')
+    # Should exceed the longest load: rows stamped before the last high mark but committed after it are re-scanned
+    OVERLAP_SECONDS = int(os.getenv('TRANSFORM_OVERLAP_SECONDS', '900'))
+    REQUIRED = [('SNOWFLAKE_USER', os.getenv('SNOWFLAKE_USER')), ('SNOWFLAKE_PASSWORD', os.getenv('SNOWFLAKE_PASSWORD')),
+                ('SNOWFLAKE_ACCOUNT', os.getenv('SNOWFLAKE_ACCOUNT')), ('SNOWFLAKE_DATABASE', SF_DATABASE),
+                ('SNOWFLAKE_SCHEMA', SF_SCHEMA)]
+
+
+configure()
+
+
+def check_config():
+    missing = [n for n, v in REQUIRED if not v]
+    if missing:
+        sys.exit(f"Missing env vars: {', '.join(missing)}. Add them or create a .env file.")
+
+
+def qualified(name):
+    return f"{SF_DATABASE}.{SF_SCHEMA}.{name}"
+
+
+def merge_sql(source, where=''):
+    """The REFRESH_SILVER_FLAT_TASK MERGE over the bronze rows of `source` (a table or stream) matching `where`.
+
+    If a key appears in several new bronze rows, the most recently ingested one wins.
+    """
+    return f"""
+MERGE INTO {qualified(SILVER_TABLE)} AS target
+USING (
+    SELECT
+      f.value[8]::STRING      AS PORT_NAME,
+      f.value[9]::STRING      AS STATE_NAME,
+      f.value[10]::STRING     AS PORT_CODE,
+      f.value[11]::STRING     AS BORDER_TYPE,
+      f.value[12]::DATE       AS DATE_KEY,
+      f.value[13]::STRING     AS MEASURE,
+      f.value[14]::INTEGER    AS VALUE,
+      f.value[15]::FLOAT      AS LATITUDE,
+      f.value[16]::FLOAT      AS LONGITUDE,
+      TO_GEOGRAPHY('POINT(' || f.value[16]::STRING || ' ' || f.value[15]::STRING || ')') AS LOCATION_POINT
+    FROM {source} b,
+    LATERAL FLATTEN(input => b.content:"data") f
+    WHERE f.value[10] IS NOT NULL{where}
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY PORT_CODE, MEASURE, DATE_KEY ORDER BY b.INGESTION_TIME DESC) = 1
+) AS source
+ON  target.PORT_CODE = source.PORT_CODE
+AND target.MEASURE   = source.MEASURE
+AND target.DATE_KEY  = source.DATE_KEY
+
+WHEN MATCHED AND (target.VALUE != source.VALUE OR target.PORT_NAME != source.PORT_NAME) THEN
+    UPDATE SET
+        target.VALUE = source.VALUE,
+        target.LOCATION_POINT = source.LOCATION_POINT
+
+WHEN NOT MATCHED THEN
+    INSERT (PORT_NAME, STATE_NAME, PORT_CODE, BORDER_TYPE, DATE_KEY, MEASURE, VALUE, LATITUDE, LONGITUDE, LOCATION_POINT)
+    VALUES (source.PORT_NAME, source.STATE_NAME, source.PORT_CODE, source.BORDER_TYPE, source.DATE_KEY, source.MEASURE, source.VALUE, source.LATITUDE, source.LONGITUDE, source.LOCATION_POINT)
+"""
+
+
+def watermark_filter(low, overlap=None):
+    """Extra WHERE condition for rows after the `low` watermark less `overlap` seconds and up to the high mark
+    (both bound as params)."""
+    overlap = OVERLAP_SECONDS if overlap is None else overlap
+    cond = "\n      AND b.INGESTION_TIME <= %s::TIMESTAMP_LTZ"
+    if not low:
+        return cond
+    return f"\n      AND b.INGESTION_TIME > DATEADD(second, -{int(overlap)}, %s::TIMESTAMP_LTZ)" + cond
+
+
+# -- history -----------------------------------------------------------------
+
+def last_watermark(path=None, bronze=None):
+    """High mark of the last successful watermark run on `bronze`, or None."""
+    path = path or HISTORY_PATH
+    bronze = bronze or qualified(BRONZE_TABLE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None
+    for line in reversed(lines):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if entry.get('source') == 'watermark' and entry.get('bronze') == bronze and entry.get('status') in ('ok', 'skipped'):
+            return entry.get('watermark', {}).get('high') or None
+    return None
+
+
+def append_history(path, entry):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, default=str) + '\n')
+
+
+def profile(session, statements):
+    """Adds bytes scanned, server elapsed time and rows affected from INFORMATION_SCHEMA.QUERY_HISTORY."""
+    ids = [s['query_id'] for s in statements if s.get('query_id')]
+    if not ids:
+        return
+    try:
+        rows = session.execute(
+            "SELECT QUERY_ID, TOTAL_ELAPSED_TIME, BYTES_SCANNED, ROWS_INSERTED, ROWS_UPDATED, ROWS_DELETED, ROWS_PRODUCED "
+            "FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY(RESULT_LIMIT => 1000)) "
+            f"WHERE QUERY_ID IN ({', '.join(['%s'] * len(ids))})", ids)
+    except Exception as e:
+        print(f"Query profile unavailable: {e}")
+        return
+    by_id = {r[0]: r for r in rows}
+    for s in statements:
+        r = by_id.get(s.get('query_id'))
+        if r is None:
+            continue
+        _, elapsed_ms, scanned, inserted, updated, deleted, produced = r
+        s.update(elapsed_ms=elapsed_ms, bytes_scanned=scanned)
+        if s['kind'] == 'merge':
+            s['rows_affected'] = (inserted or 0) + (updated or 0) + (deleted or 0)
+        elif s.get('rows_affected') is None:
+            s['rows_affected'] = produced
+
+
+# -- runner ------------------------------------------------------------------
+
+def run(source='watermark', full=False, history=None, session=None):
+    """Runs one incremental refresh and appends it to `history` (default HISTORY_PATH). Returns the history entry.
+
+    Raises after recording the failed run when a statement fails.
+    """
+    history = history or HISTORY_PATH
+    if source not in SOURCES:
+        raise ValueError(f"Unknown transform source {source!r}; expected one of {SOURCES}")
+    bronze = qualified(BRONZE_TABLE)
+    entry = {'run_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'source': source, 'bronze': bronze,
+             'silver': qualified(SILVER_TABLE), 'status': 'ok', 'statements': []}
+    own = session is None
+    session = session or Session(config_from_env(), size=1)
+    started = time.perf_counter()
+
+    def execute(kind, sql, params=None):
+        recorded = len(session.timings)
+        try:
+            return session.execute(sql, params)
+        finally:
+            for t in session.timings[recorded:]:
+                stmt = {'kind': kind, 'query_id': t['query_id'], 'seconds': t['seconds'], 'rows_affected': t['rowcount']}
+                if 'error' in t:
+                    stmt['error'] = t['error']
+                entry['statements'].append(stmt)
+
+    try:
+        if source == 'stream':
+            stream = qualified(BRONZE_STREAM)
+            has_data = execute('check', f"SELECT SYSTEM$STREAM_HAS_DATA('{stream}')")
+            if not (has_data and has_data[0][0]):
+                entry['status'] = 'skipped'
+            else:
+                result = execute('merge', merge_sql(stream))
+        else:
+            low = None if full else last_watermark(history, bronze)
+            high = execute('watermark', f"SELECT MAX(INGESTION_TIME) FROM {bronze}")
+            high = high[0][0] if high else None
+            if hasattr(high, 'isoformat'):
+                high = high.isoformat()
+            entry['watermark'] = {'low': low, 'high': high, 'overlap_seconds': OVERLAP_SECONDS if low else 0}
+            if high is None or (low is not None and datetime.fromisoformat(high) <= datetime.fromisoformat(low)):
+                entry['status'] = 'skipped'
+                entry['watermark']['high'] = low
+            else:
+                result = execute('merge', merge_sql(bronze, watermark_filter(low)), ([low] if low else []) + [high])
+        if entry['status'] == 'ok':
+            merge = entry['statements'][-1]
+            if result and merge['kind'] == 'merge':
+                # MERGE returns one row: rows inserted, rows updated (and deleted, when there is a DELETE clause)
+                merge['rows_affected'] = sum(v or 0 for v in result[0])
+        profile(session, entry['statements'])
+    except Exception as e:
+        entry.update(status='error', error=str(e))
+        raise
+    finally:
+        entry['seconds'] = round(time.perf_counter() - started, 4)
+        append_history(history, entry)
+        if own:
+            session.close()
+    return entry
+
+
+def report(entry):
+    if entry['status'] == 'skipped':
+        return f"Transform ({entry['source']}): no new bronze rows since the last refresh"
+    merge = next((s for s in entry['statements'] if s['kind'] == 'merge'), {})
+    scanned = merge.get('bytes_scanned')
+    return (f"Transform ({entry['source']}): MERGE into {entry['silver']} affected {merge.get('rows_affected')} rows "
+            f"in {merge.get('seconds', 0):.2f}s" + (f", scanned {scanned / 2**20:.1f} MB" if scanned else '')
+            + f" (query {merge.get('query_id')})")
+
+
+def main(argv=None):
+    configure(dotenv=True)
+    p = argparse.ArgumentParser(prog='transform', description='Incremental bronze -> silver MERGE (SILVER_BORDER_FLAT) with a query history')
+    p.add_argument('--source', choices=SOURCES, default='watermark', help='watermark: bronze rows with a newer INGESTION_TIME; stream: the append-only stream on bronze')
+    p.add_argument('--full', action='store_true', help='Watermark source: MERGE all of bronze (ignore the saved watermark)')
+    p.add_argument('--history', default=HISTORY_PATH, help='JSON lines file with one entry per run (and the watermark)')
+    p.add_argument('--dry-run', action='store_true', help='Print the MERGE and the watermark it would start from, then exit')
+    args = p.parse_args(argv)
+    check_config()
+    if args.dry_run:
+        if args.source == 'stream':
+            print(merge_sql(qualified(BRONZE_STREAM)))
+        else:
+            low = None if args.full else last_watermark(args.history)
+            print(f"-- watermark: after {f'{low} less {OVERLAP_SECONDS}s' if low else '(none: all of bronze)'}")
+            print(merge_sql(qualified(BRONZE_TABLE), watermark_filter(low)))
+        return 0
+    try:
+        entry = run(args.source, full=args.full, history=args.history)
+    except Exception as e:
+        sys.exit(f"Transform failed (recorded in {args.history}): {e}")
+    print(report(entry))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,6 +28,8 @@ SHOW_INITIAL_ROWS = FALSE; -- Set to FALSE because we just loaded it
 
 
 -- Create a task to refresh the SILVER_BORDER_FLAT table from the BRONZE_BORDER table every 15 minutes
+-- (transform.py runs the same MERGE right after a load, limited to new bronze rows; with it in use,
+-- ALTER TASK ELT_PROJECT.GOVDATA.REFRESH_SILVER_FLAT_TASK SUSPEND;)
 CREATE OR REPLACE TASK ELT_PROJECT.GOVDATA.REFRESH_SILVER_FLAT_TASK
     WAREHOUSE = COMPUTE_WH
     SCHEDULE = '11000 MINUTE'
@@ -63,4 +65,151 @@ WHEN MATCHED AND (target.VALUE != source.VALUE OR target.PORT_NAME != source.POR
 -- Insert everything including geography
 WHEN NOT MATCHED THEN
     INSERT (PORT_NAME, STATE_NAME, PORT_CODE, BORDER_TYPE, DATE_KEY, MEASURE, VALUE, LATITUDE, LONGITUDE, LOCATION_POINT)
-    VALUES (source.PORT_NAME, source.STATE_NAME, source.PORT_CODE, source.BORDER_TYPE, source.DATE_KEY, source.MEASURE, source.VALUE, source.LATITUDE, source.LONGITUDE, source.LOCATION_POINT);
\ No newline at end of file
+    VALUES (source.PORT_NAME, source.STATE_NAME, source.PORT_CODE, source.BORDER_TYPE, source.DATE_KEY, source.MEASURE, source.VALUE, source.LATITUDE, source.LONGITUDE, source.LOCATION_POINT);
+
+
+
+-- Delta loads (Snowflake_Upload.py with LOAD_MODE=delta)
+-- One append-only bronze row per changed source row; OP is I(nsert), U(pdate) or D(elete).
+-- For D rows CONTENT holds just the natural key: [port_code, measure, date].
+CREATE TABLE IF NOT EXISTS ELT_PROJECT.GOVDATA.BRONZE_BORDER_ROWS (
+    CONTENT             VARIANT,
+    OP                  VARCHAR(1),
+    SOURCE_FILE         VARCHAR,
+    INGESTION_TIME      TIMESTAMP_LTZ
+);
+
+CREATE OR REPLACE STREAM ELT_PROJECT.GOVDATA.BRONZE_BORDER_ROWS_STREAM
+ON TABLE ELT_PROJECT.GOVDATA.BRONZE_BORDER_ROWS
+APPEND_ONLY = TRUE;
+
+
+-- Applies only the appended change records (the stream advances when the MERGE commits)
+CREATE OR REPLACE TASK ELT_PROJECT.GOVDATA.APPLY_BORDER_DELTA_TASK
+    WAREHOUSE = COMPUTE_WH
+    SCHEDULE = '60 MINUTE'
+WHEN SYSTEM$STREAM_HAS_DATA('ELT_PROJECT.GOVDATA.BRONZE_BORDER_ROWS_STREAM')
+AS
+MERGE INTO ELT_PROJECT.GOVDATA.SILVER_BORDER_FLAT AS target
+USING (
+    SELECT
+      b.OP,
+      IFF(b.OP = 'D', NULL, b.content[8]::STRING)     AS PORT_NAME,
+      IFF(b.OP = 'D', NULL, b.content[9]::STRING)     AS STATE_NAME,
+      IFF(b.OP = 'D', b.content[0], b.content[10])::STRING  AS PORT_CODE,
+      IFF(b.OP = 'D', NULL, b.content[11]::STRING)    AS BORDER_TYPE,
+      IFF(b.OP = 'D', b.content[2], b.content[12])::DATE    AS DATE_KEY,
+      IFF(b.OP = 'D', b.content[1], b.content[13])::STRING  AS MEASURE,
+      IFF(b.OP = 'D', NULL, b.content[14]::INTEGER)   AS VALUE,
+      IFF(b.OP = 'D', NULL, b.content[15]::FLOAT)     AS LATITUDE,
+      IFF(b.OP = 'D', NULL, b.content[16]::FLOAT)     AS LONGITUDE,
+      IFF(b.OP = 'D', NULL, TO_GEOGRAPHY('POINT(' || b.content[16]::STRING || ' ' || b.content[15]::STRING || ')')) AS LOCATION_POINT
+    FROM ELT_PROJECT.GOVDATA.BRONZE_BORDER_ROWS_STREAM b
+    -- Latest change per key wins if a key changed in several runs since the last MERGE
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY PORT_CODE, MEASURE, DATE_KEY ORDER BY b.INGESTION_TIME DESC) = 1
+) AS source
+ON  target.PORT_CODE = source.PORT_CODE
+AND target.MEASURE   = source.MEASURE
+AND target.DATE_KEY  = source.DATE_KEY
+
+WHEN MATCHED AND source.OP = 'D' THEN
+    DELETE
+
+WHEN MATCHED THEN
+    UPDATE SET
+        target.PORT_NAME = source.PORT_NAME,
+        target.STATE_NAME = source.STATE_NAME,
+        target.BORDER_TYPE = source.BORDER_TYPE,
+        target.VALUE = source.VALUE,
+        target.LATITUDE = source.LATITUDE,
+        target.LONGITUDE = source.LONGITUDE,
+        target.LOCATION_POINT = source.LOCATION_POINT
+
+WHEN NOT MATCHED AND source.OP != 'D' THEN
+    INSERT (PORT_NAME, STATE_NAME, PORT_CODE, BORDER_TYPE, DATE_KEY, MEASURE, VALUE, LATITUDE, LONGITUDE, LOCATION_POINT)
+    VALUES (source.PORT_NAME, source.STATE_NAME, source.PORT_CODE, source.BORDER_TYPE, source.DATE_KEY, source.MEASURE, source.VALUE, source.LATITUDE, source.LONGITUDE, source.LOCATION_POINT);
+
+
+
+-- Typed loads (Snowflake_Upload.py with LOAD_MODE=flat)
+-- Rows arrive already flattened and cast client-side (border_flat.py), one row per source row,
+-- so the refresh below is a plain MERGE with no LATERAL FLATTEN or positional casts.
+CREATE TABLE IF NOT EXISTS ELT_PROJECT.GOVDATA.BRONZE_BORDER_TYPED (
+    PORT_NAME           VARCHAR,
+    STATE_NAME          VARCHAR,
+    PORT_CODE           VARCHAR,
+    BORDER_TYPE         VARCHAR,
+    DATE_KEY            DATE,
+    MEASURE             VARCHAR,
+    VALUE               INTEGER,
+    LATITUDE            FLOAT,
+    LONGITUDE           FLOAT,
+    LOCATION_POINT      VARCHAR,  -- WKT, converted with TO_GEOGRAPHY in the MERGE
+    SOURCE_FILE         VARCHAR,
+    INGESTION_TIME      TIMESTAMP_LTZ
+);
+
+
+CREATE OR REPLACE TASK ELT_PROJECT.GOVDATA.REFRESH_SILVER_FROM_TYPED_TASK
+    WAREHOUSE = COMPUTE_WH
+    SCHEDULE = '11000 MINUTE'
+AS
+MERGE INTO ELT_PROJECT.GOVDATA.SILVER_BORDER_FLAT AS target
+USING (
+    SELECT
+      PORT_NAME, STATE_NAME, PORT_CODE, BORDER_TYPE, DATE_KEY, MEASURE, VALUE, LATITUDE, LONGITUDE,
+      TO_GEOGRAPHY(LOCATION_POINT) AS LOCATION_POINT
+    FROM ELT_PROJECT.GOVDATA.BRONZE_BORDER_TYPED
+) AS source
+ON  target.PORT_CODE = source.PORT_CODE
+AND target.MEASURE   = source.MEASURE
+AND target.DATE_KEY  = source.DATE_KEY
+
+WHEN MATCHED AND (target.VALUE != source.VALUE OR target.PORT_NAME != source.PORT_NAME) THEN
+    UPDATE SET
+        target.VALUE = source.VALUE,
+        target.LOCATION_POINT = source.LOCATION_POINT
+
+WHEN NOT MATCHED THEN
+    INSERT (PORT_NAME, STATE_NAME, PORT_CODE, BORDER_TYPE, DATE_KEY, MEASURE, VALUE, LATITUDE, LONGITUDE, LOCATION_POINT)
+    VALUES (source.PORT_NAME, source.STATE_NAME, source.PORT_CODE, source.BORDER_TYPE, source.DATE_KEY, source.MEASURE, source.VALUE, source.LATITUDE, source.LONGITUDE, source.LOCATION_POINT);
+
+
+
+-- Gold rollups (combined.py --rollup / --rollup-only)
+-- Aggregated locally (rollup.py); each run replaces the rows of its GROUPING (e.g. 'port,measure,border,month').
+-- DATA holds the group columns plus VALUE_SUM, ROW_COUNT, VALUE_MIN, VALUE_MAX.
+CREATE TABLE IF NOT EXISTS ELT_PROJECT.GOVDATA.GOLD_BORDER_ROLLUP (
+    GROUPING            VARCHAR,
+    DATA                VARIANT,
+    INGESTION_TIME      TIMESTAMP_LTZ
+);
+
+CREATE OR REPLACE VIEW ELT_PROJECT.GOVDATA.GOLD_BORDER_MONTHLY AS
+SELECT
+    DATA:PORT_CODE::STRING                 AS PORT_CODE,
+    DATA:PORT_NAME::STRING                 AS PORT_NAME,
+    DATA:MEASURE::STRING                   AS MEASURE,
+    DATA:BORDER_TYPE::STRING               AS BORDER_TYPE,
+    TO_DATE(DATA:MONTH::STRING, 'YYYY-MM') AS MONTH,
+    DATA:VALUE_SUM::NUMBER                 AS VALUE_SUM,
+    DATA:ROW_COUNT::INTEGER                AS ROW_COUNT,
+    DATA:VALUE_MIN::NUMBER                 AS VALUE_MIN,
+    DATA:VALUE_MAX::NUMBER                 AS VALUE_MAX
+FROM ELT_PROJECT.GOVDATA.GOLD_BORDER_ROLLUP
+WHERE GROUPING = 'port,measure,border,month';
+
+
+
+-- Checkpointed insert loads (combined.py --mode insert)
+-- Every INSERT batch is tagged with a load id and skipped if that id is already present,
+-- so a batch retried after a crash is not loaded twice (see checkpoint.py).
+ALTER TABLE ELT_PROJECT.GOVDATA.BRONZE_BORDER ADD COLUMN IF NOT EXISTS LOAD_ID VARCHAR;
+
+
+
+-- Incremental silver refresh (transform.py --source stream)
+-- Holds the bronze rows appended since the last MERGE; the MERGE consumes it.
+CREATE STREAM IF NOT EXISTS ELT_PROJECT.GOVDATA.BRONZE_BORDER_STREAM
+ON TABLE ELT_PROJECT.GOVDATA.BRONZE_BORDER
+APPEND_ONLY = TRUE;
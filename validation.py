@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+validation.py
+
+Local validation and quarantine of border rows before they are staged.
+
+Rows are checked in column batches with NumPy (vectorized over fixed-width
+string views, no per-row Python for the common case):
+
+  row_malformed    not a positional list, or too short for the column layout
+  port_code_null   missing/empty port code (what the MERGE's IS NOT NULL filter dropped)
+  date_invalid     date is not a valid YYYY-MM-DD calendar date
+  value_not_int    value is not an integer
+  latlon_range     latitude/longitude not numeric or outside [-90, 90] / [-180, 180]
+  duplicate_key    (port_code, measure, date) already seen earlier in the file
+                   (exact keys kept in a set across batches, about 100 bytes per row)
+
+Columns are pulled out of a batch with map(itemgetter) (a C loop). A batch whose
+keys are all new is added to `seen` with one set union; only a batch holding
+duplicates is walked row by row.
+
+Failing rows are written to a gzip NDJSON quarantine file as
+{"row": [...], "reasons": [...]}; counts per rule are kept on `.counts`.
+Requires numpy (pip install numpy).
+"""
+
+import gzip, json
+from itertools import compress, islice
+from operator import itemgetter
+
+import metrics
+from border_flat import COLUMNS, positions
+
+RULES = ('row_malformed', 'port_code_null', 'date_invalid', 'value_not_int', 'latlon_range', 'duplicate_key')
+# Columns checked, by border_flat.COLUMNS name
+CHECKED = ('PORT_CODE', 'MEASURE', 'DATE_KEY', 'VALUE', 'LATITUDE', 'LONGITUDE')
+_DAYS = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+_SEP = '\x1f'
+
+
+def _np():
+    try:
+        import numpy
+    except ModuleNotFoundError:
+        raise RuntimeError("Row validation requires numpy. Install with: pip install numpy")
+    return numpy
+
+
+def _codes(np, values, width):
+    """(n, width) uint32 code points of the values as fixed-width strings (None -> 'None', padding -> 0)."""
+    arr = np.asarray(values, dtype=f'U{width}')
+    return arr.view(np.uint32).reshape(len(arr), width)
+
+
+def _digits(np, m):
+    return (m >= 48) & (m <= 57)
+
+
+def check_dates(np, values):
+    """True where the value starts with a valid calendar date YYYY-MM-DD."""
+    m = _codes(np, values, 10)
+    d = _digits(np, m)
+    ok = d[:, [0, 1, 2, 3, 5, 6, 8, 9]].all(axis=1) & (m[:, 4] == 45) & (m[:, 7] == 45)
+    n = (m.astype(np.int64) - 48)
+    year = n[:, 0] * 1000 + n[:, 1] * 100 + n[:, 2] * 10 + n[:, 3]
+    month = n[:, 5] * 10 + n[:, 6]
+    day = n[:, 8] * 10 + n[:, 9]
+    ok &= (month >= 1) & (month <= 12)
+    month = np.where(ok, month, 1)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    max_day = np.array(_DAYS)[month] - ((month == 2) & ~leap)
+    return ok & (day >= 1) & (day <= max_day)
+
+
+def check_ints(np, values, width=20):
+    """True where the value is an integer (optionally negative) of fewer than `width` characters."""
+    m = _codes(np, values, width)
+    d = _digits(np, m)
+    pad = m == 0
+    sign = np.zeros_like(d)
+    sign[:, 0] = m[:, 0] == 45
+    return (d | pad | sign).all(axis=1) & d.any(axis=1) & pad[:, -1]
+
+
+def _key(parts):
+    """Exact set key of (port, measure, date): the parts joined by _SEP, or _SEP + repr() when joining is ambiguous."""
+    if all(type(v) is str and _SEP not in v for v in parts):
+        return _SEP.join(parts)
+    return _SEP + repr(parts)
+
+
+def check_coords(np, lat, lon):
+    """True where lat/lon are missing (left to the warehouse) or numeric and in range."""
+    def floats(values):
+        try:
+            # Fast path: every value parses (float() in C via map, no per-row bytecode)
+            return np.fromiter(map(float, values), dtype=np.float64, count=len(values)), np.zeros(len(values), bool)
+        except (TypeError, ValueError):
+            pass
+        out, missing = np.empty(len(values)), np.zeros(len(values), bool)
+        for i, v in enumerate(values):
+            if v is None or v == '':
+                out[i], missing[i] = np.nan, True
+                continue
+            try:
+                out[i] = float(v)
+            except (TypeError, ValueError):
+                out[i] = np.inf
+        return out, missing
+    la, lat_missing = floats(lat)
+    lo, lon_missing = floats(lon)
+    missing = lat_missing & lon_missing
+    return missing | ((np.abs(la) <= 90) & (np.abs(lo) <= 180))
+
+
+class Validator:
+    """Iterates the valid rows of `rows` (e.g. a JsonRowReader) and quarantines the rest.
+
+    `.meta` is passed through from the source so downstream stages can still resolve positions.
+    `append=True` adds to an existing quarantine file (a resumed load).
+    """
+
+    def __init__(self, rows, quarantine_path=None, batch_size=100_000, meta=None, append=False):
+        self.source = rows
+        self.quarantine_path = quarantine_path
+        self.append = append
+        self.batch_size = batch_size
+        self._meta = meta
+        self.counts = dict.fromkeys(('rows', 'passed', 'quarantined') + RULES, 0)
+        self._np = _np()
+        self.seen = set()
+        self._pos = None
+        self._out = None
+        self._recorded = False
+
+    @property
+    def meta(self):
+        return self._meta if self._meta is not None else getattr(self.source, 'meta', None)
+
+    def __iter__(self):
+        it = iter(self.source)
+        try:
+            while True:
+                batch = list(islice(it, self.batch_size))
+                if not batch:
+                    break
+                yield from self.check(batch)
+        finally:
+            self.close()
+
+    def _positions(self):
+        if self._pos is None:
+            by_name = dict(zip((c[0] for c in COLUMNS), positions(self.meta)))
+            self._pos = [by_name[c] for c in CHECKED]
+        return self._pos
+
+    def check(self, batch):
+        """Returns the valid rows of one batch; failures go to quarantine and the per-rule counts."""
+        np = self._np
+        pos = self._positions()
+        width = max(pos) + 1
+        n = len(batch)
+        self.counts['rows'] += n
+        if set(map(type, batch)) != {list} or min(map(len, batch)) < width:
+            shaped = [r for r in batch if type(r) is list and len(r) >= width]
+            for r in batch:
+                if not (type(r) is list and len(r) >= width):
+                    self._reject(r, ['row_malformed'])
+            batch = shaped
+            n = len(batch)
+        if not n:
+            return []
+
+        # map(itemgetter) runs in C; it beats both a list comprehension and np.fromiter(dtype=object)
+        port, measure, date, value, lat, lon = (list(map(itemgetter(p), batch)) for p in pos)
+        if None in port or '' in port:
+            pc = np.array(port, dtype=object)
+            port_ok = ~((pc == None) | (pc == ''))  # noqa: E711 (elementwise)
+        else:
+            port_ok = np.ones(n, dtype=bool)
+        masks = {
+            'port_code_null': port_ok,
+            'date_invalid': check_dates(np, date),
+            'value_not_int': check_ints(np, value),
+            'latlon_range': check_coords(np, lat, lon),
+        }
+        ok = np.logical_and.reduce(list(masks.values()))
+        dup = self._duplicates((port, measure, date), ok)
+        ok &= ~dup
+        if ok.all():
+            self.counts['passed'] += n
+            return batch
+
+        masks['duplicate_key'] = ~dup
+        # Every failed rule as one bit per row; rejected rows are looked up by their bit pattern
+        failed = np.zeros(n, dtype=np.int64)
+        for bit, (rule, m) in enumerate(masks.items()):
+            self.counts[rule] += int(n - m.sum())
+            failed |= (~m).astype(np.int64) << bit
+        rules = list(masks)
+        reasons = {code: [r for bit, r in enumerate(rules) if code >> bit & 1] for code in np.unique(failed).tolist()}
+        bad = np.flatnonzero(~ok).tolist()
+        self._quarantine([batch[i] for i in bad], [reasons[code] for code in failed[bad].tolist()])
+        keep = ok.tolist()
+        self.counts['passed'] += sum(keep)
+        return list(compress(batch, keep))
+
+    def _duplicates(self, cols, ok):
+        """Marks valid rows whose exact key (one value from each of `cols`) was seen earlier in this batch or before."""
+        np = self._np
+        if not ok.all():
+            keep = ok.tolist()
+            cols = [list(compress(c, keep)) for c in cols]
+        try:
+            # Joining is unambiguous when every part is a string free of _SEP (checked per column, in C)
+            plain = not any(_SEP in ''.join(c) for c in cols)
+        except TypeError:  # a non-string part
+            plain = False
+        keys = list(map(_SEP.join if plain else _key, zip(*cols)))
+        dup = np.zeros(len(ok), dtype=bool)
+        fresh = set(keys)
+        if len(fresh) == len(keys) and self.seen.isdisjoint(fresh):
+            self.seen |= fresh
+            return dup
+        seen, repeated = self.seen, []
+        for i, key in zip(np.flatnonzero(ok).tolist(), keys):
+            if key in seen:
+                repeated.append(i)
+            else:
+                seen.add(key)
+        dup[repeated] = True
+        return dup
+
+    def _reject(self, row, reasons):
+        for rule in reasons:
+            self.counts[rule] += 1
+        self._quarantine([row], [reasons])
+
+    def _quarantine(self, rows, reasons):
+        """Writes failed rows with their reasons (rule counts are kept by the caller)."""
+        self.counts['quarantined'] += len(rows)
+        if self.quarantine_path and rows:
+            if self._out is None:
+                # Level 1: the quarantine is a diagnostic file, and gzip's default level 9 cost more than the checks
+                self._out = gzip.open(self.quarantine_path, 'at' if self.append else 'wt', encoding='utf-8',
+                                      compresslevel=1)
+            dumps = json.JSONEncoder(separators=(',', ':'), default=str).encode
+            self._out.write(''.join(dumps({'row': row, 'reasons': why}) + '\n' for row, why in zip(rows, reasons)))
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        if not self._recorded:
+            self._recorded = True
+            for rule in RULES:
+                if self.counts[rule]:
+                    metrics.incr('quarantined', self.counts[rule], rule=rule)
+
+    def report(self):
+        c = self.counts
+        rules = ', '.join(f"{r}={c[r]}" for r in RULES if c[r])
+        where = f" -> {self.quarantine_path}" if self.quarantine_path and c['quarantined'] else ''
+        return f"Validation: {c['passed']}/{c['rows']} rows passed, {c['quarantined']} quarantined{where}" + \
+            (f" ({rules})" if rules else '')